@@ -11,6 +11,8 @@ from utils.format_quiz_context import format_quiz_context
 # Load survey URLs from environment
 PRE_QUIZ_SURVEY_URL = os.getenv("PRE_QUIZ_SURVEY_URL", "")
 POST_QUIZ_SURVEY_URL = os.getenv("POST_QUIZ_SURVEY_URL", "")
+# How often the extraction status fragment polls while a quiz PDF is being extracted
+EXTRACTION_POLL_SECONDS = float(os.getenv("EXTRACTION_POLL_SECONDS", "1.5"))
 
 # Set page configuration (must be the first Streamlit command)
 st.set_page_config(page_title="GenAI ITS", layout="wide", initial_sidebar_state="collapsed")
@@ -34,7 +36,14 @@ sys.path.extend(
 
 from document_loader import load_and_embed_pdf
 from quiz_extractor import extract_questions_from_pdf
-from quiz_agent import QuizAgent
+from quiz_agent import QuizAgent, get_session_agent, drop_session_agent
+from kb_content_cache import get_kb_snapshot, kb_content_cache
+
+# Optionally load the embedding model at start-up (once per process) so the
+# first student answer does not pay for reading models/mxbai.
+if os.getenv("WARM_EMBEDDINGS", "0").lower() in ("1", "true", "yes"):
+    from embedding_service import warm_up
+    warm_up(background=True)
 
 # Compatibility helper: some Streamlit versions expose experimental_rerun, others only have rerun
 def safe_rerun():
@@ -77,6 +86,12 @@ def save_quiz_to_firestore(subject, week, questions):
         "week": week,
         "questions": questions
     })
+    # Precompute per-question KB retrieval (and refresh the index) in the background
+    try:
+        from kb_build_queue import schedule_kb_build
+        schedule_kb_build(subject, week)
+    except Exception as e:
+        st.warning(f"Could not schedule knowledgebase retrieval precompute: {e}")
 
 def load_quiz_from_firestore(subject, week):
     doc_id = f"{subject}_{week}"
@@ -114,32 +129,48 @@ def save_knowledgebase_to_firestore(subject, week, knowledgebase):
         "week": week,
         "knowledgebase": normalized
     })
+    kb_content_cache.invalidate(subject, week)
+    # Rebuild the retrieval index in the background; students keep using the
+    # previous index version until the new one is published.
+    try:
+        from kb_build_queue import schedule_kb_build
+        schedule_kb_build(subject, week)
+    except Exception as e:
+        st.warning(f"Could not schedule knowledgebase index build: {e}")
 
 # Function to load knowledgebase from Firebase
 
-def load_knowledgebase_from_firestore(subject, week):
-    doc_id = f"{subject}_{week}_kb"
-    doc = db.collection("knowledgebase").document(doc_id).get()
-    if doc.exists:
-        kb = doc.to_dict().get("knowledgebase", [])
-        # Normalize returned KB into list of dicts with cleaned names
-        normalized = []
-        for it in (kb or []):
-            if isinstance(it, dict):
-                name = (it.get('name') or '').replace('\n', ' ').strip()
-                normalized.append({
-                    'name': name,
-                    'type': it.get('type', 'unknown'),
-                    'content': it.get('content'),
-                    'url': it.get('url'),
-                    'uploaded_at': it.get('uploaded_at'),
-                    'uploader': it.get('uploader')
-                })
-            else:
-                name = str(it).replace('\n', ' ').strip()
-                normalized.append({'name': name, 'type': 'unknown', 'content': None, 'url': None})
-        return normalized
-    return []
+def load_knowledgebase_from_firestore(subject, week, max_age=None):
+    # Normalized entries from the shared KB cache (same doc the quiz agent reads);
+    # max_age=0 revalidates against Firestore, e.g. before a read-modify-write
+    snap = get_kb_snapshot(db, subject, week, max_age=max_age)
+    return [dict(it) for it in snap.entries] if snap is not None else []
+
+@st.fragment(run_every=EXTRACTION_POLL_SECONDS)
+def extraction_status():
+    # Polls the background extraction job (only this fragment reruns); the
+    # whole page reruns only when new questions are ready or the job ends,
+    # so edits in progress are not interrupted every poll
+    job = st.session_state.get('extraction_job')
+    if job is not None:
+        ready, messages = job.snapshot()
+        grew = len(ready) != len(st.session_state.get('uploaded_questions', []))
+        st.session_state.uploaded_questions = ready
+        st.session_state.extraction_messages = messages
+        if job.error is not None:
+            st.error(f"Error processing PDF: {job.error}")
+        if job.done:
+            st.session_state.extraction_job = None
+            st.rerun()
+        total = job.total
+        st.progress(len(ready) / total if total else 0.0,
+                    text=(f"Enriching contexts and generating rubrics: {len(ready)}/{total} ready"
+                          if total else "Extracting questions from PDF (Pass 1)..."))
+        if grew:
+            st.rerun()
+    # Extraction log, incl. the Pass-2 token savings once the job is done
+    for level, msg in st.session_state.get('extraction_messages', []):
+        getattr(st, level)(msg)
 
 # ── Streamlit layout ──────────────────────────────────────────────────
 # Main entry page: login/role selection
@@ -275,6 +306,16 @@ if st.session_state.page == 'teacher':
             else:
                 st.info("No knowledgebase files found for this subject/week.")
 
+            try:
+                from kb_build_queue import kb_build_status
+                build = kb_build_status(subject, week)
+                if build["state"] in ("queued", "running"):
+                    st.caption(f"🔄 Search index build {build['state']}… students use the previous version until it finishes.")
+                elif build["state"] == "failed":
+                    st.caption(f"⚠️ Last search index build failed: {build.get('error')}")
+            except Exception:
+                pass
+
             # KB uploader with progress indicators
             uploaded_kb = st.file_uploader("Upload Knowledgebase (TXT or PDF)", type=["txt", "pdf"], key=f"upload_kb_{subject}_{week}")
             if uploaded_kb:
@@ -331,7 +372,8 @@ if st.session_state.page == 'teacher':
 
                     # Save metadata to Firestore (merge by filename, overwrite if exists)
                     progress.text("Saving knowledgebase metadata to Firestore...")
-                    existing = load_knowledgebase_from_firestore(subject, week) or []
+                    # Fresh read: another session/replica may have saved since our cached copy
+                    existing = load_knowledgebase_from_firestore(subject, week, max_age=0) or []
                     merged = []
                     replaced = False
                     # Preserve existing order; replace entry when the name matches
@@ -399,40 +441,32 @@ if st.session_state.page == 'teacher':
 
             # Re-run Pass 2: update contexts in-place using KB + existing context
             if rerun_p2:
-                import quiz_extractor  # reuse prompts and cleaner
+                import quiz_extractor  # reuse prompts, cleaner and the concurrent pass runner
                 llm = quiz_extractor.get_llm()
                 progress = st.progress(0.0, text="Enriching contexts...")
-                updated = 0
+                keys = []
                 for idx, q in enumerate(quiz_data, start=1):
                     qid = q.get('id', idx)
-                    q_key = f"edit_q_{qid}_question"
-                    c_key = f"edit_q_{qid}_context"
-                    question_txt = _current_value(q_key, q.get('question', ''))
-                    context_txt  = _current_value(c_key, q.get('context', ''))
-                    try:
-                        enrich_prompt = quiz_extractor.ENRICH_PROMPT.format(
-                            pdf_text=(kb_text or ""),
-                            question=question_txt,
-                            context=context_txt,
-                        )
-                        enriched_context = llm.invoke(
-                            [
-                                {"role": "system", "content": "Return ONLY the enriched context as plain text. Do not add any preamble or conclusion. Do NOT include any answer."},
-                                {"role": "user", "content": enrich_prompt},
-                            ],
-                            temperature=0.2,
-                        ).content
-                        cleaned = quiz_extractor.clean_enriched_context(enriched_context)
-                        # If enrichment is too short, append a few KB lines heuristically
-                        if len(cleaned) < 40 and kb_text:
-                            kb_lines = [ln for ln in kb_text.splitlines() if ln.strip()][:8]
-                            cleaned = (cleaned + "\n" + "\n".join(kb_lines)).strip()
-                        # Update text area value via session_state, then the UI will reflect after rerun
-                        st.session_state[c_key] = cleaned
-                        updated += 1
-                    except Exception as e:
-                        st.warning(f"⚠️ Pass-2 failed for Q{qid}: {e}")
-                    progress.progress(updated / max(1, len(quiz_data)))
+                    keys.append((qid, f"edit_q_{qid}_context"))
+                items = [(_current_value(f"edit_q_{qid}_question", q.get('question', '')),
+                          _current_value(c_key, q.get('context', '')))
+                         for q, (qid, c_key) in zip(quiz_data, keys)]
+                results = quiz_extractor.enrich_contexts(
+                    llm, items, kb_text or "",
+                    system="Return ONLY the enriched context as plain text. Do not add any preamble or conclusion. Do NOT include any answer.",
+                    on_progress=lambda done, total: progress.progress(done / total),
+                )
+                for (qid, c_key), enriched_context in zip(keys, results):
+                    if isinstance(enriched_context, Exception):
+                        st.warning(f"⚠️ Pass-2 failed for Q{qid}: {enriched_context}")
+                        continue
+                    cleaned = quiz_extractor.clean_enriched_context(enriched_context)
+                    # If enrichment is too short, append a few KB lines heuristically
+                    if len(cleaned) < 40 and kb_text:
+                        kb_lines = [ln for ln in kb_text.splitlines() if ln.strip()][:8]
+                        cleaned = (cleaned + "\n" + "\n".join(kb_lines)).strip()
+                    # Update text area value via session_state, then the UI will reflect after rerun
+                    st.session_state[c_key] = cleaned
                 progress.empty()
                 st.success("Pass 2 complete: Context enriched using knowledgebase.")
                 safe_rerun()
@@ -442,30 +476,17 @@ if st.session_state.page == 'teacher':
                 import quiz_extractor
                 llm = quiz_extractor.get_llm()
                 progress = st.progress(0.0, text="Generating rubrics...")
-                updated = 0
-                for idx, q in enumerate(quiz_data, start=1):
-                    qid = q.get('id', idx)
-                    q_key = f"edit_q_{qid}_question"
-                    c_key = f"edit_q_{qid}_context"
-                    r_key = f"edit_q_{qid}_rubric"
-                    question_txt = _current_value(q_key, q.get('question', ''))
-                    context_txt  = _current_value(c_key, q.get('context', ''))
-                    try:
-                        rubric_prompt = quiz_extractor.RUBRIC_PROMPT.format(
-                            question=question_txt,
-                            context=context_txt,
-                        )
-                        rubric = llm.invoke(
-                            [
-                                {"role": "system", "content": "Return the marking rubric as plain text."},
-                                {"role": "user", "content": rubric_prompt},
-                            ]
-                        ).content
-                        st.session_state[r_key] = rubric.strip()
-                        updated += 1
-                    except Exception as e:
-                        st.warning(f"⚠️ Pass-3 failed for Q{qid}: {e}")
-                    progress.progress(updated / max(1, len(quiz_data)))
+                qids = [q.get('id', idx) for idx, q in enumerate(quiz_data, start=1)]
+                items = [(_current_value(f"edit_q_{qid}_question", q.get('question', '')),
+                          _current_value(f"edit_q_{qid}_context", q.get('context', '')))
+                         for q, qid in zip(quiz_data, qids)]
+                results = quiz_extractor.generate_rubrics(
+                    llm, items, on_progress=lambda done, total: progress.progress(done / total))
+                for qid, rubric in zip(qids, results):
+                    if isinstance(rubric, Exception):
+                        st.warning(f"⚠️ Pass-3 failed for Q{qid}: {rubric}")
+                        continue
+                    st.session_state[f"edit_q_{qid}_rubric"] = rubric.strip()
                 progress.empty()
                 st.success("Pass 3 complete: Rubrics regenerated.")
                 safe_rerun()
@@ -527,78 +548,75 @@ if st.session_state.page == 'teacher':
             # Save uploaded PDF to a temp location inside BASE so extraction utilities can access it
             temp_pdf_path = os.path.join(BASE, "data", "uploaded_pdfs", uploaded_pdf.name)
             os.makedirs(os.path.dirname(temp_pdf_path), exist_ok=True)
-            with open(temp_pdf_path, "wb") as f:
-                f.write(uploaded_pdf.read())
             import quiz_extractor
-            # Only run extraction if not already done for this PDF
+            # Only run extraction if not already done for this PDF. It runs on a
+            # background job: questions appear below as soon as their rubric is
+            # ready and can be edited while the rest are still being processed.
             if 'uploaded_pdf_name' not in st.session_state or st.session_state.uploaded_pdf_name != uploaded_pdf.name:
-                with st.spinner("Extracting questions from PDF (Pass 1)..."):
-                    try:
-                        questions = quiz_extractor.extract_questions_from_pdf(temp_pdf_path)
-                        st.session_state.uploaded_questions = questions
-                        st.session_state.uploaded_pdf_name = uploaded_pdf.name
-                    except Exception as e:
-                        st.error(f"Error processing PDF: {e}")
-                        st.session_state.uploaded_questions = []
+                with open(temp_pdf_path, "wb") as f:
+                    f.write(uploaded_pdf.read())
+                st.session_state.extraction_job = quiz_extractor.ExtractionJob(temp_pdf_path)
+                st.session_state.uploaded_pdf_name = uploaded_pdf.name
+                st.session_state.uploaded_questions = []
+                st.session_state.extraction_messages = []
+            elif not os.path.exists(temp_pdf_path):
+                with open(temp_pdf_path, "wb") as f:
+                    f.write(uploaded_pdf.read())
+            extraction_status()
+            job = st.session_state.get('extraction_job')
             # If already extracted, use session state
             questions = st.session_state.get('uploaded_questions', [])
             if questions:
-                st.success(f"Extracted {len(questions)} questions. You can edit them below before saving.")
-                # Buttons to re-run Pass 2 and Pass 3
-                if st.button("Re-run Pass 2: Enrich Context"):
+                if job is None:
+                    st.success(f"Extracted {len(questions)} questions. You can edit them below before saving.")
+                # Buttons to re-run Pass 2 and Pass 3 (once extraction has finished)
+                if job is None and st.button("Re-run Pass 2: Enrich Context"):
                     with st.spinner("Re-enriching context for all questions (Pass 2)..."):
-                        enriched_questions = []
                         llm = quiz_extractor.get_llm()
-                        pdf_text = quiz_extractor._pdf_to_text(temp_pdf_path)
-                        for idx, q in enumerate(st.session_state.uploaded_questions, start=1):
+                        pdf_text = quiz_extractor._pdf_to_text(temp_pdf_path, max_chars=None)
+                        uploaded = st.session_state.uploaded_questions
+                        for idx, q in enumerate(uploaded, start=1):
                             q.setdefault("id", idx)
-                            try:
-                                enrich_prompt = quiz_extractor.ENRICH_PROMPT.format(
-                                    pdf_text=pdf_text,
-                                    question=q["question"],
-                                    context=q["context"],
-                                )
-                                enriched_context = llm.invoke(
-                                    [
-                                        {"role": "system", "content": "Return ONLY the enriched context as plain text. Do not add any preamble or conclusion."},
-                                        {"role": "user", "content": enrich_prompt},
-                                    ],
-                                    temperature=0.2
-                                ).content
-                                cleaned_context = quiz_extractor.clean_enriched_context(enriched_context)
-                                if len(cleaned_context) < 40 or cleaned_context.lower().startswith("the question is asking"):
-                                    q_text = q["question"][:40]
-                                    pdf_lines = pdf_text.splitlines()
-                                    relevant_lines = [line for line in pdf_lines if q_text.split()[0] in line or any(x in line for x in ["=", "print", ":", "+", "input", "output"])]
-                                    if relevant_lines:
-                                        cleaned_context += "\n" + "\n".join(relevant_lines[:6])
-                                q["context"] = cleaned_context.strip()
-                            except Exception as e:
-                                st.warning(f"⚠️ Error enriching context for Q{idx}: {e}")
+                        progress = st.progress(0.0)
+                        results = quiz_extractor.enrich_contexts(
+                            llm, [(q["question"], q["context"]) for q in uploaded], pdf_text,
+                            system="Return ONLY the enriched context as plain text. Do not add any preamble or conclusion.",
+                            on_progress=lambda done, total: progress.progress(done / total),
+                        )
+                        progress.empty()
+                        enriched_questions = []
+                        for idx, (q, enriched_context) in enumerate(zip(uploaded, results), start=1):
+                            if isinstance(enriched_context, Exception):
+                                st.warning(f"⚠️ Error enriching context for Q{idx}: {enriched_context}")
+                                enriched_questions.append(q)
+                                continue
+                            cleaned_context = quiz_extractor.clean_enriched_context(enriched_context)
+                            if len(cleaned_context) < 40 or cleaned_context.lower().startswith("the question is asking"):
+                                q_text = q["question"][:40]
+                                pdf_lines = pdf_text.splitlines()
+                                relevant_lines = [line for line in pdf_lines if q_text.split()[0] in line or any(x in line for x in ["=", "print", ":", "+", "input", "output"])]
+                                if relevant_lines:
+                                    cleaned_context += "\n" + "\n".join(relevant_lines[:6])
+                            q["context"] = cleaned_context.strip()
                             enriched_questions.append(q)
                         st.session_state.uploaded_questions = enriched_questions
                         st.success("Pass 2 complete: Context enriched.")
-                if st.button("Re-run Pass 3: Generate Rubrics"):
+                if job is None and st.button("Re-run Pass 3: Generate Rubrics"):
                     with st.spinner("Generating rubrics for all questions (Pass 3)..."):
-                        rubric_questions = []
                         llm = quiz_extractor.get_llm()
-                        for q in st.session_state.uploaded_questions:
-                            try:
-                                rubric_prompt = quiz_extractor.RUBRIC_PROMPT.format(
-                                    question=q["question"],
-                                    context=q["context"],
-                                )
-                                rubric_response = llm.invoke(
-                                    [
-                                        {"role": "system", "content": "Return the marking rubric as plain text."},
-                                        {"role": "user", "content": rubric_prompt},
-                                    ]
-                                ).content
-                                q["answer"] = rubric_response.strip()
-                            except Exception as e:
-                                st.warning(f"⚠️ Error generating rubric for Q{q.get('id','')}: {e}")
+                        rubric_questions = st.session_state.uploaded_questions
+                        progress = st.progress(0.0)
+                        results = quiz_extractor.generate_rubrics(
+                            llm, [(q["question"], q["context"]) for q in rubric_questions],
+                            on_progress=lambda done, total: progress.progress(done / total),
+                        )
+                        progress.empty()
+                        for q, rubric_response in zip(rubric_questions, results):
+                            if isinstance(rubric_response, Exception):
+                                st.warning(f"⚠️ Error generating rubric for Q{q.get('id','')}: {rubric_response}")
                                 q["answer"] = "Rubric generation failed."
-                            rubric_questions.append(q)
+                            else:
+                                q["answer"] = rubric_response.strip()
                         st.session_state.uploaded_questions = rubric_questions
                         st.success("Pass 3 complete: Rubrics generated.")
                 # Always show the questions for editing
@@ -618,7 +636,7 @@ if st.session_state.page == 'teacher':
                 # If no expanders are opened, still save the current questions
                 if not edited_questions:
                     edited_questions = st.session_state.uploaded_questions
-                if st.button("Save Quiz"):
+                if st.button("Save Quiz", disabled=job is not None):
                     save_quiz_to_firestore(new_subject, new_week, edited_questions)
                     st.success(f"Quiz saved to Firestore for {new_subject} / {new_week}. It is now available to students.")
 elif st.session_state.page == 'student_login':
@@ -787,17 +805,13 @@ elif st.session_state.page == 'student_quiz':
                 perf["current_q"] = 0
                 perf["last_score"] = 0.0
                 perf_ref.set(perf)
+            drop_session_agent(st.session_state, subject, week, st.session_state.student_id)
             st.rerun()
         st.markdown("---")
         # Only initialize with instructions/first question if chat_history is empty
         if not chat_history:
-            try:
-                from quiz_agent import QuizAgent
-            except ImportError:
-                import importlib
-                quiz_agent = importlib.import_module("quiz_agent")
-                QuizAgent = quiz_agent.QuizAgent
-            agent = QuizAgent(quiz_data, subject, week, st.session_state.student_id, {})
+            agent = get_session_agent(st.session_state, quiz_data, subject, week,
+                                      st.session_state.student_id)
             rules = agent.get_instructions()
             first_q = agent.present_question(quiz_data[0])
             chat_history.append({"role": "assistant", "content": rules + "\n\n" + first_q})
@@ -819,14 +833,17 @@ elif st.session_state.page == 'student_quiz':
         user_input = st.chat_input("Type your answer and press Enter...")
         if user_input:
             chat_history.append({"role": "user", "content": user_input})
-            try:
-                from quiz_agent import QuizAgent
-            except ImportError:
-                import importlib
-                quiz_agent = importlib.import_module("quiz_agent")
-                QuizAgent = quiz_agent.QuizAgent
-            agent = QuizAgent(quiz_data, subject, week, st.session_state.student_id, {})
-            response, end_quiz = agent.handle_input(user_input, chat_history)
+            agent = get_session_agent(st.session_state, quiz_data, subject, week,
+                                      st.session_state.student_id)
+            # Stream the tutor's reply as it is generated instead of waiting for
+            # the whole completion and re-rendering the page.
+            turn = agent.handle_input_stream(user_input, chat_history)
+            with chat_container:
+                st.chat_message("user").markdown(f"**User:** {user_input}")
+                with st.chat_message("assistant"):
+                    st.markdown("**Assistant:**")
+                    st.write_stream(turn)
+            response, end_quiz = turn.text, turn.value
             # If the response signals Qualtrics 2, go to post-survey page
             if end_quiz == "qualtrics2":
                 chat_history.append({"role": "assistant", "content": response})
@@ -851,7 +868,8 @@ elif st.session_state.page == 'student_quiz':
             with open(chat_history_path, "w", encoding="utf-8") as cf:
                 json.dump(chat_history, cf)
             st.session_state.last_displayed_index = len(chat_history)
-            st.rerun()
+            # No st.rerun(): the reply is already on screen and the saved history
+            # is rendered on the next interaction.
 
     # If user types 'quit', return to main page or skip post-quiz survey if already done
     if user_input and user_input.strip().lower() == 'quit':
@@ -0,0 +1,81 @@
+# bench_index.py   ── run from the project root
+"""
+Recall-vs-latency of the vector_index types against the exact Flat index.
+
+    python 1.2_back_end/bench_index.py                       # synthetic 1024-d vectors
+    python 1.2_back_end/bench_index.py --n 200000 --queries 500
+    python 1.2_back_end/bench_index.py --npy course_vectors.npy
+
+Ground truth is the exact top-k from IndexFlatL2.  Each spec is built and
+searched exactly as the app ships it – write_store() (vector_index's
+build_raw_index / tune_index) and MmapVectorStore, one query at a time,
+including the exact rerank of INDEX_RERANK × k ANN candidates – and
+reports recall@k, mean query latency, build time and ANN index size.
+Synthetic data is clustered so approximate indexes behave as on text
+embeddings rather than on uniform noise.
+"""
+
+import argparse, os, pathlib, shutil, sys, tempfile, time
+
+import numpy as np
+import faiss
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+import vector_index
+from mmap_store import MmapVectorStore, write_store, store_dir
+
+
+def synthetic(n, dim, clusters=256, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dim)).astype(np.float32)
+    x = centres[rng.integers(0, clusters, n)] + 0.35 * rng.normal(size=(n, dim)).astype(np.float32)
+    return x.astype(np.float32)
+
+
+def bench(spec, x, q, truth, k):
+    tmp = pathlib.Path(tempfile.mkdtemp(prefix="bench_index_"))
+    try:
+        n = len(x)
+        t0 = time.perf_counter()
+        write_store(tmp / "store", [""] * n, x, [{}] * n, [str(i) for i in range(n)], spec)
+        build_s = time.perf_counter() - t0
+        store = MmapVectorStore(tmp / "store", embedding=None)
+        t0 = time.perf_counter()
+        found = [[r for r, _ in store._search(qi, k)] for qi in q]
+        latency_ms = (time.perf_counter() - t0) * 1000 / len(q)
+        ann = store_dir(tmp / "store") / "ann.faiss"
+        size = ann.stat().st_size if ann.exists() else 0
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+    print(f"{spec:<22} recall@{k}={recall:6.2%}  query={latency_ms:7.3f} ms  "
+          f"build={build_s:6.1f}s  ann={size / 1e6:8.1f} MB")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=50_000)
+    ap.add_argument("--dim", type=int, default=1024)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=3)
+    ap.add_argument("--npy", help="float32 matrix of real embeddings (n × dim)")
+    args = ap.parse_args()
+
+    x = np.load(args.npy).astype(np.float32) if args.npy else synthetic(args.n + args.queries, args.dim)
+    q, x = x[:args.queries], x[args.queries:]
+    n, dim = x.shape
+    print(f"{n:,} vectors × {dim} dims, {len(q)} queries")
+
+    flat = faiss.IndexFlatL2(dim)
+    flat.add(x)
+    _, truth = flat.search(q, args.k)
+
+    specs = ["Flat"] + [vector_index.choose_index_spec(n, dim, kind) for kind in ("hnsw_sq", "ivfpq")]
+    for spec in specs:
+        bench(spec, x, q, truth, args.k)
+    print(f"auto → {vector_index.choose_index_spec(n, dim, 'auto')}, "
+          f"rerank {vector_index.INDEX_RERANK} × k candidates")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,7 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 class LocalHuggingFaceEmbeddings(HuggingFaceEmbeddings):
     def __init__(self):
         super().__init__(
-            model_name="mixedbread-ai/mxbai-embed-large-v1",
+            model_name="mixedbread-ai/mxbai-embed-large-v1",   # = embedding_service.EMBED_MODEL_NAME
             cache_folder="models/mxbai"
         )
 
@@ -19,7 +19,14 @@ def load_and_embed_pdf(pdf_path):
     chunks = splitter.split_documents(docs)
     print(f"✂️ Created {len(chunks)} text chunks")
 
-    embeddings = LocalHuggingFaceEmbeddings()
-    vectorstore = FAISS.from_documents(chunks, embeddings)
-    vectorstore.save_local("data/vectorstore/")
+    import uuid
+    from embedding_service import get_embeddings
+    from vector_index import choose_index_spec
+    from mmap_store import write_store
+    embeddings = get_embeddings()
+    texts = [c.page_content for c in chunks]
+    vectors = embeddings.embed_documents(texts)
+    spec = choose_index_spec(len(vectors), len(vectors[0]) if vectors else 0)
+    write_store("data/vectorstore/", texts, vectors, [c.metadata for c in chunks],
+                [str(uuid.uuid4()) for _ in texts], spec)
     print("✅ Vectorstore saved at data/vectorstore/")
\ No newline at end of file
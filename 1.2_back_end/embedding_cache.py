@@ -0,0 +1,190 @@
+"""
+embedding_cache.py
+────────────────────────────────────────────────────────────────────────
+Persistent, content-addressed cache of embedding vectors.
+
+Layout (one folder per embedding model):
+
+    data/embedding_cache/<model-slug>/
+        vectors.f32     ← float32 matrix [max_rows × dim], memory-mapped
+        keys.bin        ← sha256 digest of the key stored in each row
+        index.sqlite    ← key (sha256 of model + text) → row, last_used
+
+Lookups read straight from the mmap, so repeated chunks / queries skip
+the transformer forward pass entirely.  When the matrix is full the
+least-recently-used rows are overwritten; entries beyond a lowered
+EMBED_CACHE_MAX_ROWS are dropped and re-embedded.  SQLite serialises slot
+allocation, so several Streamlit processes can share one cache folder;
+a reader only accepts a row whose keys.bin digest matches its key both
+before and after copying the vector (writers clear the digest, write the
+vector, then set the new digest), so a row evicted by another process
+mid-read is a miss, never another text's vector.
+"""
+
+from __future__ import annotations
+import os, re, time, sqlite3, hashlib, threading
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+__all__ = ["EmbeddingCache", "EMBED_CACHE_DIR"]
+
+BASE_DIR            = Path(__file__).resolve().parents[1]
+EMBED_CACHE_DIR     = Path(os.getenv("EMBED_CACHE_DIR", BASE_DIR / "data" / "embedding_cache"))
+EMBED_CACHE_MAX_ROWS = int(os.getenv("EMBED_CACHE_MAX_ROWS", "100000"))
+
+
+class EmbeddingCache:
+    """mmap'd float32 matrix + SQLite hash index with LRU eviction."""
+
+    def __init__(self, model_name: str,
+                 root: Path = EMBED_CACHE_DIR,
+                 max_rows: int = EMBED_CACHE_MAX_ROWS):
+        self.model_name = model_name
+        self.max_rows = max(1, max_rows)
+        self.dir = Path(root) / re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.dir / "index.sqlite"),
+                                   timeout=30, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                         " key TEXT PRIMARY KEY, row INTEGER UNIQUE, last_used REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries(last_used)")
+        self._mm: Optional[np.memmap] = None
+        self._keys: Optional[np.memmap] = None
+        self.dim: Optional[int] = None
+        row = self._db.execute("SELECT v FROM meta WHERE k='dim'").fetchone()
+        if row:
+            self._open(int(row[0]))
+
+    # ── storage ────────────────────────────────────────────────────────
+    @staticmethod
+    def _ensure_size(path: Path, nbytes: int) -> None:
+        """Create *path* (sparse) or grow it to *nbytes*; never truncates, so
+        concurrent creators and processes that already map it are safe."""
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < nbytes:
+                os.ftruncate(fd, nbytes)
+        finally:
+            os.close(fd)
+
+    def _open(self, dim: int) -> None:
+        path = self.dir / "vectors.f32"
+        self._ensure_size(path, self.max_rows * dim * 4)
+        self._mm = np.memmap(path, dtype=np.float32, mode="r+", shape=(self.max_rows, dim))
+        kpath = self.dir / "keys.bin"
+        self._ensure_size(kpath, self.max_rows * 32)
+        self._keys = np.memmap(kpath, dtype=np.uint8, mode="r+", shape=(self.max_rows, 32))
+        self.dim = dim
+
+    def _read_row(self, r: int, key: str) -> Optional[List[float]]:
+        digest = np.frombuffer(bytes.fromhex(key), dtype=np.uint8)
+        if not np.array_equal(self._keys[r], digest):
+            return None
+        vec = np.array(self._mm[r])                   # copy, then re-check
+        if not np.array_equal(self._keys[r], digest):
+            return None
+        return vec.tolist()
+
+    def _write_row(self, r: int, key: str, vec) -> None:
+        self._keys[r] = 0                             # invalidate for concurrent readers
+        self._keys.flush()
+        self._mm[r] = np.asarray(vec, dtype=np.float32)
+        self._mm.flush()
+        self._keys[r] = np.frombuffer(bytes.fromhex(key), dtype=np.uint8)
+
+    def key(self, text: str, kind: str = "doc") -> str:
+        return hashlib.sha256(f"{self.model_name}\0{kind}\0{text}".encode("utf-8")).hexdigest()
+
+    # ── public API ─────────────────────────────────────────────────────
+    def get_many(self, texts: Sequence[str], kind: str = "doc") -> List[Optional[List[float]]]:
+        """Return cached vectors (None for misses) in input order."""
+        out: List[Optional[List[float]]] = [None] * len(texts)
+        if self._mm is None and texts:
+            with self._lock:                           # another process may have set dim
+                row = self._db.execute("SELECT v FROM meta WHERE k='dim'").fetchone()
+                if row and self._mm is None:
+                    self._open(int(row[0]))
+        if self._mm is None or not texts:
+            return out
+        keys = [self.key(t, kind) for t in texts]
+        with self._lock:
+            rows = {}
+            for i in range(0, len(keys), 500):            # SQLite variable limit
+                part = keys[i:i + 500]
+                q = "SELECT key, row FROM entries WHERE key IN (%s)" % ",".join("?" * len(part))
+                rows.update(self._db.execute(q, part).fetchall())
+            if rows:
+                now = time.time()
+                self._db.execute("BEGIN")
+                self._db.executemany("UPDATE entries SET last_used=? WHERE key=?",
+                                     [(now, k) for k in rows])
+                self._db.execute("COMMIT")
+            for i, k in enumerate(keys):
+                r = rows.get(k)
+                if r is not None and r < self.max_rows:
+                    out[i] = self._read_row(r, k)
+        return out
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Sequence[float]],
+                 kind: str = "doc") -> None:
+        if not texts:
+            return
+        with self._lock:
+            if self._mm is None:
+                dim = len(vectors[0])
+                self._db.execute("INSERT OR IGNORE INTO meta VALUES ('dim', ?)", (str(dim),))
+                self._open(int(self._db.execute("SELECT v FROM meta WHERE k='dim'").fetchone()[0]))
+            # dedupe while keeping the last vector per key
+            pending = {self.key(t, kind): v for t, v in zip(texts, vectors)}
+            if len(pending) > self.max_rows:
+                pending = dict(list(pending.items())[-self.max_rows:])
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # rows past max_rows (EMBED_CACHE_MAX_ROWS lowered) are misses – reassign them
+                self._db.execute("DELETE FROM entries WHERE row >= ?", (self.max_rows,))
+                known = {}
+                for k in list(pending):
+                    r = self._db.execute("SELECT row FROM entries WHERE key=?", (k,)).fetchone()
+                    if r:
+                        known[k] = r[0]
+                fresh = [k for k in pending if k not in known]
+                slots = self._allocate(len(fresh), exclude=set(known.values()))
+                now = time.time()
+                for k, r in zip(fresh, slots):
+                    self._db.execute("INSERT INTO entries VALUES (?, ?, ?)", (k, r, now))
+                for k, r in list(known.items()) + list(zip(fresh, slots)):
+                    self._write_row(r, k, pending[k])
+                self._keys.flush()
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _allocate(self, n: int, exclude: set) -> List[int]:
+        """Return *n* free rows, evicting least-recently-used entries if needed."""
+        if n == 0:
+            return []
+        used = self._db.execute("SELECT COUNT(*), COALESCE(MAX(row), -1) FROM entries").fetchone()
+        count, max_row = used
+        slots = list(range(max_row + 1, min(self.max_rows, max_row + 1 + n)))
+        if len(slots) < n and count < self.max_rows:
+            taken = {r for (r,) in self._db.execute("SELECT row FROM entries")}
+            slots += [r for r in range(self.max_rows) if r not in taken and r not in slots][:n - len(slots)]
+        if len(slots) < n:
+            victims = self._db.execute(
+                "SELECT key, row FROM entries ORDER BY last_used LIMIT ?",
+                (n - len(slots) + len(exclude),)).fetchall()
+            victims = [(k, r) for k, r in victims if r not in exclude][:n - len(slots)]
+            self._db.executemany("DELETE FROM entries WHERE key=?", [(k,) for k, _ in victims])
+            slots += [r for _, r in victims]
+        return slots
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
@@ -0,0 +1,210 @@
+"""
+embedding_service.py
+────────────────────────────────────────────────────────────────────────
+One process-wide copy of the mxbai embedding model.
+
+Building / querying a FAISS store used to construct a fresh
+LocalHuggingFaceEmbeddings() every time, which re-reads the weights from
+models/mxbai.  Callers now share a single lazily-loaded instance:
+
+    embs = get_embeddings()        # LangChain Embeddings – pass to FAISS
+    warm_up()                      # load now (e.g. at app start-up)
+    embedding_stats()              # {"loads": 1, "hits": 57, …}
+
+Forward passes are serialised behind a lock so concurrent Streamlit
+sessions never run the transformer on the same weights at once.  Vectors
+go through the persistent EmbeddingCache first (EMBED_CACHE=0 disables
+it), so unchanged chunks and repeated queries never reach the model –
+and a fully cached call does not even load it.
+"""
+
+from __future__ import annotations
+import os, threading, time, logging
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+__all__ = ["SharedEmbeddings", "get_embeddings", "warm_up", "embedding_stats",
+           "embedding_token_counter"]
+
+EMBED_MODEL_NAME = "mixedbread-ai/mxbai-embed-large-v1"   # = LocalHuggingFaceEmbeddings
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_CACHE      = os.getenv("EMBED_CACHE", "1").lower() not in ("0", "false", "no")
+
+
+def _default_factory() -> Embeddings:
+    # imported lazily – document_loader itself uses get_embeddings()
+    try:
+        from .document_loader import LocalHuggingFaceEmbeddings
+    except ImportError:
+        from document_loader import LocalHuggingFaceEmbeddings
+    return LocalHuggingFaceEmbeddings()
+
+
+class SharedEmbeddings(Embeddings):
+    """Thread-safe, load-once wrapper around an Embeddings model."""
+
+    def __init__(self,
+                 factory: Optional[Callable[[], Embeddings]] = None,
+                 batch_size: int = EMBED_BATCH_SIZE,
+                 cache=None):
+        self._factory = factory or _default_factory
+        self.cache = cache                 # EmbeddingCache | None
+        self._model: Optional[Embeddings] = None
+        self._load_lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self.batch_size = max(1, batch_size)
+        self._stats = {
+            "loads": 0,          # times the weights were read from disk
+            "hits": 0,           # calls served by the already-loaded model
+            "documents": 0,      # texts embedded via embed_documents
+            "queries": 0,        # texts embedded via embed_query
+            "cache_hits": 0,     # vectors served from the on-disk cache
+            "cache_misses": 0,   # vectors that needed a forward pass
+            "load_seconds": 0.0,
+        }
+
+    # ── model lifecycle ────────────────────────────────────────────────
+    def _get_model(self) -> Embeddings:
+        model = self._model
+        if model is not None:
+            self._stats["hits"] += 1
+            return model
+        with self._load_lock:
+            if self._model is None:
+                t0 = time.perf_counter()
+                self._model = self._factory()
+                self._stats["loads"] += 1
+                self._stats["load_seconds"] += time.perf_counter() - t0
+                logging.info("Embedding model loaded in %.1fs",
+                             time.perf_counter() - t0)
+            else:
+                self._stats["hits"] += 1
+            return self._model
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def warm_up(self) -> None:
+        """Load the weights (no-op if already loaded)."""
+        if self._model is None:
+            self._get_model()
+
+    def stats(self) -> Dict[str, float]:
+        return dict(self._stats, loaded=self.loaded)
+
+    # ── Embeddings interface ───────────────────────────────────────────
+    def _cached(self, texts: List[str], kind: str) -> List[Optional[List[float]]]:
+        if self.cache is None:
+            return [None] * len(texts)
+        try:
+            return self.cache.get_many(texts, kind=kind)
+        except Exception:
+            logging.exception("Embedding cache read failed – computing vectors")
+            return [None] * len(texts)
+
+    def _remember(self, texts: List[str], vectors: List[List[float]], kind: str) -> None:
+        if self.cache is None or not texts:
+            return
+        try:
+            self.cache.put_many(texts, vectors, kind=kind)
+        except Exception:
+            logging.exception("Embedding cache write failed")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        vectors = self._cached(texts, "doc")
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        self._stats["cache_hits"] += len(texts) - len(missing)
+        self._stats["cache_misses"] += len(missing)
+        if missing:
+            todo = [texts[i] for i in missing]
+            model = self._get_model()
+            fresh: List[List[float]] = []
+            with self._run_lock:
+                for i in range(0, len(todo), self.batch_size):
+                    fresh.extend(model.embed_documents(todo[i:i + self.batch_size]))
+            for i, v in zip(missing, fresh):
+                vectors[i] = v
+            self._remember(todo, fresh, "doc")
+        self._stats["documents"] += len(texts)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        self._stats["queries"] += 1
+        vector = self._cached([text], "query")[0]
+        if vector is not None:
+            self._stats["cache_hits"] += 1
+            return vector
+        self._stats["cache_misses"] += 1
+        model = self._get_model()
+        with self._run_lock:
+            vector = model.embed_query(text)
+        self._remember([text], [vector], "query")
+        return vector
+
+
+_shared: Optional[SharedEmbeddings] = None
+_shared_lock = threading.Lock()
+
+
+def get_embeddings() -> SharedEmbeddings:
+    """Return the process-wide embedding service (model loads on first use)."""
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                cache = None
+                if EMBED_CACHE:
+                    try:
+                        try:
+                            from .embedding_cache import EmbeddingCache
+                        except ImportError:
+                            from embedding_cache import EmbeddingCache
+                        cache = EmbeddingCache(EMBED_MODEL_NAME)
+                    except Exception:
+                        logging.exception("Embedding cache unavailable – continuing without it")
+                _shared = SharedEmbeddings(cache=cache)
+    return _shared
+
+
+def warm_up(background: bool = False) -> None:
+    """Load the embedding model now instead of on the first query.
+
+    background=True returns immediately and loads on a daemon thread.
+    """
+    svc = get_embeddings()
+    if background:
+        threading.Thread(target=svc.warm_up, name="embeddings-warmup",
+                         daemon=True).start()
+    else:
+        svc.warm_up()
+
+
+def embedding_stats() -> Dict[str, float]:
+    return get_embeddings().stats()
+
+
+_token_counter: Optional[Callable[[str], int]] = None
+
+
+def embedding_token_counter() -> Callable[[str], int]:
+    """Return f(text) -> token count using the embedding model's own tokenizer.
+
+    Only the tokenizer files are loaded (not the weights).  Falls back to a
+    word/punctuation estimate when transformers or the files are unavailable.
+    """
+    global _token_counter
+    if _token_counter is None:
+        try:
+            from transformers import AutoTokenizer
+            tok = AutoTokenizer.from_pretrained(EMBED_MODEL_NAME, cache_dir="models/mxbai")
+            _token_counter = lambda text: len(tok.encode(text, add_special_tokens=False))
+        except Exception:
+            logging.warning("Embedding tokenizer unavailable – estimating token counts")
+            import re
+            _word = re.compile(r"\w+|[^\w\s]")
+            _token_counter = lambda text: int(len(_word.findall(text)) * 1.3)
+    return _token_counter
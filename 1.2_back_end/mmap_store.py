@@ -0,0 +1,394 @@
+"""
+mmap_store.py
+────────────────────────────────────────────────────────────────────────
+Read-only, memory-mapped vector store shared by all app processes.
+
+FAISS.load_local() unpickles the docstore and copies the vector matrix
+into private memory, so N Streamlit replicas hold N copies.  This format
+is opened with np.memmap instead – every process maps the same files
+and the OS page cache keeps one copy:
+
+    <store dir>/
+        store.hdr       magic, format version, n, dim, ANN spec  (written last)
+        vectors.f32     float32 [n × dim]
+        norms.f32       float32 [n]        ‖v‖² for exact L2 search
+        texts.bin  + texts.off     UTF-8 chunk text + uint64 offsets [n + 1]
+        ids.bin    + ids.off       docstore ids
+        meta.bin   + meta.off      per-chunk metadata (typed key/value records;
+                                   lists / dicts as JSON)
+        ann.faiss       ANN index (HNSW / IVF) when spec ≠ Flat, read with IO_FLAG_MMAP
+
+A rewrite of an existing folder goes to <store dir>/versions/<version>/
+and <store dir>/CURRENT is then repointed atomically (the KB index's
+layout), so readers always open one complete version and never see files
+truncated under their mappings.  store_dir() resolves the live folder.
+
+Flat stores are searched with numpy straight off the mapped matrix;
+ANN candidates (INDEX_RERANK × k) are re-scored exactly the same way.
+write_store() builds a store; open_vector_store() opens either this
+format or a legacy FAISS save_local() folder; convert_faiss_dir() adds
+the mmap format to a legacy folder (the legacy files are kept).
+
+    python 1.2_back_end/mmap_store.py convert data/courses/X/course_kb/vectorstore
+"""
+
+from __future__ import annotations
+import os, json, uuid, shutil, struct
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+__all__ = ["MmapVectorStore", "write_store", "open_vector_store", "convert_faiss_dir",
+           "is_mmap_store", "store_dir", "HEADER_FILE", "POINTER_FILE"]
+
+HEADER_FILE = "store.hdr"
+_MAGIC      = b"GMVS"
+_FORMAT     = 1
+_HDR        = struct.Struct("<4sIQI32s")      # magic, format, n, dim, spec
+
+# ── metadata records: key \x1f type value \x1e … ───────────────────────
+_KS, _RS = "\x1f", "\x1e"
+
+
+def _enc_meta(meta: Dict[str, Any]) -> bytes:
+    parts = []
+    for k, v in (meta or {}).items():
+        if v is None:
+            t, s = "n", ""
+        elif isinstance(v, bool):
+            t, s = "b", "1" if v else "0"
+        elif isinstance(v, int):
+            t, s = "i", str(v)
+        elif isinstance(v, float):
+            t, s = "f", repr(v)
+        elif isinstance(v, (list, tuple, dict)):
+            t, s = "j", json.dumps(v, ensure_ascii=False, default=str)
+        else:
+            t, s = "s", str(v)
+        parts.append(f"{k}{_KS}{t}{s}")
+    return _RS.join(parts).encode("utf-8")
+
+
+def _dec_meta(raw: bytes) -> Dict[str, Any]:
+    meta: Dict[str, Any] = {}
+    if not raw:
+        return meta
+    for rec in raw.decode("utf-8").split(_RS):
+        k, _, tv = rec.partition(_KS)
+        t, s = tv[:1], tv[1:]
+        meta[k] = (None if t == "n" else s == "1" if t == "b" else int(s) if t == "i"
+                   else float(s) if t == "f" else json.loads(s) if t == "j" else s)
+    return meta
+
+
+def _write_table(dir_: Path, name: str, items: Iterable[bytes]) -> None:
+    offsets = [0]
+    with open(dir_ / f"{name}.bin", "wb") as f:
+        for b in items:
+            f.write(b)
+            offsets.append(offsets[-1] + len(b))
+    np.asarray(offsets, dtype=np.uint64).tofile(dir_ / f"{name}.off")
+
+
+class _Table:
+    """mmap'd variable-length records addressed by row."""
+
+    def __init__(self, dir_: Path, name: str):
+        self.off = np.memmap(dir_ / f"{name}.off", dtype=np.uint64, mode="r")
+        size = (dir_ / f"{name}.bin").stat().st_size
+        self.data = np.memmap(dir_ / f"{name}.bin", dtype=np.uint8, mode="r") if size else b""
+
+    def __getitem__(self, row: int) -> bytes:
+        a, b = int(self.off[row]), int(self.off[row + 1])
+        return bytes(self.data[a:b])
+
+
+def is_mmap_store(path: Path) -> bool:
+    return (store_dir(path) / HEADER_FILE).exists()
+
+
+_STORE_FILES = {HEADER_FILE, "vectors.f32", "norms.f32", "ann.faiss",
+                "texts.bin", "texts.off", "ids.bin", "ids.off", "meta.bin", "meta.off"}
+POINTER_FILE  = "CURRENT"         # name of the live version folder under versions/
+VERSIONS_DIR  = "versions"
+KEEP_VERSIONS = 2                 # previous version kept so in-flight readers can finish
+
+
+def _write_files(path: Path, texts: Sequence[str], vectors, metadatas: Sequence[dict],
+                 ids: Sequence[str], spec: str) -> None:
+    x = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32))
+    n, dim = x.shape if x.size else (0, 0)
+    x.tofile(path / "vectors.f32")
+    np.einsum("ij,ij->i", x, x).astype(np.float32).tofile(path / "norms.f32")
+    _write_table(path, "texts", (t.encode("utf-8") for t in texts))
+    _write_table(path, "ids", (str(i).encode("utf-8") for i in ids))
+    _write_table(path, "meta", (_enc_meta(m) for m in metadatas))
+    spec = spec if n else "Flat"
+    if spec != "Flat":
+        import faiss
+        try:
+            from .vector_index import build_raw_index
+        except ImportError:
+            from vector_index import build_raw_index
+        faiss.write_index(build_raw_index(x, spec), str(path / "ann.faiss"))
+    with open(path / HEADER_FILE, "wb") as f:
+        f.write(_HDR.pack(_MAGIC, _FORMAT, n, dim, spec.encode("ascii")[:32]))
+
+
+def _publish(path: Path, version: str) -> None:
+    tmp = path / f".{POINTER_FILE}.{os.getpid()}.tmp"
+    tmp.write_text(version, encoding="utf-8")
+    os.replace(tmp, path / POINTER_FILE)
+
+
+def _prune(path: Path, live: str, keep: int = KEEP_VERSIONS) -> None:
+    versions = path / VERSIONS_DIR
+    built = sorted(p for p in versions.iterdir()
+                   if p.is_dir() and not p.name.startswith(".") and p.name != live)
+    for old in built[:-(keep - 1)] if keep > 1 else built:
+        shutil.rmtree(old, ignore_errors=True)
+    for name in _STORE_FILES:                # unversioned store from before the first rewrite
+        try:
+            (path / name).unlink()
+        except OSError:
+            pass
+
+
+def store_dir(path: Path) -> Path:
+    """Folder holding the live store files: the version CURRENT names, else *path*."""
+    path = Path(path)
+    try:
+        version = (path / POINTER_FILE).read_text(encoding="utf-8").strip()
+        if version and (path / VERSIONS_DIR / version / HEADER_FILE).exists():
+            return path / VERSIONS_DIR / version
+    except OSError:
+        pass
+    return path
+
+
+def write_store(path: Path, texts: Sequence[str], vectors, metadatas: Sequence[dict],
+                ids: Sequence[str], spec: str = "Flat") -> None:
+    """Write a store into *path*.
+
+    A new (or empty) *path* is written in a hidden sibling folder and
+    renamed into place.  An existing folder is never modified in place:
+    the store goes to versions/<version>/ and CURRENT is repointed
+    atomically, so readers always open one complete store, and files other
+    processes have mapped are never truncated.  Other files in *path* –
+    e.g. the legacy FAISS files kept by convert_faiss_dir() – are left alone."""
+    path = Path(path)
+    tag = f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')}-{uuid.uuid4().hex[:6]}"
+    fresh = not path.exists() or (path.is_dir() and not any(path.iterdir()))
+    if fresh:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        staging = path.parent / f".{path.name}.{tag}.tmp"
+    else:
+        (path / VERSIONS_DIR).mkdir(exist_ok=True)
+        staging = path / VERSIONS_DIR / f".{tag}.tmp"
+    staging.mkdir()
+    try:
+        _write_files(staging, texts, vectors, metadatas, ids, spec)
+        if fresh:
+            if path.exists():
+                path.rmdir()                         # empty – nobody can be reading it
+            os.replace(staging, path)
+            return
+        os.replace(staging, path / VERSIONS_DIR / tag)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    _publish(path, tag)
+    _prune(path, tag)
+
+
+class _DocstoreView:
+    """docstore.search(id) compatibility with LangChain's InMemoryDocstore."""
+
+    def __init__(self, store: "MmapVectorStore"):
+        self._store = store
+
+    def search(self, doc_id: str):
+        row = self._store.row_of(doc_id)
+        return self._store.document(row) if row is not None else f"ID {doc_id} not found."
+
+
+class MmapVectorStore(VectorStore):
+    """Zero-copy, read-only vector store over the files written by write_store()."""
+
+    def __init__(self, path: Path, embedding: Embeddings):
+        self.embedding = embedding
+        for attempt in range(3):
+            self.path = store_dir(path)          # pinned to the version live right now
+            try:
+                self._open()
+                break
+            except FileNotFoundError:            # version pruned while opening – re-resolve
+                if attempt == 2:
+                    raise
+        self.docstore = _DocstoreView(self)
+
+    def _open(self) -> None:
+        with open(self.path / HEADER_FILE, "rb") as f:
+            magic, fmt, n, dim, spec = _HDR.unpack(f.read(_HDR.size))
+        if magic != _MAGIC or fmt != _FORMAT:
+            raise ValueError(f"{self.path} is not a format-{_FORMAT} vector store")
+        self.n, self.dim = int(n), int(dim)
+        self.index_spec = spec.rstrip(b"\0").decode("ascii")
+        if self.n:
+            self.vectors = np.memmap(self.path / "vectors.f32", dtype=np.float32,
+                                     mode="r", shape=(self.n, self.dim))
+            self.norms = np.memmap(self.path / "norms.f32", dtype=np.float32, mode="r")
+        else:
+            self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+            self.norms = np.zeros(0, dtype=np.float32)
+        self._texts = _Table(self.path, "texts")
+        self._ids = _Table(self.path, "ids")
+        self._meta = _Table(self.path, "meta")
+        self._row_by_id: Optional[Dict[str, int]] = None
+        self.ann = None
+        if self.index_spec != "Flat" and self.n:
+            import faiss
+            try:
+                from .vector_index import tune_index, INDEX_RERANK
+            except ImportError:
+                from vector_index import tune_index, INDEX_RERANK
+            self.rerank = max(1, INDEX_RERANK)
+            try:
+                self.ann = faiss.read_index(str(self.path / "ann.faiss"),
+                                            faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError:
+                self.ann = faiss.read_index(str(self.path / "ann.faiss"))
+            tune_index(self.ann)
+
+    # ── row access ─────────────────────────────────────────────────────
+    def __len__(self) -> int:
+        return self.n
+
+    def text(self, row: int) -> str:
+        return self._texts[row].decode("utf-8")
+
+    def doc_id(self, row: int) -> str:
+        return self._ids[row].decode("utf-8")
+
+    def metadata(self, row: int) -> Dict[str, Any]:
+        return _dec_meta(self._meta[row])
+
+    def document(self, row: int) -> Document:
+        return Document(page_content=self.text(row), metadata=self.metadata(row))
+
+    def row_of(self, doc_id: str) -> Optional[int]:
+        if self._row_by_id is None:
+            self._row_by_id = {self.doc_id(r): r for r in range(self.n)}
+        return self._row_by_id.get(doc_id)
+
+    def resident_bytes(self) -> int:
+        """Private (non-shared) memory held by this object – mapped pages excluded."""
+        return 64 * len(self._row_by_id or ())
+
+    # ── search ─────────────────────────────────────────────────────────
+    def _search(self, q: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        k = min(k, self.n)
+        if k <= 0:
+            return []
+        if self.ann is not None:
+            # ANN candidates, re-scored exactly against the mapped vectors
+            _, rows = self.ann.search(q.reshape(1, -1), min(self.n, k * self.rerank))
+            rows = rows[0][rows[0] >= 0]
+            dist = np.maximum(self.norms[rows] - 2.0 * (self.vectors[rows] @ q) + float(q @ q), 0.0)
+            top = np.argsort(dist)[:k]
+            return [(int(rows[i]), float(dist[i])) for i in top]
+        # exact squared L2 (same scores as IndexFlatL2): ‖v‖² − 2·v·q + ‖q‖²
+        dist = np.maximum(self.norms - 2.0 * (self.vectors @ q) + float(q @ q), 0.0)
+        top = np.argpartition(dist, k - 1)[:k]
+        top = top[np.argsort(dist[top])]
+        return [(int(r), float(dist[r])) for r in top]
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        q = np.asarray(self.embedding.embed_query(query), dtype=np.float32)
+        return [(self.document(r), d) for r, d in self._search(q, k)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    **kwargs: Any) -> List[Document]:
+        q = np.asarray(embedding, dtype=np.float32)
+        return [self.document(r) for r, _ in self._search(q, k)]
+
+    # ── read-only ──────────────────────────────────────────────────────
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  **kwargs: Any) -> List[str]:
+        raise NotImplementedError("MmapVectorStore is read-only – write a new version with write_store()")
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings,
+                   metadatas: Optional[List[dict]] = None, *,
+                   path: Optional[Path] = None, ids: Optional[List[str]] = None,
+                   spec: str = "Flat", **kwargs: Any) -> "MmapVectorStore":
+        import tempfile
+        path = Path(path or tempfile.mkdtemp(prefix="mmap_store_"))
+        write_store(path, texts, embedding.embed_documents(list(texts)),
+                    metadatas or [{} for _ in texts],
+                    ids or [str(uuid.uuid4()) for _ in texts], spec)
+        return cls(path, embedding)
+
+
+def convert_faiss_dir(path: Path, embedding: Optional[Embeddings] = None) -> None:
+    """Add the mmap format next to a legacy FAISS save_local() folder."""
+    import faiss
+    from langchain_community.vectorstores import FAISS
+
+    try:
+        from .vector_index import choose_index_spec
+    except ImportError:
+        from vector_index import choose_index_spec
+
+    path = Path(path)
+    legacy = FAISS.load_local(str(path), embedding, allow_dangerous_deserialization=True)
+    n = legacy.index.ntotal
+    index = faiss.downcast_index(legacy.index)
+    ids = [legacy.index_to_docstore_id[i] for i in range(n)]
+    docs = [legacy.docstore.search(i) for i in ids]
+    texts = [d.page_content for d in docs]
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()                    # IVF can't reconstruct without one
+    try:
+        x = index.reconstruct_n(0, n) if n else np.zeros((0, index.d), dtype=np.float32)
+    except RuntimeError:
+        if embedding is None:
+            raise
+        x = np.asarray(embedding.embed_documents(texts), dtype=np.float32)
+    # The legacy factory string isn't recoverable; non-flat stores get
+    # whatever ANN type the app would build for this size today.
+    spec = "Flat" if isinstance(index, faiss.IndexFlat) else choose_index_spec(n, index.d)
+    write_store(path, texts, x, [dict(d.metadata or {}) for d in docs], ids, spec)
+
+
+def open_vector_store(path: Path, embedding: Embeddings):
+    """Open *path* as an MmapVectorStore, or as a legacy FAISS folder."""
+    path = Path(path)
+    if is_mmap_store(path):
+        return MmapVectorStore(path, embedding)
+    from langchain_community.vectorstores import FAISS
+    try:
+        from .vector_index import tune_for_search
+    except ImportError:
+        from vector_index import tune_for_search
+    return tune_for_search(FAISS.load_local(str(path), embedding,
+                                            allow_dangerous_deserialization=True))
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 3 or sys.argv[1] != "convert":
+        sys.exit("usage: python mmap_store.py convert <faiss dir> [<faiss dir> …]")
+    for d in sys.argv[2:]:
+        convert_faiss_dir(Path(d))
+        print(f"✅ {d} → mmap store")
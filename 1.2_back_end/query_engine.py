@@ -7,21 +7,17 @@ Requirements:
     • data/vectorstore/  generated via document_loader.load_and_embed_pdf()
 """
 
-from langchain.vectorstores import FAISS
 from langchain.chains import RetrievalQA
 
 from groq_llm import get_groq_llm
-from document_loader import LocalHuggingFaceEmbeddings
+from embedding_service import get_embeddings
+from mmap_store import open_vector_store
 
 
 def run_agent_query(query: str, model: str = "llama3-70b-8192") -> str:
     # --- open the vector‑store -------------------------------------------------
-    embeddings = LocalHuggingFaceEmbeddings()
-    vectordb = FAISS.load_local(
-        "data/vectorstore/",
-        embeddings,
-        allow_dangerous_deserialization=True,
-    )
+    embeddings = get_embeddings()                # shared, loaded once
+    vectordb = open_vector_store("data/vectorstore/", embeddings)   # mmap or legacy FAISS
 
     retriever = vectordb.as_retriever(search_type="similarity", k=3)
 
@@ -0,0 +1,143 @@
+"""
+vector_index.py
+────────────────────────────────────────────────────────────────────────
+Size-aware FAISS index factory.
+
+FAISS.from_texts / from_documents always build an exact IndexFlatL2 over
+1024-d float32 vectors – memory and search time grow linearly with the
+corpus.  build_faiss_store() picks the index type from the corpus size:
+
+    n ≤ INDEX_FLAT_MAX   (20 000)   → "Flat"          exact, no training
+    n ≤ INDEX_HNSW_MAX   (500 000)  → "HNSW32,SQ8"    graph + 8-bit scalar quant
+    larger                          → "IVF{nlist},PQ{m}"  coarse lists + product quant
+
+INDEX_KIND=flat|hnsw_sq|ivfpq forces one type (IVF below 10 000 vectors
+uses SQ8 codes – too few points to train PQ codebooks).  Quantised / IVF
+indexes are trained on the vectors being indexed.  Their codes are lossy
+(IVF-PQ alone recalls well under half of the exact top-3), so the mmap
+store re-scores INDEX_RERANK × k ANN candidates against its exact
+vectors; bench_index.py measures that shipped path.  The returned store is a
+regular LangChain FAISS object, so save_local / load_local, retrievers
+and similarity_search work unchanged; index_info() describes it for the
+index metadata.
+"""
+
+from __future__ import annotations
+import os, math
+from typing import Dict, Iterable, Optional, Sequence
+
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+__all__ = ["choose_index_spec", "build_raw_index", "build_faiss_store",
+           "tune_index", "tune_for_search", "index_info"]
+
+INDEX_KIND      = os.getenv("INDEX_KIND", "auto").lower()
+INDEX_FLAT_MAX  = int(os.getenv("INDEX_FLAT_MAX", "20000"))
+INDEX_HNSW_MAX  = int(os.getenv("INDEX_HNSW_MAX", "500000"))
+INDEX_NPROBE    = int(os.getenv("INDEX_NPROBE", "16"))
+INDEX_EF_SEARCH = int(os.getenv("INDEX_EF_SEARCH", "64"))
+INDEX_RERANK    = int(os.getenv("INDEX_RERANK", "10"))      # ANN candidates per result, re-scored exactly
+
+
+def _pq_subquantizers(dim: int) -> int:
+    # largest m ≤ 64 dividing dim with ≥ 8 dims per sub-vector
+    for m in range(min(64, dim // 8), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def choose_index_spec(n: int, dim: int, kind: Optional[str] = None) -> str:
+    """Return a faiss.index_factory string for *n* vectors of size *dim*."""
+    kind = (kind or INDEX_KIND).lower()
+    if kind == "auto":
+        kind = "flat" if n <= INDEX_FLAT_MAX else "hnsw_sq" if n <= INDEX_HNSW_MAX else "ivfpq"
+    if kind == "flat":
+        return "Flat"
+    if kind == "hnsw_sq":
+        return "HNSW32,SQ8"
+    if kind == "ivfpq":
+        # ~4·√n lists, but keep ≥ 39 training points per list
+        nlist = max(1, min(int(4 * math.sqrt(n)), n // 39, 65536))
+        if n < 10_000:                    # too few points to train 256-entry PQ codebooks
+            return f"IVF{nlist},SQ8"
+        return f"IVF{nlist},PQ{_pq_subquantizers(dim)}"
+    raise ValueError(f"Unknown INDEX_KIND '{kind}'")
+
+
+def tune_index(index):
+    """Apply query-time parameters (nprobe / efSearch) to a bare faiss index."""
+    import faiss
+    try:
+        faiss.extract_index_ivf(index).nprobe = INDEX_NPROBE
+    except Exception:
+        pass
+    hnsw = getattr(faiss.downcast_index(index), "hnsw", None)
+    if hnsw is not None:
+        hnsw.efSearch = INDEX_EF_SEARCH
+    return index
+
+
+def tune_for_search(store: FAISS) -> FAISS:
+    """tune_index() for a built or loaded LangChain FAISS store."""
+    tune_index(store.index)
+    return store
+
+
+def index_info(store: FAISS) -> Dict[str, object]:
+    """Describe the index for metadata files: type, spec, size, dimension."""
+    import faiss
+    index = faiss.downcast_index(store.index)
+    return {
+        "index_type": type(index).__name__,
+        "spec": getattr(store, "index_spec", "Flat"),
+        "ntotal": int(index.ntotal),
+        "dim": int(index.d),
+    }
+
+
+def build_raw_index(x: np.ndarray, spec: str):
+    """Create, train and fill a bare faiss index for the float32 matrix *x*."""
+    import faiss
+    index = faiss.index_factory(x.shape[1], spec, faiss.METRIC_L2)
+    if not index.is_trained:
+        index.train(x)
+    index.add(x)
+    return tune_index(index)
+
+
+def build_faiss_store(texts: Sequence[str],
+                      embedding: Embeddings,
+                      metadatas: Optional[Sequence[dict]] = None,
+                      ids: Optional[Sequence[str]] = None,
+                      vectors: Optional[Iterable[Sequence[float]]] = None,
+                      kind: Optional[str] = None) -> FAISS:
+    """Embed *texts* (unless *vectors* are given) and index them with the
+    index type chosen by choose_index_spec()."""
+    import uuid
+
+    texts = list(texts)
+    if vectors is None:
+        vectors = embedding.embed_documents(texts)
+    x = np.asarray(list(vectors), dtype=np.float32)
+    spec = choose_index_spec(x.shape[0], x.shape[1], kind)
+    index = build_raw_index(x, spec)
+
+    ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+    metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+    docs: Dict[str, Document] = {
+        doc_id: Document(page_content=t, metadata=dict(m))
+        for doc_id, t, m in zip(ids, texts, metadatas)
+    }
+    store = FAISS(
+        embedding_function=embedding,
+        index=index,
+        docstore=InMemoryDocstore(docs),
+        index_to_docstore_id={i: doc_id for i, doc_id in enumerate(ids)},
+    )
+    store.index_spec = spec
+    return store
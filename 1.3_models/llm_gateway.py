@@ -0,0 +1,273 @@
+"""
+Central gateway for every Groq call – rate limits, retries, coalescing, priority.
+
+Usage
+-----
+from llm_gateway import llm_call, llm_stream, INTERACTIVE, BATCH
+text = llm_call(llm, messages)                            # → response text
+text = llm_call(llm, messages, priority=BATCH, temperature=0.2)
+for piece in llm_stream(llm, messages):                   # streamed text
+    ...
+text = await allm_call(llm, messages)                     # from async code
+
+• Token buckets per model keep requests under GROQ_RPM and GROQ_TPM
+  (prompt tokens + an expected completion, reconciled with the reported
+  usage afterwards).
+• Waiting callers are admitted lowest priority value first, so a
+  student's evaluation (INTERACTIVE) overtakes queued teacher extraction
+  (BATCH); at most LLM_GATEWAY_CONCURRENCY calls are in flight.
+• 429 / 5xx / timeouts are retried with jittered exponential back-off
+  (Retry-After honoured); a 429 also pauses that model's bucket.
+• Identical non-streamed requests already in flight are coalesced: later
+  callers wait for the first one's result instead of calling again.
+"""
+
+from __future__ import annotations
+import os, json, time, heapq, random, hashlib, asyncio, itertools, logging, threading
+from concurrent.futures import Future
+from typing import Any, Dict, Iterator, Optional
+
+from prompt_budget import count_tokens
+
+__all__ = ["LLMGateway", "gateway", "llm_call", "allm_call", "llm_stream",
+           "INTERACTIVE", "BATCH"]
+
+INTERACTIVE = 0                 # student-facing – admitted first
+BATCH       = 10                # teacher extraction, classification, rebuilds
+
+GROQ_RPM              = float(os.getenv("GROQ_RPM", "30"))
+GROQ_TPM              = float(os.getenv("GROQ_TPM", "12000"))
+GATEWAY_CONCURRENCY   = int(os.getenv("LLM_GATEWAY_CONCURRENCY", "8"))
+GATEWAY_RETRIES       = int(os.getenv("LLM_GATEWAY_RETRIES", "3"))
+GATEWAY_MAX_BACKOFF   = float(os.getenv("LLM_GATEWAY_MAX_BACKOFF", "30"))
+COMPLETION_ESTIMATE   = 400     # tokens charged up front for the reply
+
+
+class TokenBucket:
+    """Refills `rate` units per minute up to `capacity`; not thread-safe on its own."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = max(1.0, per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.stamp = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until *amount* is available (0 → take it now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if now < self.paused_until:
+            return self.paused_until - now
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, delta: float) -> None:
+        """Debit (delta > 0) or refund (delta < 0) after the real usage is known."""
+        self.level = min(self.capacity, self.level - delta)
+
+
+def _status(exc: Exception) -> Optional[int]:
+    status = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def _retryable(exc: Exception) -> bool:
+    status = _status(exc)
+    if status is not None:
+        return status == 429 or status >= 500
+    name, text = type(exc).__name__.lower(), str(exc).lower()
+    return ("timeout" in name or "connection" in name or "rate limit" in text
+            or "429" in text or "overloaded" in text)
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _model_of(llm) -> str:
+    inner = getattr(llm, "bound", llm)          # llm.bind(...) wrappers
+    return str(getattr(inner, "model_name", None) or getattr(inner, "model", None) or "default")
+
+
+def _prompt_text(messages) -> str:
+    if isinstance(messages, str):
+        return messages
+    return "\n".join(m.get("content", "") if isinstance(m, dict) else str(getattr(m, "content", m))
+                     for m in messages)
+
+
+def _used_tokens(response) -> Optional[int]:
+    usage = getattr(response, "usage_metadata", None) or {}
+    total = usage.get("total_tokens") if isinstance(usage, dict) else None
+    if total is None:
+        meta = (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+        total = meta.get("total_tokens")
+    return int(total) if total else None
+
+
+class LLMGateway:
+    def __init__(self, rpm: float = GROQ_RPM, tpm: float = GROQ_TPM,
+                 concurrency: int = GATEWAY_CONCURRENCY, retries: int = GATEWAY_RETRIES):
+        self.rpm, self.tpm = rpm, tpm
+        self.concurrency = max(1, concurrency)
+        self.retries = retries
+        self._cond = threading.Condition()
+        self._waiting: list = []                 # heap of (priority, seq)
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._buckets: Dict[str, tuple] = {}
+        self._pending: Dict[str, Future] = {}    # coalescing: request key → result
+        self.stats = {"calls": 0, "coalesced": 0, "retries": 0, "rate_limited": 0}
+
+    # ── admission ──────────────────────────────────────────────────────
+    def _buckets_for(self, model: str) -> tuple:
+        if model not in self._buckets:
+            self._buckets[model] = (TokenBucket(self.rpm), TokenBucket(self.tpm))
+        return self._buckets[model]
+
+    def _admit(self, model: str, tokens: int, priority: int) -> None:
+        ticket = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    wait = None
+                    if self._waiting[0] == ticket and self._in_flight < self.concurrency:
+                        rpm, tpm = self._buckets_for(model)
+                        now = time.monotonic()
+                        wait = max(rpm.wait_time(1, now), tpm.wait_time(tokens, now))
+                        if wait <= 0:
+                            rpm.take(1)
+                            tpm.take(tokens)
+                            self._in_flight += 1
+                            return
+                    self._cond.wait(timeout=wait)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+    def _release(self, model: str, charged: int, used: Optional[int]) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            if used is not None:
+                self._buckets_for(model)[1].adjust(used - charged)
+            self._cond.notify_all()
+
+    def _penalise(self, model: str, delay: float) -> None:
+        with self._cond:
+            rpm, tpm = self._buckets_for(model)
+            rpm.paused_until = tpm.paused_until = max(rpm.paused_until, time.monotonic() + delay)
+            self.stats["rate_limited"] += 1
+
+    def _backoff(self, model: str, exc: Exception, attempt: int) -> None:
+        delay = _retry_after(exc) or min(GATEWAY_MAX_BACKOFF, (2 ** attempt) * (0.5 + random.random()))
+        if _status(exc) == 429 or "rate limit" in str(exc).lower():
+            self._penalise(model, delay)
+        with self._cond:
+            self.stats["retries"] += 1
+        logging.warning("LLM call failed (%s) – retry %d in %.1fs", exc, attempt + 1, delay)
+        time.sleep(delay)
+
+    def _charge(self, llm, messages) -> int:
+        max_tokens = getattr(getattr(llm, "bound", llm), "max_tokens", None) or COMPLETION_ESTIMATE
+        return count_tokens(_prompt_text(messages)) + min(int(max_tokens), COMPLETION_ESTIMATE)
+
+    # ── public API ─────────────────────────────────────────────────────
+    def invoke(self, llm, messages, priority: int = INTERACTIVE,
+               retries: Optional[int] = None, **kwargs: Any):
+        """llm.invoke(messages, **kwargs) through the gateway; returns the message."""
+        key = hashlib.sha256(json.dumps([id(llm), _prompt_text(messages), sorted(kwargs.items())],
+                                        default=str).encode("utf-8")).hexdigest()
+        with self._cond:
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = Future()
+                owner = True
+            else:
+                self.stats["coalesced"] += 1
+                owner = False
+        if not owner:
+            return pending.result()
+        try:
+            result = self._invoke(llm, messages, priority, retries, kwargs)
+            pending.set_result(result)
+            return result
+        except BaseException as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self._cond:
+                self._pending.pop(key, None)
+
+    def _invoke(self, llm, messages, priority, retries, kwargs):
+        model = _model_of(llm)
+        charged = self._charge(llm, messages)
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            self._admit(model, charged, priority)
+            used = None
+            try:
+                with self._cond:
+                    self.stats["calls"] += 1
+                response = llm.invoke(messages, **kwargs)
+                used = _used_tokens(response)
+                return response
+            except Exception as e:
+                if attempt >= retries or not _retryable(e):
+                    raise
+                err = e
+            finally:
+                self._release(model, charged, used)
+            self._backoff(model, err, attempt)
+
+    def stream(self, llm, messages, priority: int = INTERACTIVE,
+               retries: Optional[int] = None, **kwargs: Any) -> Iterator[str]:
+        """Text pieces of llm.stream(...); retried only until the first piece arrives."""
+        model = _model_of(llm)
+        charged = self._charge(llm, messages)
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            self._admit(model, charged, priority)
+            started = False
+            try:
+                with self._cond:
+                    self.stats["calls"] += 1
+                for chunk in llm.stream(messages, **kwargs):
+                    started = True
+                    yield chunk.content
+                return
+            except Exception as e:
+                if started or attempt >= retries or not _retryable(e):
+                    raise
+                err = e
+            finally:
+                self._release(model, charged, None)
+            self._backoff(model, err, attempt)
+
+
+gateway = LLMGateway()
+
+
+def llm_call(llm, messages, priority: int = INTERACTIVE, retries: Optional[int] = None, **kwargs: Any) -> str:
+    """Response text of *llm* for *messages*, via the shared gateway."""
+    return gateway.invoke(llm, messages, priority=priority, retries=retries, **kwargs).content
+
+
+async def allm_call(llm, messages, priority: int = INTERACTIVE, **kwargs: Any) -> str:
+    return await asyncio.to_thread(llm_call, llm, messages, priority, None, **kwargs)
+
+
+def llm_stream(llm, messages, priority: int = INTERACTIVE, **kwargs: Any) -> Iterator[str]:
+    return gateway.stream(llm, messages, priority=priority, **kwargs)
@@ -6,33 +6,95 @@ Usage
 llm = get_llm()                                   # uses .env defaults
 llm = get_llm(model_name="llama-3.3-70b-versatile")        # one-off model
 llm = get_llm(temperature=0.7, max_tokens=2048)   # tweak params
+llm.bind(temperature=0.9).invoke(msgs)            # per-call override, same client
+
+Clients are cached per normalised (provider, model, temperature, max_tokens)
+in a bounded LRU (LLM_CLIENT_CACHE_SIZE), so repeated parameterised calls
+reuse one ChatGroq object.  All clients share one keep-alive HTTP
+connection pool (LLM_HTTP_MAX_CONNECTIONS / LLM_HTTP_KEEPALIVE).
 """
 
 from __future__ import annotations
-import os, functools
-from typing import Any
+import os, threading
+from collections import OrderedDict
+from typing import Any, Hashable, Tuple
 from dotenv import load_dotenv
 load_dotenv()                        # pick-up .env early
 
+LLM_CLIENT_CACHE_SIZE = int(os.getenv("LLM_CLIENT_CACHE_SIZE", "16"))
+
+_ALIASES = {"model": "model_name"}   # get_llm(model=…) means the model name
+
+
+def _groq_defaults() -> dict:
+    return {
+        "model_name":  os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile"),
+        "temperature": os.getenv("LLM_TEMPERATURE", "0.1"),
+        "max_tokens":  os.getenv("LLM_MAX_TOKENS", "1024"),
+    }
+
+
+_http = None
+_http_lock = threading.Lock()
+
+
+def _shared_http_clients():
+    """(sync, async) httpx clients shared by every cached LLM client."""
+    global _http
+    if _http is None:
+        with _http_lock:
+            if _http is None:
+                try:
+                    import httpx
+                    limits = httpx.Limits(
+                        max_connections=int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "32")),
+                        max_keepalive_connections=int(os.getenv("LLM_HTTP_KEEPALIVE", "16")),
+                    )
+                    timeout = float(os.getenv("LLM_HTTP_TIMEOUT", "60"))
+                    _http = (httpx.Client(limits=limits, timeout=timeout),
+                             httpx.AsyncClient(limits=limits, timeout=timeout))
+                except ImportError:
+                    _http = (None, None)     # SDK default clients
+    return _http
+
+
 def _get_groq(**kw: Any):
     from langchain_groq import ChatGroq
+    http_client, http_async_client = _shared_http_clients()
+    extra = {}
+    if http_client is not None:
+        extra = {"http_client": http_client, "http_async_client": http_async_client}
     return ChatGroq(
         groq_api_key=os.environ["GROQ_API_KEY"],
-        model_name  = kw.get("model_name" ,
-                             os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")),
-        temperature = float(kw.get("temperature" ,
-                             os.getenv("LLM_TEMPERATURE", "0.1"))),
-        max_tokens  = int  (kw.get("max_tokens"  ,
-                             os.getenv("LLM_MAX_TOKENS", "1024"))),
+        model_name  = kw["model_name"],
+        temperature = kw["temperature"],
+        max_tokens  = kw["max_tokens"],
+        **extra,
     )
 
 _PROVIDER_MAP = {
     "groq":         _get_groq,
 }
 
-@functools.lru_cache  # cache only *no-arg* calls
-def _get_llm_cached(provider: str):
-    return _PROVIDER_MAP[provider]()
+_DEFAULTS_MAP = {
+    "groq":         _groq_defaults,
+}
+
+
+def _normalise(provider: str, overrides: dict) -> Tuple[dict, Hashable]:
+    params = _DEFAULTS_MAP[provider]()
+    for k, v in overrides.items():
+        if v is not None:
+            params[_ALIASES.get(k, k)] = v
+    params["temperature"] = round(float(params["temperature"]), 3)
+    params["max_tokens"] = int(params["max_tokens"])
+    key = (provider,) + tuple(sorted((k, repr(v)) for k, v in params.items()))
+    return params, key
+
+
+_clients: "OrderedDict[Hashable, Any]" = OrderedDict()
+_clients_lock = threading.Lock()
+
 
 def get_llm(
         provider: str | None = None,
@@ -40,11 +102,28 @@ def get_llm(
 ):
     """
     get_llm()                            – use .env defaults
-    get_llm(model_name="llama3-8b")      – single-call override
+    get_llm(model_name="llama-3.1-8b-instant") – single-call override
+    get_llm(model=None)                  – None values keep the .env default
+    Equal (normalised) parameters return the same cached client.
     """
     sel = (provider or os.getenv("LLM_PROVIDER", "groq")).lower()
     if sel not in _PROVIDER_MAP:
         raise ValueError(f"Unknown provider '{sel}'")
-    if not overrides:
-        return _get_llm_cached(sel)
-    return _PROVIDER_MAP[sel](**overrides)
+    params, key = _normalise(sel, overrides)
+    with _clients_lock:
+        llm = _clients.get(key)
+        if llm is not None:
+            _clients.move_to_end(key)
+            return llm
+    llm = _PROVIDER_MAP[sel](**params)
+    with _clients_lock:
+        llm = _clients.setdefault(key, llm)          # another thread may have won
+        _clients.move_to_end(key)
+        while len(_clients) > max(1, LLM_CLIENT_CACHE_SIZE):
+            _clients.popitem(last=False)             # HTTP pool is shared – nothing to close
+    return llm
+
+
+def llm_cache_info() -> dict:
+    with _clients_lock:
+        return {"clients": len(_clients), "max": LLM_CLIENT_CACHE_SIZE}
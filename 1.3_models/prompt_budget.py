@@ -0,0 +1,166 @@
+"""
+Token-budgeted prompt assembly.
+
+Usage
+-----
+pb = PromptBuilder(model="llama-3.3-70b-versatile")
+pb.add("question", q_text, priority=0)
+pb.add("answer",   student_answer, priority=1, max_tokens=1500)
+pb.add_items("chunks", ranked_chunks, priority=3)     # best first
+parts = pb.build()            # {"question": "...", "chunks": "...", …}
+pb.report                     # per-section token usage
+
+Sections are filled in priority order (0 first) until the model's budget
+is used up; a section that does not fit is truncated at a token boundary
+and lower-priority sections get what is left.  Lines already present in
+an earlier section (≥ PROMPT_DEDUPE_MIN_CHARS) are dropped from ranked
+items, so overlapping chunks / blobs are not paid for twice.
+
+Tokens are counted with tiktoken (PROMPT_TOKEN_ENCODING, cl100k_base by
+default – close to the Llama 3 tokenizer) or estimated when unavailable.
+Budgets: PROMPT_BUDGETS="model=tokens,model=tokens", else the table
+below, else PROMPT_BUDGET_TOKENS.
+"""
+
+from __future__ import annotations
+import os, re, functools, logging
+from typing import Callable, Dict, Iterable, List, Optional
+
+__all__ = ["PromptBuilder", "prompt_budget", "count_tokens"]
+
+DEFAULT_PROMPT_BUDGET = int(os.getenv("PROMPT_BUDGET_TOKENS", "6000"))
+PROMPT_DEDUPE_MIN_CHARS = int(os.getenv("PROMPT_DEDUPE_MIN_CHARS", "24"))
+MIN_PARTIAL_TOKENS = 48         # don't append a truncated item shorter than this
+
+# Prompt tokens per evaluation call, kept well under Groq's per-minute limits
+_MODEL_BUDGETS = {
+    "llama-3.3-70b-versatile": 6000,
+    "llama-3.1-70b-versatile": 6000,
+    "llama3-70b-8192":         6000,
+    "llama-3.1-8b-instant":    5000,
+    "llama3-8b-8192":          5000,
+    "gemma2-9b-it":            5000,
+}
+
+
+def prompt_budget(model: Optional[str]) -> int:
+    overrides = {}
+    for item in os.getenv("PROMPT_BUDGETS", "").split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip().isdigit():
+            overrides[name.strip()] = int(value)
+    model = model or ""
+    return overrides.get(model) or _MODEL_BUDGETS.get(model) or DEFAULT_PROMPT_BUDGET
+
+
+@functools.lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(os.getenv("PROMPT_TOKEN_ENCODING", "cl100k_base"))
+    except Exception:                    # not installed / encoding not downloadable
+        logging.warning("tiktoken unavailable – estimating prompt tokens")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    enc = _encoding()
+    if enc is None:
+        return (len(text) + 3) // 4
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    enc = _encoding()
+    if enc is None:
+        return text[:max_tokens * 4]
+    ids = enc.encode(text, disallowed_special=())
+    return text if len(ids) <= max_tokens else enc.decode(ids[:max_tokens])
+
+
+_TAG = re.compile(r"^\s*\[[A-Za-z]+:[^\]]*\]\s*")     # leading citation tag, e.g. [KB:x#chunk0]
+
+
+def _norm_line(line: str) -> str:
+    return re.sub(r"\s+", " ", _TAG.sub("", line)).strip().lower()
+
+
+class PromptBuilder:
+    def __init__(self, model: Optional[str] = None, budget: Optional[int] = None,
+                 count: Callable[[str], int] = count_tokens):
+        self.model = model
+        self.budget = budget if budget is not None else prompt_budget(model)
+        self._count = count
+        self._sections: List[dict] = []
+        self.report: Dict[str, object] = {}
+
+    def add(self, name: str, text: str, priority: int, max_tokens: Optional[int] = None):
+        """One block of text, kept whole if it fits."""
+        self._sections.append({"name": name, "items": [text or ""], "priority": priority,
+                               "max_tokens": max_tokens, "dedupe": False, "sep": ""})
+        return self
+
+    def add_items(self, name: str, items: Iterable[str], priority: int,
+                  max_tokens: Optional[int] = None, sep: str = "\n"):
+        """Ranked items (best first); duplicates of earlier text are removed."""
+        self._sections.append({"name": name, "items": [i for i in items if i], "priority": priority,
+                               "max_tokens": max_tokens, "dedupe": True, "sep": sep})
+        return self
+
+    def _dedupe(self, text: str, seen: set) -> str:
+        kept = []
+        for line in text.splitlines():
+            key = _norm_line(line)
+            if len(key) >= PROMPT_DEDUPE_MIN_CHARS and key in seen:
+                continue
+            kept.append(line)
+        return "\n".join(kept).strip()
+
+    def build(self) -> Dict[str, str]:
+        """Return {section name: text} within the budget and fill self.report."""
+        remaining = self.budget
+        seen: set = set()
+        out: Dict[str, str] = {}
+        sections_report: Dict[str, dict] = {}
+        for sec in sorted(self._sections, key=lambda s: s["priority"]):
+            cap = remaining if sec["max_tokens"] is None else min(remaining, sec["max_tokens"])
+            parts: List[str] = []
+            used = dropped = deduped = 0
+            truncated = False
+            for i, item in enumerate(sec["items"]):
+                text = self._dedupe(item, seen) if sec["dedupe"] else item
+                if not text:
+                    deduped += 1
+                    continue
+                cost = self._count(text) + (self._count(sec["sep"]) if parts else 0)
+                if used + cost > cap:
+                    room = cap - used
+                    partial = _truncate(text, room) if (not sec["dedupe"] or room >= MIN_PARTIAL_TOKENS) else ""
+                    if partial:
+                        parts.append(partial)
+                        used += self._count(partial)
+                    truncated = True
+                    dropped = len(sec["items"]) - i - (1 if partial else 0)
+                    break
+                parts.append(text)
+                used += cost
+            for p in parts:
+                seen.update(k for k in map(_norm_line, p.splitlines())
+                            if len(k) >= PROMPT_DEDUPE_MIN_CHARS)
+            out[sec["name"]] = sec["sep"].join(parts)
+            remaining -= used
+            sections_report[sec["name"]] = {"tokens": used, "items": len(parts),
+                                             "dropped": dropped, "deduped": deduped,
+                                             "truncated": truncated}
+        self.report = {"model": self.model, "budget": self.budget,
+                       "total": self.budget - remaining, "sections": sections_report}
+        return out
+
+    def summary(self) -> str:
+        """One-line token report, e.g. for logging."""
+        secs = self.report.get("sections", {})
+        body = ", ".join(f"{n}={s['tokens']}" + ("*" if s["truncated"] else "")
+                         for n, s in secs.items())
+        return f"{self.report.get('total', 0)}/{self.budget} tokens ({body})"
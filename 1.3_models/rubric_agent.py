@@ -1,4 +1,5 @@
 from llm_provider import get_llm
+from llm_gateway import llm_call, INTERACTIVE
 
 # Initialize the LLM
 llm = get_llm()
@@ -39,7 +40,7 @@ Feedback: <Your feedback here>
     """
 
     try:
-        response = llm.invoke(prompt).content.strip()
+        response = llm_call(llm, prompt, priority=INTERACTIVE).strip()
         correct = "Yes" in response.splitlines()[0]
         feedback = "\n".join(response.splitlines()[1:])
         return feedback, correct
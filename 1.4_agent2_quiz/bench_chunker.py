@@ -0,0 +1,87 @@
+# bench_chunker.py   ── run from the project root
+"""
+Compare the legacy 800/200-word chunker with kb_chunker.iter_chunks.
+
+    python 1.4_agent2_quiz/bench_chunker.py notes.md lab3.txt [--k 3] [--queries 50]
+
+For each chunker it reports the number of chunks, tokens sent to the
+embedding model, approximate index size (vectors + text) and build time,
+plus retrieval recall@k: sentences sampled from the documents are used
+as queries, and a query counts as a hit when one of the top-k chunks
+contains that sentence.  Run with EMBED_CACHE=0 for cold build timings.
+"""
+
+import argparse, pathlib, random, re, sys, time
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+for sub in ("1.2_back_end", "1.4_agent2_quiz"):
+    if str(ROOT / sub) not in sys.path:
+        sys.path.insert(0, str(ROOT / sub))
+
+from langchain_community.vectorstores import FAISS
+from embedding_service import get_embeddings, embedding_token_counter
+from kb_chunker import iter_chunks
+
+
+def legacy_chunks(text, chunk_size=800, overlap=200):
+    # the whitespace windows kb_rag used before kb_chunker
+    words = text.split()
+    i = 0
+    while i < len(words):
+        yield " ".join(words[i:i + chunk_size])
+        i += chunk_size - overlap
+
+
+def _norm(s):
+    return re.sub(r"\s+", " ", s).strip().lower()
+
+
+def sample_queries(texts, n, seed=13):
+    sentences = []
+    for t in texts:
+        for s in re.split(r"(?<=[.!?])\s+|\n{2,}", t):
+            if len(s.split()) >= 8:
+                sentences.append(s.strip())
+    random.Random(seed).shuffle(sentences)
+    return sentences[:n]
+
+
+def run(name, chunks, queries, k, count):
+    embs = get_embeddings()
+    t0 = time.perf_counter()
+    store = FAISS.from_texts(chunks, embs)
+    build_s = time.perf_counter() - t0
+    dim = store.index.d
+    size = len(chunks) * dim * 4 + sum(len(c.encode("utf-8")) for c in chunks)
+    hits = 0
+    t0 = time.perf_counter()
+    for q in queries:
+        found = store.similarity_search(q, k=k)
+        if any(_norm(q) in _norm(d.page_content) for d in found):
+            hits += 1
+    query_ms = (time.perf_counter() - t0) * 1000 / max(1, len(queries))
+    tokens = sum(count(c) for c in chunks)
+    print(f"{name:<10} chunks={len(chunks):>5}  tokens={tokens:>8,}  "
+          f"index≈{size / 1e6:6.2f} MB  build={build_s:6.1f}s  "
+          f"recall@{k}={hits / max(1, len(queries)):.2%}  query={query_ms:.1f} ms")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("files", nargs="+")
+    ap.add_argument("--k", type=int, default=3)
+    ap.add_argument("--queries", type=int, default=50)
+    args = ap.parse_args()
+
+    texts = [pathlib.Path(f).read_text(encoding="utf-8", errors="ignore") for f in args.files]
+    queries = sample_queries(texts, args.queries)
+    count = embedding_token_counter()
+    print(f"{len(texts)} document(s), {sum(map(len, texts)):,} chars, {len(queries)} queries")
+
+    run("legacy", [c for t in texts for c in legacy_chunks(t)], queries, args.k, count)
+    run("kb_chunker", [c.text for t in texts for c in iter_chunks(t, count_tokens=count)],
+        queries, args.k, count)
+
+
+if __name__ == "__main__":
+    main()
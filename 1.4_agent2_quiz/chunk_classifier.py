@@ -54,25 +54,48 @@
 
 # ────────────────────────────────────────────────────────────────
 #  chunk_classifier.py
-#  Two-label Groq-LLM classifier → "question" | "context"
+#  Multi-label Groq-LLM classifier → question | answer | code | context | metadata
 # ────────────────────────────────────────────────────────────────
 """
 Called by context_binder.assign_context_to_questions().
 If the LLM call fails or returns something unexpected we
-gracefully fall back to "context" so extraction never crashes.
+gracefully fall back to "context" so extraction never crashes; that
+fallback is not memoised, so a transient failure is retried next time.
+
+classify_chunks(chunks) labels a whole PDF at once: chunks are numbered
+and packed into prompts of ≤ CLASSIFIER_BATCH_TOKENS, the batches run
+concurrently, and the "n: label" replies are parsed back; any chunk a
+reply leaves out (or mislabels) is retried on its own.  Labels are
+memoised by chunk hash, so re-running a PDF costs no LLM calls.  The
+LLM client is only created on the first call.
+
+Before any of that, prelabel() settles the obvious chunks locally – page
+numbers and headings (metadata), fenced or line-by-line code (code),
+"Q3." / "Question 3" / short "…?" chunks (question), "Answer:" /
+"Solution:" blocks (answer).  Only chunks it returns None for go to the
+LLM; classify_chunks() logs the fraction it resolved and keeps the
+counts in last_stats.
 """
 
-from typing import Literal
-import os, logging
+from typing import Dict, List, Literal, Optional, Sequence
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os, re, hashlib, logging, threading
 from llm_provider import get_llm   # helper already in your repo
+from llm_gateway import llm_call, BATCH
+from prompt_budget import count_tokens
 
-__all__ = ["classify_chunk"]
+__all__ = ["classify_chunk", "classify_chunks", "prelabel"]
 
 logging.basicConfig(level=logging.INFO)
 
-LLM = get_llm(model=os.getenv("CLASSIFIER_MODEL",
-                                   "llama3-8b-8192"))
-+# 2025-05-10  update – allow richer labels so we keep useful chunks
+CLASSIFIER_MODEL        = os.getenv("CLASSIFIER_MODEL")      # unset → GROQ_MODEL
+CLASSIFIER_BATCH_TOKENS = int(os.getenv("CLASSIFIER_BATCH_TOKENS", "3000"))   # chunk text per prompt
+CLASSIFIER_CONCURRENCY  = int(os.getenv("CLASSIFIER_CONCURRENCY", "4"))
+CLASSIFIER_MEMO_SIZE    = int(os.getenv("CLASSIFIER_MEMO_SIZE", "20000"))
+_CHUNK_CHARS = 1500                    # per chunk, as in the single-chunk prompt
+
+# 2025-05-10  update – allow richer labels so we keep useful chunks
 _VALID: set[str] = {
     "question",          # learner must answer
     "context",           # general instructional text
@@ -80,38 +103,224 @@ _VALID: set[str] = {
     "code",              # code blocks or variable tables
     "metadata",          # headings, section titles …
 }
+Label = Literal["question", "context", "answer", "code", "metadata"]
 
+_LABELS_HELP = (
+    "  question  – learner must answer\n"
+    "  answer    – model answer / rubric\n"
+    "  code      – code blocks, tables of variables/constants\n"
+    "  context   – explanatory prose, instructions\n"
+    "  metadata  – headings, page numbers, boiler-plate\n\n"
+)
 
-def classify_chunk(text: str) -> Literal["question", "context"]:
-    """
-    Identify whether *text* is an assessment question (learner
-    must answer) or just explanatory / code / metadata context.
 
-    Returns one of the strings in _VALID.
-    """
+def _llm():
+    return get_llm(model=CLASSIFIER_MODEL)    # get_llm caches the client
+
+
+_memo: "OrderedDict[str, str]" = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def _key(text: str) -> str:
+    return hashlib.sha256(text.strip().encode("utf-8")).hexdigest()
+
+
+def _memo_get(key: str) -> Optional[str]:
+    with _memo_lock:
+        label = _memo.get(key)
+        if label is not None:
+            _memo.move_to_end(key)
+        return label
+
+
+def _memo_put(key: str, label: str) -> None:
+    with _memo_lock:
+        _memo[key] = label
+        _memo.move_to_end(key)
+        while len(_memo) > max(1, CLASSIFIER_MEMO_SIZE):
+            _memo.popitem(last=False)
+
+
+def _classify_one(text: str) -> Optional[str]:
+    """LLM label for *text*, or None when the call fails or the reply is not a label."""
     prompt = (
         "Classify the PDF chunk below.  Return **exactly one word** "
         "from this list:\n"
-        "  question  – learner must answer\n"
-        "  answer    – model answer / rubric\n"
-        "  code      – code blocks, tables of variables/constants\n"
-        "  context   – explanatory prose, instructions\n"
-        "  metadata  – headings, page numbers, boiler-plate\n\n"
+        + _LABELS_HELP +
         "-----\n"
-        f"{text.strip()[:1500]}\n"
+        f"{text.strip()[:_CHUNK_CHARS]}\n"
         "-----\n"
         "One-word answer:"
     )
 
     try:
-        label = LLM.invoke(prompt).content.strip().lower()
+        label = llm_call(_llm(), prompt, priority=BATCH).strip().lower()
     except Exception:
         logging.exception("LLM call failed – defaulting to 'context'")
-        return "context"
+        return None
 
     if label not in _VALID:
         logging.warning("Unexpected label '%s' – coerced to 'context'", label)
-        return "context"
+        return None
 
     logging.debug("%-8s | %.90s", label, text.replace("\n", " "))
+    return label
+
+
+# ── local first stage ────────────────────────────────────────────────
+_PAGE_NO   = re.compile(r"^(page\s*)?[-–(\[]?\s*\d{1,4}\s*([-–)\]]|(of|/)\s*\d{1,4})?\s*$", re.I)
+_BOILER    = re.compile(r"^(©|\(c\)|copyright\b|all rights reserved|confidential\b)", re.I)
+_MD_HEAD   = re.compile(r"^#{1,6}\s+\S")
+_Q_LABEL   = re.compile(r"^(q(uestion)?\s*\d+[a-z]?\s*[.:)\-]|\(?[a-z]\)\s+\S.*\?$)", re.I)
+_ANSWER    = re.compile(r"^(answer|solution|model answer|sample answer|marking (rubric|scheme)|rubric)\s*[:\-]", re.I)
+_CODE_LINE = re.compile(r"^(\s{4,}\S|\s*(def|class|import|from|for|while|if|elif|else|try|except|with|return|print)\b"
+                        r"|.*[;{}]\s*$|\s*[A-Za-z_][\w.\[\]]*\s*[+\-*/]?=\s*\S|\s*#\s|\s*>>>)")
+
+
+def prelabel(text: str) -> Optional[str]:
+    """Label for chunks that are obvious from their shape, else None."""
+    t = text.strip()
+    if not t:
+        return "metadata"
+    lines = [l for l in t.splitlines() if l.strip()]
+    first = lines[0].strip()
+    if len(lines) <= 2 and all(_PAGE_NO.match(l.strip()) or _BOILER.match(l.strip()) for l in lines):
+        return "metadata"
+    if t.startswith(("```", "~~~")) and t.rstrip().endswith(("```", "~~~")) and len(lines) >= 2:
+        return "code"
+    if _ANSWER.match(first):
+        return "answer"
+    if _Q_LABEL.match(first):
+        return "question"
+    if len(lines) >= 3 and sum(bool(_CODE_LINE.match(l)) for l in lines) >= 0.8 * len(lines):
+        return "code"
+    words = len(t.split())
+    if len(lines) == 1 and words <= 12 and not t.endswith((".", "?", ":")) and \
+            (_MD_HEAD.match(t) or (t.isupper() and sum(c.isalpha() for c in t) >= 4)):
+        return "metadata"
+    if t.endswith("?") and words <= 60 and len(lines) <= 3:
+        return "question"
+    return None
+
+
+def classify_chunk(text: str) -> Label:
+    """
+    Identify whether *text* is an assessment question (learner
+    must answer) or just explanatory / code / metadata context.
+
+    Returns one of the strings in _VALID.
+    """
+    label = prelabel(text)
+    if label is not None:
+        return label  # type: ignore[return-value]
+    key = _key(text)
+    label = _memo_get(key)
+    if label is None:
+        label = _classify_one(text)
+        if label is None:
+            return "context"
+        _memo_put(key, label)
     return label  # type: ignore[return-value]
+
+
+# ── batching ─────────────────────────────────────────────────────────
+_REPLY_LINE = re.compile(r"^\W*(\d+)\W+([a-z]+)", re.M)
+
+
+def _batch_prompt(texts: Sequence[str]) -> str:
+    body = "\n".join(f"### {n}\n{t.strip()[:_CHUNK_CHARS]}" for n, t in enumerate(texts, start=1))
+    return (
+        f"Classify each of the {len(texts)} numbered PDF chunks below with "
+        "**exactly one word** from this list:\n"
+        + _LABELS_HELP +
+        "-----\n"
+        f"{body}\n"
+        "-----\n"
+        "Answer with one line per chunk, in order, formatted `<number>: <label>` "
+        "and nothing else."
+    )
+
+
+def _parse_labels(reply: str, n: int) -> Dict[int, str]:
+    """{chunk number: label} for every well-formed line of *reply*."""
+    labels: Dict[int, str] = {}
+    for m in _REPLY_LINE.finditer(reply.lower()):
+        num, label = int(m.group(1)), m.group(2)
+        if 1 <= num <= n and label in _VALID:
+            labels.setdefault(num, label)
+    return labels
+
+
+def _batches(texts: Sequence[str], budget: int) -> List[List[int]]:
+    """Indexes of *texts* packed greedily into batches of ≤ *budget* tokens."""
+    batches: List[List[int]] = []
+    cur: List[int] = []
+    used = 0
+    for i, t in enumerate(texts):
+        cost = count_tokens(t.strip()[:_CHUNK_CHARS]) + 4
+        if cur and used + cost > budget:
+            batches.append(cur)
+            cur, used = [], 0
+        cur.append(i)
+        used += cost
+    if cur:
+        batches.append(cur)
+    return batches
+
+
+def _classify_batch(texts: Sequence[str]) -> List[Optional[str]]:
+    """LLM labels for *texts*; None where no valid label could be obtained."""
+    if len(texts) == 1:
+        return [_classify_one(texts[0])]
+    try:
+        reply = llm_call(_llm(), _batch_prompt(texts), priority=BATCH)
+        labels = _parse_labels(reply, len(texts))
+    except Exception:
+        logging.exception("Batch classification failed – classifying chunks one by one")
+        labels = {}
+    missing = [n for n in range(1, len(texts) + 1) if n not in labels]
+    if missing:
+        logging.warning("Batch reply missed %d/%d chunks – retrying them singly", len(missing), len(texts))
+        for n in missing:
+            labels[n] = _classify_one(texts[n - 1])
+    return [labels[n] for n in range(1, len(texts) + 1)]
+
+
+last_stats: Dict[str, int] = {}
+
+
+def classify_chunks(chunks: Sequence[str],
+                    batch_tokens: int = CLASSIFIER_BATCH_TOKENS,
+                    max_workers: int = CLASSIFIER_CONCURRENCY) -> List[Label]:
+    """Labels for *chunks*, in order (one of _VALID each)."""
+    global last_stats
+    labels: List[Optional[str]] = [prelabel(c) for c in chunks]
+    by_rules = sum(label is not None for label in labels)
+    keys = [_key(c) for c in chunks]
+    todo: Dict[str, int] = {}                   # unique uncached chunk → first index
+    for i, k in enumerate(keys):
+        if labels[i] is None:
+            labels[i] = _memo_get(k)
+            if labels[i] is None:
+                todo.setdefault(k, i)
+    order = list(todo.values())
+    texts = [chunks[i] for i in order]
+    batches = _batches(texts, batch_tokens)
+    if batches:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches))),
+                                thread_name_prefix="chunk-classify") as pool:
+            results = pool.map(lambda b: _classify_batch([texts[j] for j in b]), batches)
+            fresh: Dict[str, Optional[str]] = {}
+            for batch, batch_labels in zip(batches, results):
+                for j, label in zip(batch, batch_labels):
+                    fresh[keys[order[j]]] = label
+                    if label is not None:           # only real LLM labels are memoised
+                        _memo_put(keys[order[j]], label)
+        labels = [label if label is not None else fresh[k] or "context" for k, label in zip(keys, labels)]
+    last_stats = {"chunks": len(chunks), "rules": by_rules, "llm": len(texts), "batches": len(batches)}
+    if chunks:
+        logging.info("Classified %d chunks: %d (%.0f%%) by local rules, %d unique via the LLM "
+                     "in %d batch(es), the rest memoised", len(chunks), by_rules,
+                     100.0 * by_rules / len(chunks), len(texts), len(batches))
+    return labels  # type: ignore[return-value]
@@ -3,52 +3,73 @@
 #  Attach preceding context / code to every QUESTION chunk
 # ────────────────────────────────────────────────────────────────
 """
-Works in tandem with chunk_classifier.classify_chunk().
-Window size can be increased (default = 3) if you feel context
-is still too sparse.
+Works in tandem with chunk_classifier.classify_chunks() (one batched,
+concurrent pass over all chunks).
+
+Per-chunk features (label, stripped text, looks-like-code, tokens) are
+computed once into arrays.  Each question then takes the widest
+symmetric neighbour window – up to _MAX_WINDOW chunks either side – whose
+bindable text fits BINDER_CONTEXT_TOKENS; window costs for every
+question and width come from one prefix sum.  Sparse sheets therefore
+get wider windows, dense ones narrower, and at least ±1 chunk is always
+used.
 """
 
+import os
 from typing import List, Dict
-from chunk_classifier import classify_chunk
-
-__all__ = ["assign_context_to_questions"]
 
-_WINDOW = 3                           # ← broaden if you like (e.g. 5)
-_CODE_HINTS = ("```", "print(", "=")  # quick-n-dirty code heuristics
+import numpy as np
 
+from chunk_classifier import classify_chunks
+from prompt_budget import count_tokens
 
-def assign_context_to_questions(chunks: List[str]) -> List[Dict]:
-    """Return [{'id', 'question', 'context'}, …]"""
-    labeled = [{"text": c, "label": classify_chunk(c)} for c in chunks]
+__all__ = ["assign_context_to_questions"]
 
-    questions = []
-    for idx, item in enumerate(labeled):
-        if item["label"] != "question":
-            continue
+_MAX_WINDOW = int(os.getenv("BINDER_MAX_WINDOW", "6"))               # chunks either side
+_CONTEXT_TOKENS = int(os.getenv("BINDER_CONTEXT_TOKENS", "1500"))    # bound context per question
+_CODE_HINTS = ("```", "print(", "=")  # quick-n-dirty code heuristics
 
-        ctx_parts, code_parts = [], []
 
-        for off in range(-_WINDOW, _WINDOW + 1):
-            if off == 0 or not (0 <= idx + off < len(labeled)):
-                continue
-            neighbour = labeled[idx + off]
+def _window_sizes(q_idx: np.ndarray, cost: np.ndarray) -> np.ndarray:
+    """Largest w in [1, _MAX_WINDOW] per question with window cost ≤ budget."""
+    n = len(cost)
+    prefix = np.concatenate(([0], np.cumsum(cost)))
+    widths = np.arange(1, max(1, _MAX_WINDOW) + 1)[:, None]              # (W, 1)
+    lo = np.clip(q_idx[None, :] - widths, 0, n)
+    hi = np.clip(q_idx[None, :] + widths + 1, 0, n)
+    totals = prefix[hi] - prefix[lo] - cost[q_idx][None, :]              # (W, nq)
+    fits = totals <= _CONTEXT_TOKENS
+    fits[0, :] = True                                                    # always ±1
+    # widths are monotone in cost: count fitting rows from the top
+    return np.cumprod(fits, axis=0).sum(axis=0)
 
-            if neighbour["label"] == "question":
-                continue
 
-            text = neighbour["text"].strip()
-            looks_like_code = any(h in text for h in _CODE_HINTS)
+def assign_context_to_questions(chunks: List[str]) -> List[Dict]:
+    """Return [{'id', 'question', 'context'}, …]"""
+    labels = np.array(classify_chunks(chunks), dtype=object)
+    texts = [c.strip() for c in chunks]
+    is_question = labels == "question"
+    if not is_question.any():
+        return []
+    is_code = np.fromiter((any(h in t for h in _CODE_HINTS) for t in texts), dtype=bool, count=len(texts))
+    bindable = ~is_question & (is_code | (labels == "context"))
+    cost = np.array([count_tokens(t) if b else 0 for t, b in zip(texts, bindable)], dtype=np.int64)
 
-            if looks_like_code:
-                code_parts.append(text)
-            elif neighbour["label"] == "context":
-                ctx_parts.append(text)
+    q_idx = np.flatnonzero(is_question)
+    widths = _window_sizes(q_idx, cost)
 
+    questions = []
+    for i, w in zip(q_idx, widths):
+        lo, hi = max(0, i - w), min(len(texts), i + w + 1)
+        window = np.arange(lo, hi)
+        window = window[bindable[lo:hi]]               # never the question itself
+        code_parts = [texts[j] for j in window[is_code[window]]]
+        ctx_parts = [texts[j] for j in window[~is_code[window]]]
         context_blob = "\n\n".join(code_parts + ctx_parts)
 
         questions.append({
             "id": len(questions) + 1,
-            "question": item["text"].strip(),
+            "question": texts[i],
             "context": context_blob.strip()
         })
 
@@ -0,0 +1,156 @@
+"""
+index_cache.py
+────────────────────────────────────────────────────────────────────────
+In-memory LRU cache of loaded vector stores.
+
+FAISS.load_local() reads the index and unpickles the docstore on every
+call.  Stores are now kept in memory, keyed by a string (e.g.
+"COMP801_Week 1" or an absolute path) and tagged with a *version*.  A
+lookup whose version differs from the cached one reloads the store, so
+a rebuilt index is picked up without restarting the app.
+
+    store = index_cache.get(key, version, loader)   # loader() on miss
+    index_cache.put(key, version, store)            # swap in a fresh build
+    index_cache.stats()
+
+Eviction is least-recently-used, bounded by both an entry count and an
+approximate byte budget (vectors + chunk text).
+"""
+
+from __future__ import annotations
+import os, threading, logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+__all__ = ["IndexCache", "index_cache", "dir_version", "estimate_store_bytes"]
+
+INDEX_CACHE_MB          = int(os.getenv("INDEX_CACHE_MB", "512"))
+INDEX_CACHE_MAX_ENTRIES = int(os.getenv("INDEX_CACHE_MAX_ENTRIES", "16"))
+
+
+def estimate_store_bytes(store: Any) -> int:
+    """Rough resident size of a LangChain FAISS store (vectors + texts)."""
+    lexical = getattr(store, "lexical", None)          # kb_lexical.BM25Index
+    total = lexical.approx_bytes() if lexical is not None else 0
+    if hasattr(store, "resident_bytes"):      # mmap store – pages are shared
+        return total + int(store.resident_bytes())
+    index = getattr(store, "index", None)
+    if index is not None:
+        total += int(getattr(index, "ntotal", 0)) * int(getattr(index, "d", 0)) * 4
+    docs = getattr(getattr(store, "docstore", None), "_dict", None) or {}
+    for doc in docs.values():
+        total += len(getattr(doc, "page_content", "") or "")
+    return total
+
+
+def dir_version(path: Path) -> Optional[Tuple[int, int]]:
+    """Version tag for an on-disk store: (mtime_ns, size) of CURRENT (mmap
+    store rewritten into versions/), store.hdr (mmap format, written last)
+    or index.faiss (legacy FAISS folder)."""
+    for name in ("CURRENT", "store.hdr", "index.faiss"):
+        try:
+            st = (Path(path) / name).stat()
+            break
+        except OSError:
+            continue
+    else:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class IndexCache:
+    """Thread-safe LRU of (version, store) pairs with a byte budget."""
+
+    def __init__(self,
+                 max_bytes: int = INDEX_CACHE_MB * 1024 * 1024,
+                 max_entries: int = INDEX_CACHE_MAX_ENTRIES,
+                 sizer: Callable[[Any], int] = estimate_store_bytes):
+        self.max_bytes = max_bytes
+        self.max_entries = max(1, max_entries)
+        self._sizer = sizer
+        self._entries: "OrderedDict[Hashable, Tuple[Hashable, Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self.hits = self.misses = self.evictions = 0
+
+    # ── lookups ────────────────────────────────────────────────────────
+    def peek(self, key: Hashable, version: Hashable = None) -> Optional[Any]:
+        """Return the cached store if present (and matching *version*)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (version is not None and entry[0] != version):
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def get(self, key: Hashable, version: Hashable,
+            loader: Callable[[], Any]) -> Any:
+        """Return the store for *key* at *version*, calling loader() on a miss.
+
+        Concurrent misses for the same key wait for a single load.
+        """
+        store = self.peek(key, version)
+        if store is not None:
+            return store
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            store = self.peek(key, version)      # another thread loaded it
+            if store is not None:
+                return store
+            with self._lock:
+                self.misses += 1
+            store = loader()
+            if store is not None:
+                self.put(key, version, store)
+            return store
+
+    # ── mutation ───────────────────────────────────────────────────────
+    def put(self, key: Hashable, version: Hashable, store: Any) -> None:
+        """Insert / replace *key* in one step – readers see old or new, never both."""
+        nbytes = self._sizer(store)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[key] = (version, store, nbytes)
+            self._bytes += nbytes
+            self._evict_locked(keep=key)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _evict_locked(self, keep: Hashable) -> None:
+        while self._entries and (len(self._entries) > self.max_entries
+                                 or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            if oldest == keep:
+                break                      # a single oversized store stays usable
+            _, _, nbytes = self._entries.pop(oldest)
+            self._bytes -= nbytes
+            self.evictions += 1
+            logging.info("index_cache: evicted %s (%d bytes)", oldest, nbytes)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+index_cache = IndexCache()
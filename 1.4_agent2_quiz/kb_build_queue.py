@@ -0,0 +1,131 @@
+"""
+kb_build_queue.py
+────────────────────────────────────────────────────────────────────────
+Background builds of the per-(subject, week) knowledgebase index.
+
+The teacher page enqueues a build whenever the knowledgebase doc or the
+quiz is saved.  Each job rebuilds the index (a no-op when the KB is
+unchanged) and then precomputes the saved quiz's per-question retrieval
+for the live index version.  Students keep querying the previously
+published index version (or the inline KB blob when none exists yet)
+until the new one is atomically swapped in by kb_rag.
+
+    schedule_kb_build(subject, week)     # non-blocking, de-duplicated
+    kb_build_status(subject, week)       # {"state": "running", …}
+
+Requests for a key that is already queued are merged.  A request that
+arrives while the same key is *running* marks it dirty so exactly one
+follow-up build runs afterwards with the latest Firestore content.
+"""
+
+from __future__ import annotations
+import os, threading, time, logging
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Dict, Optional, Tuple
+
+__all__ = ["KBBuildQueue", "schedule_kb_build", "kb_build_status"]
+
+KB_BUILD_WORKERS = int(os.getenv("KB_BUILD_WORKERS", "1"))
+
+Key = Tuple[str, str]
+
+
+def _default_build(subject: str, week: str) -> None:
+    try:
+        from .kb_rag import build_index_from_firestore_kb, precompute_quiz_retrieval_from_firestore
+    except ImportError:
+        from kb_rag import build_index_from_firestore_kb, precompute_quiz_retrieval_from_firestore
+    build_index_from_firestore_kb(subject, week)
+    # Refresh the per-question retrieval of the saved quiz for the live index
+    precompute_quiz_retrieval_from_firestore(subject, week)
+
+
+class KBBuildQueue:
+    """De-duplicating job queue running index builds on a thread pool."""
+
+    def __init__(self,
+                 build_fn: Callable[[str, str], None] = _default_build,
+                 max_workers: int = KB_BUILD_WORKERS):
+        self._build_fn = build_fn
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers),
+                                        thread_name_prefix="kb-build")
+        self._lock = threading.Lock()
+        self._status: Dict[Key, dict] = {}
+        self._futures: Dict[Key, Future] = {}
+
+    def submit(self, subject: str, week: str) -> dict:
+        """Queue a build for subject/week unless one is already pending."""
+        key = (subject, week)
+        with self._lock:
+            status = self._status.setdefault(key, {"state": "idle", "builds": 0})
+            if status["state"] == "queued":
+                return dict(status)
+            if status["state"] == "running":
+                status["dirty"] = True           # rebuild once this one finishes
+                return dict(status)
+            status.update(state="queued", queued_at=time.time(), error=None, dirty=False)
+            self._futures[key] = self._pool.submit(self._run, key)
+            return dict(status)
+
+    def _run(self, key: Key) -> None:
+        with self._lock:
+            status = self._status[key]
+            status.update(state="running", started_at=time.time(), dirty=False)
+        try:
+            self._build_fn(*key)
+        except Exception as e:
+            logging.exception("KB index build failed for %s/%s", *key)
+            with self._lock:
+                status.update(state="failed", error=str(e), finished_at=time.time())
+        else:
+            with self._lock:
+                status.update(state="done", finished_at=time.time())
+                status["builds"] += 1
+        with self._lock:
+            rerun = status.pop("dirty", False)
+        if rerun:
+            self.submit(*key)
+
+    def status(self, subject: str, week: str) -> dict:
+        with self._lock:
+            return dict(self._status.get((subject, week), {"state": "idle", "builds": 0}))
+
+    def is_building(self, subject: str, week: str) -> bool:
+        return self.status(subject, week)["state"] in ("queued", "running")
+
+    def wait(self, subject: str, week: str, timeout: Optional[float] = None) -> dict:
+        """Block until the current build for subject/week finishes (scripts/tests)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.is_building(subject, week):
+            with self._lock:
+                fut = self._futures.get((subject, week))
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if fut is not None:
+                try:
+                    fut.result(timeout=remaining)
+                except Exception:
+                    pass
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+        return self.status(subject, week)
+
+
+_queue: Optional[KBBuildQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_build_queue() -> KBBuildQueue:
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = KBBuildQueue()
+    return _queue
+
+
+def schedule_kb_build(subject: str, week: str) -> dict:
+    return get_build_queue().submit(subject, week)
+
+
+def kb_build_status(subject: str, week: str) -> dict:
+    return get_build_queue().status(subject, week)
@@ -0,0 +1,222 @@
+"""
+kb_chunker.py
+────────────────────────────────────────────────────────────────────────
+Streaming, token-aware, structure-preserving chunker for KB documents.
+
+Replaces the old 800-word / 200-word-overlap whitespace windows.  Text
+is read line by line and grouped into *blocks* – a fenced code block, a
+heading, or a paragraph – which are then packed into chunks of at most
+`max_tokens` tokens as counted by the embedding model's tokenizer:
+
+    for chunk in iter_chunks(text):            # generator – constant memory
+        chunk.text, chunk.start, chunk.end, chunk.tokens
+
+• a heading always starts a new chunk, so sections are not merged, and
+  is only emitted without a body when nothing follows it or the
+  headings alone fill the budget;
+• code fences are never split unless a single fence exceeds the budget;
+• oversized paragraphs fall back to sentence, then word, boundaries;
+• no overlap by default (overlap_tokens > 0 carries trailing blocks).
+
+`start` / `end` are character offsets into the source text.
+"""
+
+from __future__ import annotations
+import io, re
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Union
+
+__all__ = ["Chunk", "iter_chunks", "CHUNK_MAX_TOKENS"]
+
+CHUNK_MAX_TOKENS = 384          # mxbai-embed-large truncates at 512
+
+_FENCE    = re.compile(r"^\s*(```|~~~)")
+_MD_HEAD  = re.compile(r"^\s*#{1,6}\s+\S")
+_NUM_HEAD = re.compile(r"^\s*(\d+(\.\d+)*\.?|[A-Z]\.|Part\s+\w+[:.]?|Section\s+\w+[:.]?)\s+[A-Z][^.!?]{0,80}$")
+_SENTENCE = re.compile(r"(?<=[.!?])\s+")
+_CODEISH  = re.compile(r"[*=]|(^|\s)--?[A-Za-z]|[;{}]$")      # SQL / shell / code, not a title
+
+
+class Chunk(NamedTuple):
+    text: str
+    start: int          # char offset of the first character
+    end: int            # char offset one past the last character
+    tokens: int
+
+
+class _Block(NamedTuple):
+    text: str
+    start: int
+    end: int
+    kind: str           # "heading" | "code" | "para"
+
+
+def _default_counter() -> Callable[[str], int]:
+    try:
+        from .embedding_service import embedding_token_counter
+    except ImportError:
+        try:
+            from embedding_service import embedding_token_counter
+        except ImportError:
+            embedding_token_counter = None
+    if embedding_token_counter is not None:
+        return embedding_token_counter()
+    word = re.compile(r"\w+|[^\w\s]")
+    return lambda text: len(word.findall(text))
+
+
+def _is_heading(line: str) -> bool:
+    s = line.strip()
+    if not s or len(s) > 90:
+        return False
+    if _MD_HEAD.match(s):
+        return True
+    if _CODEISH.search(s):
+        return False
+    if _NUM_HEAD.match(s):
+        return True
+    # short ALL-CAPS title lines, e.g. "LAB 3 – NETWORK SCANNING"
+    letters = [c for c in s if c.isalpha()]
+    return len(letters) >= 4 and all(c.isupper() for c in letters) and not s.endswith((".", ","))
+
+
+def _iter_blocks(lines: Iterable[str]) -> Iterator[_Block]:
+    """Group raw lines (with line endings) into heading / code / paragraph blocks."""
+    pos = 0
+    buf: List[str] = []
+    buf_start = 0
+    in_code = False
+
+    def flush(kind: str):
+        text = "".join(buf).strip()
+        return _Block(text, buf_start, pos, kind) if text else None
+
+    for line in lines:
+        if in_code:
+            buf.append(line)
+            pos += len(line)
+            if _FENCE.match(line):
+                blk = flush("code")
+                if blk:
+                    yield blk
+                buf, in_code = [], False
+            continue
+        if _FENCE.match(line):
+            blk = flush("para")
+            if blk:
+                yield blk
+            buf, buf_start, in_code = [line], pos, True
+            pos += len(line)
+            continue
+        if not line.strip():
+            blk = flush("para")
+            if blk:
+                yield blk
+            pos += len(line)
+            buf, buf_start = [], pos
+            continue
+        if _is_heading(line):
+            blk = flush("para")
+            if blk:
+                yield blk
+            yield _Block(line.strip(), pos, pos + len(line.rstrip("\r\n")), "heading")
+            pos += len(line)
+            buf, buf_start = [], pos
+            continue
+        if not buf:
+            buf_start = pos
+        buf.append(line)
+        pos += len(line)
+    blk = flush("code" if in_code else "para")
+    if blk:
+        yield blk
+
+
+def _split_block(block: _Block, max_tokens: int, count: Callable[[str], int]) -> Iterator[_Block]:
+    """Split an oversized block at line/sentence boundaries, then at words."""
+    text = block.text
+    pieces = text.splitlines(keepends=True) if block.kind == "code" else _SENTENCE.split(text)
+    spans: List[tuple] = []          # (start, end, tokens) within block.text
+    cursor = 0
+    for piece in pieces:
+        if not piece.strip():
+            continue
+        off = text.find(piece, cursor)
+        off = cursor if off < 0 else off
+        cursor = off + len(piece)
+        t = count(piece)
+        if t <= max_tokens:
+            spans.append((off, cursor, t))
+        else:                                   # one huge sentence / line
+            for m in re.finditer(r"\S+", piece):
+                spans.append((off + m.start(), off + m.end(), count(m.group())))
+    group: List[tuple] = []
+    total = 0
+    for span in spans:
+        if group and total + span[2] > max_tokens:
+            g0, g1 = group[0][0], group[-1][1]
+            yield _Block(text[g0:g1].strip(), block.start + g0, block.start + g1, block.kind)
+            group, total = [], 0
+        group.append(span)
+        total += span[2]
+    if group:
+        g0, g1 = group[0][0], group[-1][1]
+        yield _Block(text[g0:g1].strip(), block.start + g0, block.start + g1, block.kind)
+
+
+def iter_chunks(source: Union[str, Iterable[str]],
+                max_tokens: int = CHUNK_MAX_TOKENS,
+                overlap_tokens: int = 0,
+                count_tokens: Optional[Callable[[str], int]] = None) -> Iterator[Chunk]:
+    """Yield Chunk(text, start, end, tokens) for *source*.
+
+    *source* may be a string or any iterable of lines that keep their line
+    endings (e.g. an open file), so large documents are never loaded whole.
+    """
+    count = count_tokens or _default_counter()
+    lines = io.StringIO(source) if isinstance(source, str) else source
+
+    parts: List[tuple] = []           # (block, tokens) in the current chunk
+    total = 0
+
+    def emit() -> Chunk:
+        text = "\n\n".join(b.text for b, _ in parts)
+        return Chunk(text, parts[0][0].start, parts[-1][0].end, sum(t for _, t in parts))
+
+    def carry() -> List[tuple]:
+        kept, used = [], 0
+        for b, t in reversed(parts):
+            if b.kind == "heading" or used + t > overlap_tokens:
+                break
+            kept.insert(0, (b, t))
+            used += t
+        return kept
+
+    def split(block: _Block, budget: int) -> List[tuple]:
+        tokens = count(block.text)
+        return [(block, tokens)] if tokens <= budget else \
+            [(b, count(b.text)) for b in _split_block(block, budget, count)]
+
+    for block in _iter_blocks(lines):
+        pieces = split(block, max_tokens)
+        if parts and block.kind != "heading" and all(b.kind == "heading" for b, _ in parts) \
+                and total + pieces[0][1] > max_tokens and max_tokens - total > 0:
+            # Never emit a heading on its own: split so the first piece fits
+            # under the pending heading(s) and the rest follows at full size.
+            head = split(block, max_tokens - total)
+            if len(head) > 1:
+                rest = _Block(block.text[head[1][0].start - block.start:].strip(),
+                              head[1][0].start, block.end, block.kind)
+                pieces = [head[0]] + split(rest, max_tokens)
+        for blk, t in pieces:
+            starts_section = blk.kind == "heading"
+            only_headings = all(b.kind == "heading" for b, _ in parts)
+            if parts and (total + t > max_tokens or (starts_section and not only_headings)):
+                yield emit()
+                parts = carry() if overlap_tokens > 0 and not starts_section else []
+                while parts and sum(pt for _, pt in parts) + t > max_tokens:
+                    parts.pop(0)
+                total = sum(pt for _, pt in parts)
+            parts.append((blk, t))
+            total += t
+    if parts:
+        yield emit()
@@ -0,0 +1,153 @@
+"""
+kb_content_cache.py
+────────────────────────────────────────────────────────────────────────
+Process-wide cache of the knowledgebase/{subject}_{week}_kb documents.
+
+The quiz agent (every answer), the index build and the teacher page all
+read the same Firestore doc.  get_kb_snapshot() serves it from memory:
+
+    snap = get_kb_snapshot(db, subject, week)
+    snap.raw        # the stored `knowledgebase` list, untouched
+    snap.entries    # normalised dicts {name, type, content, url, uploaded_at, uploader}
+    snap.blob       # joined content the quiz agent sends as inline KB
+    snap.hashes     # {entry name: sha256 of its content}
+
+A snapshot younger than KB_CACHE_TTL seconds is returned as is.  An older
+one is revalidated with a field-masked read (no KB content transferred)
+and only re-downloaded when the document's update_time changed.
+max_age=0 forces that check, e.g. for index builds.  Writers call
+invalidate() after saving.
+"""
+
+from __future__ import annotations
+import os, time, hashlib, threading
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+__all__ = ["KBSnapshot", "KBContentCache", "kb_content_cache", "get_kb_snapshot"]
+
+KB_CACHE_TTL         = float(os.getenv("KB_CACHE_TTL", "60"))
+KB_CACHE_MAX_ENTRIES = int(os.getenv("KB_CACHE_MAX_ENTRIES", "64"))
+
+
+class KBSnapshot(NamedTuple):
+    subject: str
+    week: str
+    update_time: Any            # Firestore update_time of the doc (None if missing)
+    raw: list
+    entries: List[dict]
+    blob: str
+    hashes: Dict[str, str]
+    fetched_at: float           # time.monotonic() of the last validation
+
+
+def normalize_entries(kb) -> List[dict]:
+    """Entries as dicts with cleaned names (the teacher page's view)."""
+    normalized = []
+    for it in (kb if isinstance(kb, list) else [kb] if kb else []):
+        if isinstance(it, dict):
+            normalized.append({
+                'name': (it.get('name') or '').replace('\n', ' ').strip(),
+                'type': it.get('type', 'unknown'),
+                'content': it.get('content'),
+                'url': it.get('url'),
+                'uploaded_at': it.get('uploaded_at'),
+                'uploader': it.get('uploader'),
+            })
+        else:
+            name = str(it).replace('\n', ' ').strip()
+            normalized.append({'name': name, 'type': 'unknown', 'content': None, 'url': None})
+    return normalized
+
+
+def join_blob(kb) -> str:
+    """Content of every entry joined for the LLM prompt; entries without
+    content contribute their url or name."""
+    contents = []
+    for item in (kb if isinstance(kb, list) else [kb] if kb else []):
+        if isinstance(item, dict):
+            c = item.get("content") or item.get("url") or item.get("name", "")
+            contents.append(str(c))
+        else:
+            contents.append(str(item))
+    return "\n\n".join(c for c in contents if c)
+
+
+def _entry_hashes(entries: List[dict]) -> Dict[str, str]:
+    return {e['name']: hashlib.sha256((e.get('content') or '').encode('utf-8')).hexdigest()
+            for e in entries}
+
+
+class KBContentCache:
+    """LRU of KBSnapshot keyed by (subject, week), revalidated by update_time."""
+
+    def __init__(self, ttl: float = KB_CACHE_TTL, max_entries: int = KB_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[Tuple[str, str], KBSnapshot]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.revalidations = self.fetches = 0
+
+    @staticmethod
+    def _ref(db, subject: str, week: str):
+        return db.collection("knowledgebase").document(f"{subject}_{week}_kb")
+
+    def get(self, db, subject: str, week: str, max_age: Optional[float] = None) -> Optional[KBSnapshot]:
+        """Snapshot of the KB doc, or None when it does not exist."""
+        key = (subject, week)
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            snap = self._entries.get(key)
+            if snap is not None and time.monotonic() - snap.fetched_at < max_age:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return snap
+        ref = self._ref(db, subject, week)
+        if snap is not None:
+            # Field-masked read: metadata only, no KB content over the wire
+            head = ref.get(field_paths=["subject"])
+            if head.exists and head.update_time == snap.update_time:
+                snap = snap._replace(fetched_at=time.monotonic())
+                with self._lock:
+                    self.revalidations += 1
+                    self._store(key, snap)
+                return snap
+        doc = ref.get()
+        with self._lock:
+            self.fetches += 1
+        if not doc.exists:
+            self.invalidate(subject, week)
+            return None
+        raw = doc.to_dict().get("knowledgebase", [])
+        entries = normalize_entries(raw)
+        snap = KBSnapshot(subject, week, doc.update_time, raw, entries,
+                          join_blob(raw), _entry_hashes(entries), time.monotonic())
+        with self._lock:
+            self._store(key, snap)
+        return snap
+
+    def _store(self, key: Tuple[str, str], snap: KBSnapshot) -> None:
+        self._entries[key] = snap
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, subject: str, week: str) -> None:
+        with self._lock:
+            self._entries.pop((subject, week), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits,
+                    "revalidations": self.revalidations, "fetches": self.fetches}
+
+
+kb_content_cache = KBContentCache()
+
+
+def get_kb_snapshot(db, subject: str, week: str, max_age: Optional[float] = None) -> Optional[KBSnapshot]:
+    return kb_content_cache.get(db, subject, week, max_age)
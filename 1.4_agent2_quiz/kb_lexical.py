@@ -0,0 +1,124 @@
+"""
+kb_lexical.py
+────────────────────────────────────────────────────────────────────────
+In-process BM25 inverted index for knowledgebase chunks.
+
+Dense retrieval is weak on exact tokens – CVE ids, port numbers, flags,
+function and file names.  This index is built next to the vector store
+(bm25.json in the same version folder) and fused with the dense ranking
+by reciprocal rank fusion in kb_rag.query_kb:
+
+    bm25 = BM25Index.build(texts, ids)
+    bm25.save(version_dir)
+    BM25Index.load(version_dir).search("CVE-2021-44228 port 4444", k=20)
+
+    rrf_fuse([dense_ids, bm25_ids])      # → ids ordered by Σ 1 / (RRF_K + rank)
+
+Tokens are lower-cased runs of letters, digits and '_'; compound tokens
+such as "cve-2021-44228", "10.0.0.1", "os.system" or "/etc/passwd" are
+indexed whole *and* as their parts, so both exact and partial queries hit.
+"""
+
+from __future__ import annotations
+import json, math, os, re
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+__all__ = ["BM25Index", "tokenize", "rrf_fuse", "BM25_FILE"]
+
+BM25_FILE = "bm25.json"
+BM25_K1   = float(os.getenv("BM25_K1", "1.2"))
+BM25_B    = float(os.getenv("BM25_B", "0.75"))
+RRF_K     = int(os.getenv("RRF_K", "60"))
+
+_COMPOUND = re.compile(r"[A-Za-z0-9_]+(?:[-.:/@][A-Za-z0-9_]+)*")
+_PART     = re.compile(r"[A-Za-z0-9_]+")
+_STOP     = frozenset("""a an and are as at be by for from how in is it of on or that the
+                         this to was what when where which why with""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    tokens: List[str] = []
+    for m in _COMPOUND.finditer(text or ""):
+        word = m.group().lower()
+        parts = _PART.findall(word)
+        if len(parts) > 1:
+            tokens.append(word)
+        tokens.extend(p for p in parts if p not in _STOP)
+    return tokens
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of chunks (rebuilt with each index version)."""
+
+    def __init__(self, ids: List[str], doc_len: List[int],
+                 postings: Dict[str, List[Tuple[int, int]]],
+                 k1: float = BM25_K1, b: float = BM25_B):
+        self.ids = ids
+        self.doc_len = doc_len
+        self.postings = postings
+        self.k1, self.b = k1, b
+        self.avgdl = (sum(doc_len) / len(doc_len)) if doc_len else 0.0
+
+    @classmethod
+    def build(cls, texts: Iterable[str], ids: Sequence[str]) -> "BM25Index":
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        doc_len: List[int] = []
+        for row, text in enumerate(texts):
+            tf = Counter(tokenize(text))
+            doc_len.append(sum(tf.values()))
+            for term, n in tf.items():
+                postings[term].append((row, n))
+        return cls(list(ids), doc_len, dict(postings))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def approx_bytes(self) -> int:
+        """Rough in-memory size, for index_cache's byte budget."""
+        n_post = sum(len(p) for p in self.postings.values())
+        return 72 * n_post + 80 * len(self.postings) + 90 * len(self.ids)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """Top-k (chunk id, BM25 score) pairs; chunks sharing no term are omitted."""
+        n = len(self.ids)
+        if not n:
+            return []
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = math.log(1.0 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+            for row, tf in plist:
+                norm = self.k1 * (1.0 - self.b + self.b * self.doc_len[row] / (self.avgdl or 1.0))
+                scores[row] += idf * tf * (self.k1 + 1.0) / (tf + norm)
+        top = sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))[:k]
+        return [(self.ids[row], score) for row, score in top]
+
+    # ── persistence ────────────────────────────────────────────────────
+    def save(self, dir_: Path) -> None:
+        with open(Path(dir_) / BM25_FILE, "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "ids": self.ids, "doc_len": self.doc_len,
+                       "postings": self.postings}, f, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, dir_: Path) -> Optional["BM25Index"]:
+        """Read bm25.json from *dir_*; None when the version was built without one."""
+        try:
+            with open(Path(dir_) / BM25_FILE, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        postings = {t: [tuple(p) for p in plist] for t, plist in data["postings"].items()}
+        return cls(data["ids"], data["doc_len"], postings, data.get("k1", BM25_K1), data.get("b", BM25_B))
+
+
+def rrf_fuse(rankings: Iterable[Sequence[str]], k: int = RRF_K) -> List[str]:
+    """Reciprocal rank fusion of several best-first id lists."""
+    fused: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] += 1.0 / (k + rank)
+    return sorted(fused, key=lambda d: -fused[d])
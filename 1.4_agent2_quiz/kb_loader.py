@@ -28,20 +28,35 @@ import os
 from pathlib import Path
 import json
 from typing import Dict, List, Optional
-from langchain_community.vectorstores import FAISS
-from .document_loader import LocalHuggingFaceEmbeddings  # already defined
+import logging
+try:
+    from .embedding_service import get_embeddings
+    from .mmap_store import convert_faiss_dir, is_mmap_store, open_vector_store
+except ImportError:
+    from embedding_service import get_embeddings   # 1.2_back_end on sys.path
+    from mmap_store import convert_faiss_dir, is_mmap_store, open_vector_store
+try:
+    from .index_cache import index_cache, dir_version
+except ImportError:
+    from index_cache import index_cache, dir_version
 
 BASE_DIR = Path(__file__).resolve().parents[2]  # …/GENAI_ITS
 COURSES_DIR = BASE_DIR / "data" / "courses"
 
-def _load_vectorstore(path: Path) -> Optional[FAISS]:
-    """Return FAISS store if folder exists, else None (caller handles)."""
+def _load_vectorstore(path: Path):
+    """Return the vector store if folder exists, else None (caller handles).
+    Legacy FAISS folders are converted to the shared mmap format on first use.
+    Stores are served from index_cache and reopened only when the files change."""
     if path.exists():
-        embs = LocalHuggingFaceEmbeddings()
-        return FAISS.load_local(
-            str(path),
-            embs,
-            allow_dangerous_deserialization=True,
+        if (path / "index.faiss").exists() and not is_mmap_store(path):
+            try:
+                convert_faiss_dir(path, get_embeddings())
+            except Exception:
+                logging.exception("Could not convert %s to the mmap format", path)
+        return index_cache.get(
+            str(path.resolve()),
+            dir_version(path),
+            lambda: open_vector_store(path, get_embeddings()),
         )
     return None
 
@@ -51,8 +66,8 @@ def load_quiz_kb(course: str, quiz: str) -> Dict:
     Returns:
         {
           "questions": List[dict],          # Q/C/A triples
-          "quiz_vectors": FAISS | None,     # vectors built from the quiz sample PDF
-          "course_vectors": FAISS | None,   # wider course content
+          "quiz_vectors": VectorStore | None,     # vectors built from the quiz sample PDF
+          "course_vectors": VectorStore | None,   # wider course content
         }
     Raises:
         FileNotFoundError if questions.json is missing.
@@ -1,98 +1,356 @@
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 import os
 import json
-from datetime import datetime
+import shutil
+import hashlib
+import logging
+from datetime import datetime, timezone
 
-from langchain_community.vectorstores import FAISS
-from .document_loader import LocalHuggingFaceEmbeddings
+import numpy as np
+try:
+    from .embedding_service import get_embeddings
+    from .vector_index import choose_index_spec
+    from .mmap_store import MmapVectorStore, is_mmap_store, open_vector_store, write_store
+except ImportError:
+    from embedding_service import get_embeddings   # 1.2_back_end on sys.path
+    from vector_index import choose_index_spec
+    from mmap_store import MmapVectorStore, is_mmap_store, open_vector_store, write_store
+try:
+    from .index_cache import index_cache
+    from .kb_chunker import iter_chunks
+    from .kb_lexical import BM25Index, rrf_fuse
+    from .kb_content_cache import get_kb_snapshot
+except ImportError:
+    from index_cache import index_cache
+    from kb_chunker import iter_chunks
+    from kb_lexical import BM25Index, rrf_fuse
+    from kb_content_cache import get_kb_snapshot
 
 BASE = Path(__file__).resolve().parents[2]
 VECTORS_DIR = BASE / "data" / "knowledgebase_vectors"
+KEEP_VERSIONS = 2      # previous build kept so in-flight readers can finish
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))   # per ranker, before RRF
+
+# On-disk layout (one folder per subject/week):
+#   {subject}_{week}/CURRENT                 ← name of the live version
+#   {subject}_{week}/versions/<version>/     ← mmap_store files, bm25.json, metadata.json
+# A build writes a new version folder, then atomically repoints CURRENT.
+# Versions are read-only mmap stores (see mmap_store.py), so every app
+# process shares one page-cache copy; older FAISS pickles still load.
 
 
 def _ensure_vectors_dir():
     VECTORS_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def _chunk_text(text: str, chunk_size: int = 800, overlap: int = 200) -> List[str]:
-    # naive whitespace-based chunking
-    words = text.split()
-    chunks = []
-    i = 0
-    while i < len(words):
-        chunk = " ".join(words[i:i+chunk_size])
-        chunks.append(chunk)
-        i += chunk_size - overlap
-    return chunks
+def _kb_key(subject: str, week: str) -> str:
+    return f"{subject}_{week}"
 
 
-def build_index_from_firestore_kb(subject: str, week: str) -> None:
-    """Read KB entries from Firestore (same doc used by the app), chunk their content,
-    compute embeddings using LocalHuggingFaceEmbeddings and store a FAISS index on disk
-    at data/knowledgebase_vectors/{subject}_{week}.
-    Also write metadata.json with per-chunk {id, source_name, uploaded_at}.
-    """
+def current_index_version(subject: str, week: str) -> Optional[str]:
+    """Name of the live index version, "legacy" for a pre-versioning index, or None."""
+    target = VECTORS_DIR / _kb_key(subject, week)
+    try:
+        version = (target / "CURRENT").read_text(encoding="utf-8").strip()
+        if version and (target / "versions" / version).is_dir():
+            return version
+    except OSError:
+        pass
+    if (target / "index.faiss").exists() or is_mmap_store(target):
+        return "legacy"
+    return None
+
+
+def _version_dir(subject: str, week: str, version: str) -> Path:
+    target = VECTORS_DIR / _kb_key(subject, week)
+    return target if version == "legacy" else target / "versions" / version
+
+
+def _publish_version(target: Path, version: str) -> None:
+    tmp = target / f"CURRENT.{os.getpid()}.tmp"
+    tmp.write_text(version, encoding="utf-8")
+    os.replace(tmp, target / "CURRENT")       # atomic on the same filesystem
+
+
+def _prune_versions(target: Path, keep: int = KEEP_VERSIONS) -> None:
+    versions_dir = target / "versions"
+    if not versions_dir.is_dir():
+        return
+    built = sorted(p for p in versions_dir.iterdir()
+                   if p.is_dir() and not p.name.startswith("."))
+    for old in built[:-keep]:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def _open_kb_store(path: Path):
+    """Open a version folder: vector store with its BM25 index as `.lexical`
+    (None for versions built before hybrid retrieval)."""
+    store = open_vector_store(path, get_embeddings())
+    store.lexical = BM25Index.load(path)
+    return store
+
+
+def load_kb_index(subject: str, week: str):
+    """Return the live vector store for subject/week from the in-memory cache,
+    opening it from disk only when the published version changed."""
+    version = current_index_version(subject, week)
+    if version is None:
+        return None
+    path = _version_dir(subject, week, version)
+    return index_cache.get(
+        _kb_key(subject, week), version,
+        lambda: _open_kb_store(path),
+    )
+
+
+def _chunk_hash(source: str, text: str) -> str:
+    """Content hash of a chunk – doubles as its docstore id in the vector store."""
+    return hashlib.sha256(f"{source}\0{text}".encode("utf-8")).hexdigest()[:32]
+
+
+def _read_manifest(version_dir: Path) -> List[dict]:
+    try:
+        with open(version_dir / 'metadata.json', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def _previous_vectors(prev_dir: Path) -> dict:
+    """Map chunk hash → stored vector for the previous version, so unchanged
+    chunks are not re-embedded. Empty when the previous version is a legacy
+    FAISS folder or has no hash manifest (the embedding cache covers those)."""
+    manifest = _read_manifest(prev_dir)
+    if not manifest or not all('hash' in m for m in manifest) or not is_mmap_store(prev_dir):
+        return {}
+    # A fresh, private mapping – the cached instance keeps serving readers.
+    prev = MmapVectorStore(prev_dir, get_embeddings())
+    return {prev.metadata(r).get('hash') or prev.doc_id(r): prev.vectors[r]
+            for r in range(len(prev))}
+
+
+def _firestore_client():
     from firebase_admin import firestore, credentials, initialize_app
     import firebase_admin
     if not firebase_admin._apps:
         cred = credentials.Certificate(dict(__import__('streamlit').secrets['FIREBASE']))
         initialize_app(cred)
-    db = firestore.client()
+    return firestore.client()
 
-    doc_id = f"{subject}_{week}_kb"
-    doc = db.collection('knowledgebase').document(doc_id).get()
-    if not doc.exists:
+
+def build_index_from_firestore_kb(subject: str, week: str) -> None:
+    """Read KB entries from Firestore (same doc used by the app), chunk their content,
+    compute embeddings using the shared embedding service and store a read-only
+    mmap vector store on disk as a new version under
+    data/knowledgebase_vectors/{subject}_{week}.
+    The new version is published atomically and swapped into the index cache.
+    Also write metadata.json with per-chunk {id, source, uploaded_at, hash, start, end}
+    and index_info.json with the index type chosen by vector_index.choose_index_spec,
+    plus bm25.json – the lexical index query_kb fuses with vector search.
+    Content is split by kb_chunker.iter_chunks (token-aware, structure-preserving).
+
+    Rebuilds are incremental: chunks whose content hash is already in the previous
+    version reuse its stored vectors and only new or changed chunks are embedded.
+    """
+    # Shared KB cache, revalidated against the doc's update_time before building
+    snap = get_kb_snapshot(_firestore_client(), subject, week, max_age=0)
+    if snap is None:
         # Nothing to build
         return
-    kb = doc.to_dict().get('knowledgebase', [])
+    kb = snap.raw
     texts = []
     metadata = []
+    seen = set()
     for entry in (kb or []):
         if isinstance(entry, dict):
             name = entry.get('name', 'unknown')
             content = entry.get('content') or ''
             uploaded_at = entry.get('uploaded_at')
             if content and content.strip():
-                chunks = _chunk_text(content)
-                for idx, c in enumerate(chunks):
-                    texts.append(c)
+                for idx, chunk in enumerate(iter_chunks(content)):
+                    h = _chunk_hash(name, chunk.text)
+                    if h in seen:
+                        continue        # identical chunk already indexed
+                    seen.add(h)
+                    texts.append(chunk.text)
                     metadata.append({
                         'id': f"{name}#chunk{idx}",
                         'source': name,
                         'uploaded_at': uploaded_at,
+                        'hash': h,
+                        'start': chunk.start,
+                        'end': chunk.end,
                     })
     if not texts:
         return
 
     _ensure_vectors_dir()
-    target = VECTORS_DIR / f"{subject}_{week}"
-    target.mkdir(parents=True, exist_ok=True)
+    target = VECTORS_DIR / _kb_key(subject, week)
+    versions_dir = target / "versions"
+    versions_dir.mkdir(parents=True, exist_ok=True)
+
+    prev_version = current_index_version(subject, week)
+    reuse = {}
+    if prev_version is not None:
+        prev_dir = _version_dir(subject, week, prev_version)
+        if _read_manifest(prev_dir) == metadata:
+            return              # KB unchanged – keep the published version
+        try:
+            reuse = _previous_vectors(prev_dir)
+        except Exception:
+            logging.exception("Reading previous KB vectors failed – re-embedding everything")
+            reuse = {}
 
-    embs = LocalHuggingFaceEmbeddings()
-    faiss_index = FAISS.from_texts(texts, embs, metadatas=metadata)
-    faiss_index.save_local(str(target))
+    added = [i for i, m in enumerate(metadata) if m['hash'] not in reuse]
+    fresh = get_embeddings().embed_documents([texts[i] for i in added]) if added else []
+    fresh_by_row = dict(zip(added, fresh))
+    vectors = np.asarray([fresh_by_row[i] if i in fresh_by_row else reuse[m['hash']]
+                          for i, m in enumerate(metadata)], dtype=np.float32)
+    if reuse:
+        logging.info("KB %s/%s: embedded %d new chunks, reused %d",
+                     subject, week, len(added), len(texts) - len(added))
+    spec = choose_index_spec(*vectors.shape)
 
-    # Write metadata file separately for quick access
-    with open(target / 'metadata.json', 'w', encoding='utf-8') as f:
+    # Write into a hidden folder first; readers only ever see complete versions
+    version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    staging = versions_dir / f".{version}.tmp"
+    write_store(staging, texts, vectors, metadata, [m['hash'] for m in metadata], spec)
+    BM25Index.build(texts, [m['hash'] for m in metadata]).save(staging)
+
+    # Write metadata file separately for quick access (also the hash manifest)
+    with open(staging / 'metadata.json', 'w', encoding='utf-8') as f:
         json.dump(metadata, f, ensure_ascii=False, indent=2)
+    info = {'index_type': 'mmap', 'spec': spec, 'ntotal': int(vectors.shape[0]),
+            'dim': int(vectors.shape[1]), 'version': version}
+    with open(staging / 'index_info.json', 'w', encoding='utf-8') as f:
+        json.dump(info, f, indent=2)
+
+    os.replace(staging, versions_dir / version)
+    _publish_version(target, version)
+    index_cache.put(_kb_key(subject, week), version, _open_kb_store(versions_dir / version))
+    _prune_versions(target)
+
+
+def _doc_key(doc) -> Optional[str]:
+    return (doc.metadata or {}).get('hash') or getattr(doc, 'id', None)
+
+
+def hybrid_search(store, query: str, top_k: int = 3) -> list:
+    """Top_k documents by reciprocal rank fusion of vector and BM25 rankings.
+    Falls back to vector search alone when the version has no BM25 index."""
+    n_cand = max(top_k, HYBRID_CANDIDATES)
+    dense = store.similarity_search(query, k=n_cand)
+    lexical = getattr(store, 'lexical', None)
+    if lexical is None or not all(_doc_key(d) for d in dense):
+        return dense[:top_k]
+    by_id = {_doc_key(d): d for d in dense}
+    lex_ids = [chunk_id for chunk_id, _ in lexical.search(query, k=n_cand)]
+    output = []
+    for chunk_id in rrf_fuse([list(by_id), lex_ids])[:top_k]:
+        doc = by_id.get(chunk_id) or store.docstore.search(chunk_id)
+        if hasattr(doc, 'page_content'):
+            output.append(doc)
+    return output
+
+
+def _citation_tag(doc) -> str:
+    # doc.metadata expected to contain 'id' and 'source'
+    meta = doc.metadata or {}
+    return f"[KB:{meta.get('id') or meta.get('source', 'kb')}]"
 
 
 def query_kb(subject: str, week: str, query: str, top_k: int = 3) -> List[Tuple[str, str]]:
-    """Return top_k tuples (citation_tag, chunk_text) for the given query.
+    """Return top_k tuples (citation_tag, chunk_text) for the given query,
+    ranked by hybrid (vector + BM25) retrieval.
     Citation tag format: [KB:source#chunk_idx] where source is the filename.
     """
-    target = VECTORS_DIR / f"{subject}_{week}"
-    if not target.exists():
+    store = load_kb_index(subject, week)
+    if store is None:
         return []
-    embs = LocalHuggingFaceEmbeddings()
-    faiss_index = FAISS.load_local(str(target), embs, allow_dangerous_deserialization=True)
-    results = faiss_index.similarity_search_with_score(query, k=top_k)
+    return [(_citation_tag(doc), doc.page_content) for doc in hybrid_search(store, query, top_k)]
+
+
+# ── Precomputed per-question retrieval ─────────────────────────────────
+# Quiz questions are fixed once saved, so their top-k chunks are computed
+# once per index version and stored next to it as retrieval.json:
+#   {"index_version": v, "top_k": k,
+#    "questions": {qid: {"qhash": …, "hits": [[chunk_id, tag], …]}}}
+# A new index version lives in a new folder, which invalidates the file.
+
+_retrieval_cache: dict = {}      # (kb key, version) → parsed retrieval.json
+
+
+def _question_hash(question_text: str) -> str:
+    return hashlib.sha256((question_text or "").strip().encode("utf-8")).hexdigest()[:16]
+
+
+def precompute_quiz_retrieval(subject: str, week: str, questions: List[dict],
+                              top_k: int = 3) -> int:
+    """Store the top_k chunk ids / citation tags of every quiz question for the
+    live index version. Returns the number of questions written."""
+    version = current_index_version(subject, week)
+    store = load_kb_index(subject, week)
+    if version is None or store is None:
+        return 0
+    entries = {}
+    for idx, q in enumerate(questions or [], start=1):
+        text = (q.get('question') or '').strip()
+        if not text:
+            continue
+        hits = []
+        for doc in hybrid_search(store, text, top_k):
+            chunk_id = _doc_key(doc)
+            if not chunk_id:
+                continue        # legacy index without stable ids
+            hits.append([chunk_id, _citation_tag(doc)])
+        entries[str(q.get('id', idx))] = {'qhash': _question_hash(text), 'hits': hits}
+
+    vdir = _version_dir(subject, week, version)
+    tmp = vdir / f"retrieval.json.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'index_version': version, 'top_k': top_k, 'questions': entries},
+                  f, ensure_ascii=False)
+    os.replace(tmp, vdir / 'retrieval.json')
+    _retrieval_cache.pop((_kb_key(subject, week), version), None)
+    return len(entries)
+
+
+def precompute_quiz_retrieval_from_firestore(subject: str, week: str, top_k: int = 3) -> int:
+    """Precompute retrieval for the finalised quiz stored in Firestore."""
+    doc = _firestore_client().collection('finalised_quizzes').document(f"{subject}_{week}").get()
+    if not doc.exists:
+        return 0
+    return precompute_quiz_retrieval(subject, week, doc.to_dict().get('questions', []), top_k)
+
+
+def precomputed_kb_hits(subject: str, week: str, question: dict,
+                        top_k: int = 3) -> Optional[List[Tuple[str, str]]]:
+    """Return precomputed (citation_tag, chunk_text) pairs for *question*, or None
+    when nothing valid is stored for the live index version (caller runs query_kb)."""
+    version = current_index_version(subject, week)
+    if version is None:
+        return None
+    key = (_kb_key(subject, week), version)
+    data = _retrieval_cache.get(key)
+    if data is None:
+        try:
+            with open(_version_dir(subject, week, version) / 'retrieval.json', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        _retrieval_cache[key] = data
+    if data.get('index_version') != version or int(data.get('top_k', 0)) < top_k:
+        return None
+    entry = (data.get('questions') or {}).get(str(question.get('id')))
+    if not entry or entry.get('qhash') != _question_hash(question.get('question', '')):
+        return None          # question edited since the quiz was saved
+    store = load_kb_index(subject, week)
+    if store is None:
+        return None
     output = []
-    for doc, score in results:
-        # doc.metadata expected to contain 'id' and 'source'
-        meta = doc.metadata or {}
-        cid = meta.get('id') or meta.get('source', 'kb')
-        tag = f"[KB:{cid}]"
-        output.append((tag, doc.page_content))
+    for chunk_id, tag in entry.get('hits', [])[:top_k]:
+        doc = store.docstore.search(chunk_id)
+        if hasattr(doc, 'page_content'):
+            output.append((tag, doc.page_content))
     return output
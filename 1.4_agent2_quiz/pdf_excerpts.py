@@ -0,0 +1,81 @@
+"""
+pdf_excerpts.py
+────────────────────────────────────────────────────────────────────────
+Per-question excerpt selection for the quiz extractor's Pass-2.
+
+ENRICH_PROMPT used to carry the whole PDF text once
+per question.  ExcerptSelector chunks the PDF once with kb_chunker,
+indexes the chunks with BM25 (kb_lexical) and picks the top-k chunks for
+a question's text + context (hits scoring under EXCERPT_MIN_SCORE × the
+best one are dropped); only those go into the prompt:
+
+    sel = ExcerptSelector(pdf_text)
+    sel.select(question, context)     # excerpts in document order, "…"-separated
+    sel.report()                      # {"calls", "full_tokens", "sent_tokens", "saved_pct"}
+
+Small PDFs (≤ EXCERPT_TOP_K chunks) are sent whole.  A question sharing
+no term with any chunk gets the leading chunks, like the old truncation.
+"""
+
+from __future__ import annotations
+import os, threading
+from typing import Callable, List, Optional
+
+try:
+    from .kb_chunker import iter_chunks
+    from .kb_lexical import BM25Index
+except ImportError:
+    from kb_chunker import iter_chunks
+    from kb_lexical import BM25Index
+from prompt_budget import count_tokens      # 1.3_models on sys.path
+
+__all__ = ["ExcerptSelector", "EXCERPT_TOP_K", "EXCERPT_CHUNK_TOKENS"]
+
+EXCERPT_TOP_K        = int(os.getenv("EXCERPT_TOP_K", "5"))
+EXCERPT_CHUNK_TOKENS = int(os.getenv("EXCERPT_CHUNK_TOKENS", "300"))
+EXCERPT_MIN_SCORE    = float(os.getenv("EXCERPT_MIN_SCORE", "0.25"))   # × best hit's BM25 score
+EXCERPT_SEPARATOR    = "\n…\n"
+
+
+class ExcerptSelector:
+    """BM25 over one PDF's chunks; thread-safe, so pipeline workers can share it."""
+
+    def __init__(self, pdf_text: str, top_k: int = EXCERPT_TOP_K,
+                 chunk_tokens: int = EXCERPT_CHUNK_TOKENS,
+                 count: Callable[[str], int] = count_tokens):
+        self.pdf_text = pdf_text or ""
+        self.top_k = max(1, top_k)
+        self._count = count
+        self.chunks: List[str] = [c.text for c in iter_chunks(self.pdf_text, max_tokens=chunk_tokens,
+                                                              count_tokens=count)]
+        self._bm25: Optional[BM25Index] = (BM25Index.build(self.chunks, [str(i) for i in range(len(self.chunks))])
+                                           if len(self.chunks) > self.top_k else None)
+        self.full_tokens = count(self.pdf_text)
+        self._lock = threading.Lock()
+        self.calls = self.sent_tokens = 0
+
+    def select(self, question: str, context: str = "") -> str:
+        """The PDF text to send for one question."""
+        if self._bm25 is None:
+            text, tokens = self.pdf_text, self.full_tokens
+        else:
+            hits = self._bm25.search(f"{question}\n{context}", k=self.top_k)
+            floor = hits[0][1] * EXCERPT_MIN_SCORE if hits else 0.0
+            rows = sorted(int(doc_id) for doc_id, score in hits if score >= floor) or list(range(self.top_k))
+            text = EXCERPT_SEPARATOR.join(self.chunks[r] for r in rows)
+            tokens = self._count(text)
+        with self._lock:
+            self.calls += 1
+            self.sent_tokens += tokens
+        return text
+
+    def report(self) -> dict:
+        with self._lock:
+            full = self.full_tokens * self.calls
+            return {"calls": self.calls, "full_tokens": full, "sent_tokens": self.sent_tokens,
+                    "saved_pct": round(100.0 * (full - self.sent_tokens) / full, 1) if full else 0.0}
+
+    def summary(self) -> str:
+        r = self.report()
+        return (f"📉 Pass-2 PDF text: {r['sent_tokens']:,} tokens sent instead of "
+                f"{r['full_tokens']:,} over {r['calls']} calls ({r['saved_pct']}% less)")
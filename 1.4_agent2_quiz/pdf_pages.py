@@ -0,0 +1,138 @@
+"""
+pdf_pages.py
+────────────────────────────────────────────────────────────────────────
+Per-page text-layer detection and page-parallel OCR for uploaded PDFs.
+
+The extractor used to OCR the *whole* document, serially, whenever the
+document as a whole had < TEXT_THRESHOLD characters of text.  Instead:
+
+    for page in iter_pages(path, ["eng"]):      # page order, streamed
+        page.page, page.ocr, page.elements, page.seconds
+
+1. one partition_pdf(strategy="fast") pass reads the text layer;
+2. pages with < OCR_PAGE_TEXT_THRESHOLD characters are split out into
+   single-page PDFs (PyPDF2) and OCR'd in a process pool (OCR_WORKERS);
+3. results are yielded in page order as soon as each page is ready.
+
+`seconds` is the page's own OCR time; text-layer pages get their share
+of the fast pass.  Without PyPDF2 the image-only pages are taken from a
+single whole-document OCR run, as before.
+"""
+
+from __future__ import annotations
+import os, time, logging, tempfile, multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+from unstructured.partition.pdf import partition_pdf
+
+__all__ = ["PageResult", "iter_pages", "page_count", "OCR_WORKERS", "OCR_PAGE_TEXT_THRESHOLD"]
+
+OCR_WORKERS             = int(os.getenv("OCR_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+OCR_PAGE_TEXT_THRESHOLD = int(os.getenv("OCR_PAGE_TEXT_THRESHOLD", "40"))   # chars – fewer → OCR the page
+
+
+class PageResult(NamedTuple):
+    page: int                   # 1-based
+    ocr: bool
+    elements: List[dict]        # {"page", "category", "text"}
+    seconds: float
+
+
+def _element_dicts(elements, page: Optional[int] = None) -> List[dict]:
+    return [{"page": page or getattr(getattr(e, "metadata", None), "page_number", None) or 1,
+             "category": getattr(e, "category", None),
+             "text": e.text}
+            for e in elements if e.text]
+
+
+def page_count(path: str) -> Optional[int]:
+    try:
+        from PyPDF2 import PdfReader
+        return len(PdfReader(path).pages)
+    except Exception:                    # PyPDF2 missing / unreadable – caller falls back
+        return None
+
+
+def _split_pages(path: str, pages: Sequence[int], out_dir: str) -> Optional[Dict[int, str]]:
+    """Write each of *pages* to its own PDF; None when PyPDF2 can't do it."""
+    try:
+        from PyPDF2 import PdfReader, PdfWriter
+        reader = PdfReader(path)
+        files = {}
+        for p in pages:
+            writer = PdfWriter()
+            writer.add_page(reader.pages[p - 1])
+            files[p] = os.path.join(out_dir, f"page_{p:04d}.pdf")
+            with open(files[p], "wb") as f:
+                writer.write(f)
+        return files
+    except Exception as e:
+        logging.warning("Could not split PDF into pages (%s) – OCR'ing the whole document", e)
+        return None
+
+
+def ocr_page(page_pdf: str, page: int, languages: List[str]) -> PageResult:
+    """OCR one single-page PDF (runs in a worker process)."""
+    t0 = time.perf_counter()
+    elements = partition_pdf(filename=page_pdf, strategy="ocr_only",
+                             languages=languages, infer_table_structure=True)
+    return PageResult(page, True, _element_dicts(elements, page), time.perf_counter() - t0)
+
+
+def _ocr_whole_document(path: str, languages: List[str]) -> Dict[int, List[dict]]:
+    elements = partition_pdf(filename=path, strategy="ocr_only",
+                             languages=languages, infer_table_structure=True)
+    by_page: Dict[int, List[dict]] = defaultdict(list)
+    for e in _element_dicts(elements):
+        by_page[e["page"]].append(e)
+    return by_page
+
+
+def iter_pages(path: str, languages: List[str],
+               threshold: int = OCR_PAGE_TEXT_THRESHOLD,
+               workers: int = OCR_WORKERS) -> Iterator[PageResult]:
+    """Yield every page of *path* in order, OCR'ing only pages without a text layer."""
+    t0 = time.perf_counter()
+    by_page: Dict[int, List[dict]] = defaultdict(list)
+    for e in _element_dicts(partition_pdf(filename=path, strategy="fast", infer_table_structure=False)):
+        by_page[e["page"]].append(e)
+    n = page_count(path) or max(by_page, default=0)
+    share = (time.perf_counter() - t0) / max(n, 1)
+    need = [p for p in range(1, n + 1) if sum(len(e["text"]) for e in by_page[p]) < threshold]
+    if not need and n:
+        for p in range(1, n + 1):
+            yield PageResult(p, False, by_page[p], share)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="pdf_pages_") as tmp:
+        files = _split_pages(path, need, tmp) if need else None
+        if files is None:
+            t1 = time.perf_counter()
+            ocr = _ocr_whole_document(path, languages)
+            n = max(n, max(ocr, default=0))
+            need = need or list(range(1, n + 1))
+            each = (time.perf_counter() - t1) / max(len(need), 1)
+            for p in range(1, n + 1):
+                yield (PageResult(p, True, ocr.get(p, []), each) if p in need
+                       else PageResult(p, False, by_page[p], share))
+            return
+
+        # spawn, not fork: the Streamlit server is multithreaded, and a forked
+        # child can deadlock on a lock another thread held at fork time
+        pool = ProcessPoolExecutor(max_workers=max(1, min(workers, len(need))),
+                                   mp_context=multiprocessing.get_context("spawn"))
+        try:
+            futures = {p: pool.submit(ocr_page, files[p], p, languages) for p in need}
+            for p in range(1, n + 1):
+                if p not in futures:
+                    yield PageResult(p, False, by_page[p], share)
+                    continue
+                try:
+                    yield futures[p].result()
+                except BrokenProcessPool:        # e.g. no fork/spawn support – OCR in-process
+                    yield ocr_page(files[p], p, languages)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
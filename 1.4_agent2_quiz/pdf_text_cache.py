@@ -0,0 +1,98 @@
+"""
+pdf_text_cache.py
+────────────────────────────────────────────────────────────────────────
+Content-addressed cache of PDF text extraction / OCR results.
+
+partition_pdf – and OCR above all – is by far the slowest part of a quiz
+or KB upload, and the same file is extracted again by the teacher's
+"Re-run Pass 2" button or when it is uploaded twice.  Results are keyed
+on SHA-256 of the PDF bytes plus the extraction settings, so a renamed
+copy hits and a settings change misses:
+
+    rec = pdf_text_cache.get_or_extract(path, settings, extract)
+    rec["text"]        # full extracted text (ASCII-cleaned)
+    rec["ocr"]         # True when the OCR path produced it
+    rec["elements"]    # [{"page", "category", "text"}, …] – page layout
+    rec["cached"]      # True when served from the cache (timings are the original run's)
+
+Layout: data/pdf_text_cache/<sha[:2]>/<key>.json, written atomically, so
+several Streamlit processes can share the folder.
+"""
+
+from __future__ import annotations
+import os, json, time, hashlib, logging
+from pathlib import Path
+from typing import Callable, Optional
+
+__all__ = ["PdfTextCache", "pdf_text_cache", "file_sha256", "PDF_TEXT_CACHE_DIR"]
+
+BASE_DIR           = Path(__file__).resolve().parents[1]
+PDF_TEXT_CACHE_DIR = Path(os.getenv("PDF_TEXT_CACHE_DIR", BASE_DIR / "data" / "pdf_text_cache"))
+CACHE_FORMAT       = 1         # bump when the record layout changes
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class PdfTextCache:
+    """One JSON record per (PDF content, extraction settings)."""
+
+    def __init__(self, root: Path = PDF_TEXT_CACHE_DIR):
+        self.root = Path(root)
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def key(digest: str, settings: dict) -> str:
+        blob = json.dumps({"format": CACHE_FORMAT, "settings": settings}, sort_keys=True)
+        return hashlib.sha256(f"{digest}\0{blob}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[dict]:
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, record: dict) -> None:
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(record, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except OSError as e:                     # read-only data/ – cache is best effort
+            logging.warning("PDF text cache write failed: %s", e)
+
+    def get_or_extract(self, path: str, settings: dict,
+                       extract: Callable[[str], dict]) -> dict:
+        """Cached record for *path*, running extract(path) on a miss."""
+        digest = file_sha256(path)
+        key = self.key(digest, settings)
+        record = self.get(key)
+        if record is not None:
+            self.hits += 1
+            record["cached"] = True
+            return record
+        self.misses += 1
+        t0 = time.perf_counter()
+        record = dict(extract(path))
+        record.update(sha256=digest, settings=settings,
+                      seconds=round(time.perf_counter() - t0, 3), created=time.time())
+        self.put(key, record)
+        record["cached"] = False
+        return record
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+pdf_text_cache = PdfTextCache()
@@ -1,8 +1,12 @@
 import os
 import json
+import time
+import logging
 import streamlit as st
 import firebase_admin
 from firebase_admin import credentials, firestore
+from prompt_budget import PromptBuilder   # 1.3_models on sys.path
+from llm_gateway import llm_stream, INTERACTIVE
 
 # Initialize Firebase only once
 if not firebase_admin._apps:
@@ -10,13 +14,124 @@ if not firebase_admin._apps:
     firebase_admin.initialize_app(cred)
 db = firestore.client()
 
+def _quiz_model_name():
+    return os.getenv("QUIZ_AGENT_MODEL", os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile"))
+
 def get_groq_llm(model_name=None, temperature=None):
     # Loads model and temperature from .env, with agent-specific overrides
     from llm_provider import get_llm
-    model = model_name or os.getenv("QUIZ_AGENT_MODEL", os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile"))
+    model = model_name or _quiz_model_name()
     temp = float(temperature if temperature is not None else os.getenv("QUIZ_AGENT_TEMPERATURE", os.getenv("GROQ_TEMPERATURE", "0.0")))
     return get_llm(model_name=model, temperature=temp)
 
+PERF_REVALIDATE_SECONDS = float(os.getenv("PERF_REVALIDATE_SECONDS", "300"))
+
+EVALUATION_INSTRUCTIONS = (
+    "INSTRUCTIONS:\n"
+    "- If you use material from the Retrieved Knowledgebase Chunks or Inline KB Blob to support any judgement, include an inline citation token exactly as it appears in the chunk (e.g. [KB:filename.pdf#chunk0]).\n"
+    "- If the student's input is a direct answer to the quiz question, use the rubric to assess it.\n"
+    "- If the answer is correct or mostly correct, start your reply with a clear statement like 'Correct:' or 'Great job! Your answer is correct because...' and then briefly explain why.\n"
+    "- If the answer is incorrect, start your reply with a clear statement like 'Incorrect:' or 'Your answer is not correct because...' and then briefly explain why.\n"
+    "- Do NOT explain your own steps or what you are doing. Do NOT mention the rubric, criteria, or that you are assessing.\n"
+    "- Be concise, professional, and humanlike.\n"
+    "- If the input is a question or exploration (e.g., starts with 'how', 'why', 'what', or ends with '?'), respond in a helpful, detailed way; you may consult the web to provide the best answer if required, but do not mention your own process.\n"
+    "- Always relate your explanation or example to cybersecurity concepts, best practices, or real-world scenarios where possible.\n"
+    "- If the answer is correct, you may offer a brief extension or related insight (preferably with a cybersecurity angle), but do not state 'next question' or similar.\n"
+    "- If the answer is not correct, kindly point out what could be improved, offer a helpful hint or example, and encourage them to try again.\n"
+    "- If the student is exploring a related topic, answer their question fully, then gently prompt them to return to the quiz when ready.\n"
+    "- Do not mention scores, rubrics, or evaluation steps in your feedback.\n"
+    "At the end, in a new line, write: SCORE: 1.0 if the answer is correct or mostly correct, or SCORE: 0.0 if not. If the input is a question or exploration, write SCORE: X (where X is the last valid score for this question, or 0.0 if not available).\n"
+)
+
+
+class ResponseStream:
+    """Iterable over the text pieces of a reply produced by a generator.
+    After iteration, .text holds the whole reply and .value the generator's
+    return value. Iterating again replays the recorded pieces."""
+
+    def __init__(self, gen):
+        self._gen = gen
+        self.parts = []
+        self.value = None
+        self.done = False
+
+    def __iter__(self):
+        if self.done:
+            yield from self.parts
+            return
+        while True:
+            try:
+                piece = next(self._gen)
+            except StopIteration as stop:
+                self.value = stop.value
+                self.done = True
+                return
+            if piece:
+                self.parts.append(piece)
+                yield piece
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+    def consume(self):
+        for _ in self:
+            pass
+        return self
+
+
+def _visible_feedback(chunks):
+    """Yield streamed LLM text without its SCORE: line(s), stripped the same way as
+    the final feedback; return the full raw response. A line is held back only
+    while it could still turn out to start with "SCORE:"."""
+    raw = []
+    line, state = "", None           # state: None (undecided) | "show" | "hide"
+    any_line = started = False
+    held = ""                        # trailing whitespace, sent once more text follows
+
+    def out(text):
+        nonlocal held, started
+        if not started:
+            text = text.lstrip()
+            if not text:
+                return ""
+            started = True
+        text = held + text
+        visible = text.rstrip()
+        held = text[len(visible):]
+        return visible
+
+    for chunk in chunks:
+        raw.append(chunk)
+        emitted = []
+        for ch in chunk:
+            if ch == "\n":
+                if state is None and not line.strip().startswith("SCORE:"):
+                    emitted.append(out(("\n" if any_line else "") + line))
+                    state = "show"
+                any_line = any_line or state == "show"
+                line, state = "", None
+            elif state == "show":
+                emitted.append(out(ch))
+            else:
+                line += ch
+                if state is None:
+                    head = line.lstrip()
+                    if head.startswith("SCORE:"):
+                        state = "hide"
+                    elif head and not "SCORE:".startswith(head):
+                        emitted.append(out(("\n" if any_line else "") + line))
+                        state = "show"
+        text = "".join(emitted)
+        if text:
+            yield text
+    if state is None and line and not line.strip().startswith("SCORE:"):
+        tail = out(("\n" if any_line else "") + line)
+        if tail:
+            yield tail
+    return "".join(raw)
+
+
 class QuizAgent:
     def __init__(self, quiz_data, subject, week, student_id, profile):
         self.quiz_data = quiz_data
@@ -25,15 +140,21 @@ class QuizAgent:
         self.student_id = student_id
         self.profile = profile
         self.firestore_doc = f"student_performance/{student_id}_{subject}_{week}"
+        self._llm = None
         self.load_performance()
-        self.current_q = self.performance.get("current_q", 0)
-        self.started = self.performance.get("started", False)
-        self.instructions_given = self.performance.get("instructions_given", False)
-        self.llm = get_groq_llm()
+
+    @property
+    def llm(self):
+        # Created on first evaluation, then reused for the rest of the session
+        if self._llm is None:
+            self._llm = get_groq_llm()
+        return self._llm
 
     def load_performance(self):
         doc_ref = db.document(self.firestore_doc)
         doc = doc_ref.get()
+        self._perf_version = doc.update_time if doc.exists else None
+        self._perf_checked = time.monotonic()
         if doc.exists:
             self.performance = doc.to_dict()
         else:
@@ -43,9 +164,27 @@ class QuizAgent:
                 "started": False,
                 "instructions_given": False
             }
+        self.current_q = self.performance.get("current_q", 0)
+        self.started = self.performance.get("started", False)
+        self.instructions_given = self.performance.get("instructions_given", False)
 
     def save_performance(self):
-        db.document(self.firestore_doc).set(self.performance)
+        result = db.document(self.firestore_doc).set(self.performance)
+        self._perf_version = getattr(result, "update_time", None)
+        self._perf_checked = time.monotonic()
+
+    def refresh_if_stale(self, max_age=None):
+        """Reload performance if the Firestore doc changed elsewhere (another tab or
+        replica). Checked at most every PERF_REVALIDATE_SECONDS with a field-masked read."""
+        max_age = PERF_REVALIDATE_SECONDS if max_age is None else max_age
+        if time.monotonic() - self._perf_checked < max_age:
+            return False
+        head = db.document(self.firestore_doc).get(field_paths=["current_q"])
+        self._perf_checked = time.monotonic()
+        if (head.update_time if head.exists else None) != self._perf_version:
+            self.load_performance()
+            return True
+        return False
 
     def get_instructions(self):
         # Clear, accurate rules for students based on actual functionality
@@ -96,116 +235,95 @@ class QuizAgent:
         return format_quiz_context(q)
 
     def load_knowledgebase(self):
-        # Load subject/week-specific knowledgebase content from Firestore if available.
+        # Subject/week-specific knowledgebase content, served from the shared KB
+        # cache (Firestore is re-read only when the doc's update_time changes).
         try:
-            doc_id = f"{self.subject}_{self.week}_kb"
-            doc = db.collection("knowledgebase").document(doc_id).get()
-            if doc.exists:
-                kb = doc.to_dict().get("knowledgebase", [])
-                # KB can be a list of filenames, strings, or metadata dicts.
-                contents = []
-                if isinstance(kb, list):
-                    for item in kb:
-                        if isinstance(item, dict):
-                            # Prefer stored file content if available
-                            c = item.get("content")
-                            if c:
-                                contents.append(str(c))
-                            else:
-                                # Fallback to name or url if no content field
-                                if item.get("url"):
-                                    contents.append(str(item.get("url")))
-                                else:
-                                    contents.append(str(item.get("name", "")))
-                        else:
-                            contents.append(str(item))
-                else:
-                    # Single string or dict-like
-                    if isinstance(kb, dict):
-                        c = kb.get("content")
-                        if c:
-                            contents.append(str(c))
-                        elif kb.get("url"):
-                            contents.append(str(kb.get("url")))
-                        else:
-                            contents.append(str(kb.get("name", "")))
-                    else:
-                        contents.append(str(kb))
-
-                # Join available content into a single blob for the LLM prompt
-                return "\n\n".join([c for c in contents if c])
+            try:
+                from .kb_content_cache import get_kb_snapshot
+            except ImportError:
+                from kb_content_cache import get_kb_snapshot
+            snap = get_kb_snapshot(db, self.subject, self.week)
+            if snap is not None:
+                return snap.blob
         except Exception:
             # Swallow errors and fall back to empty content so evaluation still works.
             pass
         # Fall back to empty string when no KB is present.
         return ""
 
-    def evaluate_answer(self, answer, question):
+    def _evaluation_prompt(self, answer, question):
         rubric = question.get("answer", "")
-        # Attempt RAG retrieval for this subject/week. Falls back to existing KB blob if retrieval is unavailable.
-        retrieved_section = ""
+        # Attempt hybrid RAG retrieval for this subject/week. Falls back to the KB blob if retrieval is unavailable.
+        retrieved_chunks = []
         try:
             # Try relative import first (same package); fallback to top-level
             try:
-                from .kb_rag import query_kb, build_index_from_firestore_kb
+                from .kb_rag import query_kb, current_index_version, precomputed_kb_hits
+                from .kb_build_queue import schedule_kb_build
             except Exception:
-                from kb_rag import query_kb, build_index_from_firestore_kb
+                from kb_rag import query_kb, current_index_version, precomputed_kb_hits
+                from kb_build_queue import schedule_kb_build
 
-            idx_path = os.path.join('data', 'knowledgebase_vectors', f"{self.subject}_{self.week}")
-            if not os.path.exists(idx_path):
-                # Build index (synchronous). For large KBs this may take time.
+            if current_index_version(self.subject, self.week) is None:
+                # Build in the background; this attempt uses the inline KB blob instead.
                 try:
-                    build_index_from_firestore_kb(self.subject, self.week)
+                    schedule_kb_build(self.subject, self.week)
                 except Exception:
                     pass
 
-            # Use the question text to retrieve relevant KB chunks
+            # Chunks precomputed when the quiz/KB was saved; otherwise retrieve by question text
             try:
-                retrieved = query_kb(self.subject, self.week, question.get('question',''), top_k=3)
+                retrieved = precomputed_kb_hits(self.subject, self.week, question, top_k=3)
+                if retrieved is None:
+                    retrieved = query_kb(self.subject, self.week, question.get('question',''), top_k=3)
             except Exception:
                 retrieved = []
 
-            if retrieved:
-                lines = []
-                for tag, chunk in retrieved:
-                    excerpt = (chunk[:700] + '...') if len(chunk) > 700 else chunk
-                    lines.append(f"{tag} {excerpt}")
-                retrieved_section = "\n".join(lines)
+            retrieved_chunks = [f"{tag} {chunk}" for tag, chunk in (retrieved or [])]
         except Exception:
             # Any failure in RAG shouldn't break evaluation — fall back to raw KB content
-            retrieved_section = ""
+            retrieved_chunks = []
 
-        # Also include small raw KB blob if present (useful for tiny KBs)
-        kb_blob = self.load_knowledgebase()
-        kb_section = kb_blob if kb_blob and kb_blob.strip() else ""
+        # Hybrid retrieval finds exact identifiers too, so the raw KB blob is only
+        # sent when there are no retrieved chunks (e.g. the index is still building)
+        kb_blob = "" if retrieved_chunks else (self.load_knowledgebase() or "").strip()
+
+        # Fit everything into the model's prompt budget: question, rubric and the
+        # student's input first, then context, ranked chunks and the blob.
+        pb = PromptBuilder(model=_quiz_model_name())
+        pb.add("instructions", EVALUATION_INSTRUCTIONS, priority=0)
+        pb.add("question", question['question'], priority=0)
+        pb.add("rubric", str(rubric), priority=0)
+        pb.add("answer", answer, priority=1, max_tokens=1500)
+        pb.add("context", question['context'], priority=2)
+        pb.add_items("chunks", retrieved_chunks, priority=3)
+        pb.add_items("kb_blob", kb_blob.split("\n\n"), priority=4, sep="\n\n")
+        parts = pb.build()
+        self.last_prompt_report = pb.report
+        logging.info("evaluate_answer prompt %s/%s q%s: %s",
+                     self.subject, self.week, question.get('id'), pb.summary())
+        kb_blob_line = f"Inline KB Blob (fallback): {parts['kb_blob']}\n" if parts['kb_blob'] else ""
 
         prompt = (
             "You are a professional, supportive university tutor\n"
             "for a student taking a quiz in a cybersecurity subject.\n"
             "Here is the quiz question and context:\n"
-            f"Question: {question['question']}\n"
-            f"Context: {question['context']}\n"
-            f"Retrieved Knowledgebase Chunks:\n{retrieved_section}\n"
-            f"Inline KB Blob (fallback): {kb_section}\n"
-            f"Marking Rubric: {rubric}\n"
-            f"Student's Input: {answer}\n"
-            "INSTRUCTIONS:\n"
-            "- If you use material from the Retrieved Knowledgebase Chunks or Inline KB Blob to support any judgement, include an inline citation token exactly as it appears in the chunk (e.g. [KB:filename.pdf#chunk0]).\n"
-            "- If the student's input is a direct answer to the quiz question, use the rubric to assess it.\n"
-            "- If the answer is correct or mostly correct, start your reply with a clear statement like 'Correct:' or 'Great job! Your answer is correct because...' and then briefly explain why.\n"
-            "- If the answer is incorrect, start your reply with a clear statement like 'Incorrect:' or 'Your answer is not correct because...' and then briefly explain why.\n"
-            "- Do NOT explain your own steps or what you are doing. Do NOT mention the rubric, criteria, or that you are assessing.\n"
-            "- Be concise, professional, and humanlike.\n"
-            "- If the input is a question or exploration (e.g., starts with 'how', 'why', 'what', or ends with '?'), respond in a helpful, detailed way; you may consult the web to provide the best answer if required, but do not mention your own process.\n"
-            "- Always relate your explanation or example to cybersecurity concepts, best practices, or real-world scenarios where possible.\n"
-            "- If the answer is correct, you may offer a brief extension or related insight (preferably with a cybersecurity angle), but do not state 'next question' or similar.\n"
-            "- If the answer is not correct, kindly point out what could be improved, offer a helpful hint or example, and encourage them to try again.\n"
-            "- If the student is exploring a related topic, answer their question fully, then gently prompt them to return to the quiz when ready.\n"
-            "- Do not mention scores, rubrics, or evaluation steps in your feedback.\n"
-            "At the end, in a new line, write: SCORE: 1.0 if the answer is correct or mostly correct, or SCORE: 0.0 if not. If the input is a question or exploration, write SCORE: X (where X is the last valid score for this question, or 0.0 if not available).\n"
+            f"Question: {parts['question']}\n"
+            f"Context: {parts['context']}\n"
+            f"Retrieved Knowledgebase Chunks:\n{parts['chunks']}\n"
+            f"{kb_blob_line}"
+            f"Marking Rubric: {parts['rubric']}\n"
+            f"Student's Input: {parts['answer']}\n"
+            + parts['instructions']
         )
-        eval_llm = get_groq_llm()
-        response = eval_llm.invoke([{"role": "system", "content": prompt}]).content.strip()
+        return prompt
+
+    def _evaluation(self, answer, question):
+        # Generator: yields visible feedback text as the LLM streams it and
+        # returns (relevant, score, feedback) once the SCORE line has arrived.
+        prompt = self._evaluation_prompt(answer, question)
+        chunks = llm_stream(self.llm, [{"role": "system", "content": prompt}], priority=INTERACTIVE)
+        response = (yield from _visible_feedback(chunks)).strip()
         lines = response.splitlines()
         score = 0.0
         for line in reversed(lines):
@@ -218,13 +336,31 @@ class QuizAgent:
         feedback = "\n".join([l for l in lines if not l.strip().startswith("SCORE:")]).strip()
         return True, score, feedback
 
+    def stream_evaluation(self, answer, question):
+        """ResponseStream of feedback text; .value is (relevant, score, feedback)
+        once iterated to the end."""
+        return ResponseStream(self._evaluation(answer, question))
+
+    def evaluate_answer(self, answer, question):
+        return self.stream_evaluation(answer, question).consume().value
+
     def handle_input(self, user_input, chat_history):
+        turn = self.handle_input_stream(user_input, chat_history).consume()
+        return turn.text, turn.value
+
+    def handle_input_stream(self, user_input, chat_history):
+        """Like handle_input, but returns a ResponseStream: iterate it to receive the
+        reply as it is generated, then read .text (full reply) and .value (end flag)."""
+        return ResponseStream(self._turn(user_input, chat_history))
+
+    def _turn(self, user_input, chat_history):
         user_clean = user_input.strip().lower()
         # End quiz if user wants to quit/exit/stop/finish at any time
         if user_clean in ["quit", "exit", "stop", "finish"]:
             self.performance["started"] = False
             self.save_performance()
-            return "Thank you for participating! Please complete the post-quiz survey below.", "qualtrics2"
+            yield "Thank you for participating! Please complete the post-quiz survey below."
+            return "qualtrics2"
 
         # Give instructions and first question if not started
         if not self.performance["started"]:
@@ -233,12 +369,14 @@ class QuizAgent:
             self.save_performance()
             q = self.quiz_data[self.current_q]
             # Only return the first question, not instructions again
-            return self.present_question(q), False
+            yield self.present_question(q)
+            return False
 
         # If all questions are done
         if self.current_q >= len(self.quiz_data):
             self.save_performance()
-            return "🎉 You've completed all questions! Type 'quit' to finish or review your answers.", False
+            yield "🎉 You've completed all questions! Type 'quit' to finish or review your answers."
+            return False
 
         q = self.quiz_data[self.current_q]
         q_id = str(q["id"])
@@ -256,21 +394,34 @@ class QuizAgent:
                     self.current_q = len(self.quiz_data)
                     self.performance["current_q"] = self.current_q
                     self.save_performance()
-                    return "🎉 You've completed all questions! Please complete the post-quiz survey below.", "qualtrics2"
+                    yield "🎉 You've completed all questions! Please complete the post-quiz survey below."
+                    return "qualtrics2"
                 self.current_q += 1
                 self.performance["current_q"] = self.current_q
                 self.save_performance()
                 if self.current_q < len(self.quiz_data):
-                    return self.present_question(self.quiz_data[self.current_q]), False
+                    yield self.present_question(self.quiz_data[self.current_q])
+                    return False
                 else:
-                    return "🎉 You've completed all questions! Please complete the post-quiz survey below.", "qualtrics2"
+                    yield "🎉 You've completed all questions! Please complete the post-quiz survey below."
+                    return "qualtrics2"
             else:
                 # Do NOT advance, must retry
-                return "You need to attempt the question and receive a score of at least 0.5 before moving on.", False
+                yield "You need to attempt the question and receive a score of at least 0.5 before moving on."
+                return False
         # Check if the input is an answer (simple heuristic: not a question, not empty)
         is_question = user_input.strip().endswith("?") or user_input.strip().lower().startswith(("how", "why", "what", "can", "does", "do", "is", "are", "could", "would", "should"))
         if user_input.strip() and not is_question:
-            relevant, score, feedback = self.evaluate_answer(user_input, q)
+            # The auto-advance replies below put text before the feedback that depends
+            # on the score, so only the usual "Keep going!" reply is streamed.
+            may_advance = user_clean in ["next", "continue"]
+            evaluation = self.stream_evaluation(user_input, q)
+            if may_advance:
+                evaluation.consume()
+            else:
+                yield "Keep going! "
+                yield from evaluation
+            relevant, score, feedback = evaluation.value
             # Store the attempt
             attempts = self.performance["answers"].setdefault(q_id, [])
             attempts.append({
@@ -315,22 +466,27 @@ class QuizAgent:
                 self.performance["current_q"] = self.current_q
                 self.save_performance()
                 response += "\n\n" + self.present_question(self.quiz_data[self.current_q])
-                return response, False
+                yield response
+                return False
             elif is_sufficiently_correct and user_clean in ["next", "continue"] and self.current_q == len(self.quiz_data) - 1:
                 encouragement = "🌟 Great job! " if correctness_percentage > 95 else "👍 Well done! "
                 response = f"{encouragement}{feedback}\n\n🎉 You've completed all questions! Please complete the post-quiz survey below."
                 self.current_q += 1
                 self.performance["current_q"] = self.current_q
                 self.save_performance()
-                return response, "qualtrics2"
+                yield response
+                return "qualtrics2"
             else:
                 # Encourage and guide for another attempt
-                return (
-                    f"Keep going! {feedback}\n\nTry again, or type 'next' to move on or 'quit' to exit."
-                , False)
+                if may_advance:
+                    yield f"Keep going! {feedback}"
+                yield "\n\nTry again, or type 'next' to move on or 'quit' to exit."
+                return False
         # If the input is a question or exploration, answer but do NOT advance
         if is_question:
-            relevant, score, feedback = self.evaluate_answer(user_input, q)
+            evaluation = self.stream_evaluation(user_input, q)
+            yield from evaluation
+            relevant, score, feedback = evaluation.value
             # Store the attempt as an exploration
             attempts = self.performance["answers"].setdefault(q_id, [])
             attempts.append({
@@ -341,16 +497,41 @@ class QuizAgent:
                 "exploration": True
             })
             self.save_performance()
-            return (
-                f"{feedback}\n\nWhen you're ready, you can try answering the quiz question or type 'next' to move on."
-            , False)
+            yield "\n\nWhen you're ready, you can try answering the quiz question or type 'next' to move on."
+            return False
         # If user types quit/exit/stop/finish at any time
         if user_clean in ["quit", "exit", "stop", "finish"]:
             self.performance["started"] = False
             self.save_performance()
-            return "Thank you for participating! Please complete the post-quiz survey below.", "qualtrics2"
+            yield "Thank you for participating! Please complete the post-quiz survey below."
+            return "qualtrics2"
         else:
             # If not an answer, respond as a tutor
-            return (
-                "If you have a question about the quiz, let me know! Otherwise, please type your answer to the current question."
-            , False)
\ No newline at end of file
+            yield ("If you have a question about the quiz, let me know! Otherwise, please type your answer to the current question.")
+            return False
+
+
+# ── Per-session agent registry ─────────────────────────────────────────
+# One QuizAgent per (student, subject, week), kept in a session-scoped mapping
+# (st.session_state) so performance state and the LLM client survive reruns.
+
+def _session_key(student_id, subject, week):
+    return f"quiz_agent:{student_id}:{subject}:{week}"
+
+
+def get_session_agent(registry, quiz_data, subject, week, student_id, profile=None):
+    """Return the session's QuizAgent, creating it on first use."""
+    key = _session_key(student_id, subject, week)
+    agent = registry.get(key)
+    if agent is None:
+        agent = QuizAgent(quiz_data, subject, week, student_id, profile or {})
+        registry[key] = agent
+    else:
+        agent.quiz_data = quiz_data          # pick up teacher edits to the quiz
+        agent.refresh_if_stale()
+    return agent
+
+
+def drop_session_agent(registry, subject, week, student_id):
+    """Forget the cached agent, e.g. after progress was reset in Firestore."""
+    registry.pop(_session_key(student_id, subject, week), None)
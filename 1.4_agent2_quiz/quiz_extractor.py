@@ -2,7 +2,7 @@
 # ─────────────────────────────────────────────────────────────────────────
 """
 PDF → (question, context, answer-rubric) extractor
-↳ OCR fallback now uses unstructured.partition.pdf with strategy="ocr_only".
+↳ pages without a text layer are OCR'd in parallel (pdf_pages, strategy="ocr_only").
 
 Returned list item:
 {
@@ -14,19 +14,35 @@ Returned list item:
 """
 
 from __future__ import annotations
-from typing import List, Dict
-import os, json, re, textwrap, shutil, warnings, copy
+from typing import Callable, Iterator, List, Dict, Optional, Sequence
+import os, json, re, textwrap, shutil, copy, threading, logging, difflib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import streamlit as st
 from llm_provider import get_llm
-
-from unstructured.partition.pdf import partition_pdf          # single import
+from llm_gateway import llm_call, BATCH
+from prompt_budget import count_tokens   # 1.3_models on sys.path
+try:
+    from .pdf_excerpts import ExcerptSelector
+    from .pdf_text_cache import pdf_text_cache
+    from .pdf_pages import iter_pages, OCR_PAGE_TEXT_THRESHOLD
+    from .kb_chunker import iter_chunks
+except ImportError:
+    from pdf_excerpts import ExcerptSelector
+    from pdf_text_cache import pdf_text_cache
+    from pdf_pages import iter_pages, OCR_PAGE_TEXT_THRESHOLD
+    from kb_chunker import iter_chunks
 
 # ── Tunables ────────────────────────────────────────────────────────────
-MAX_CHARS      = 24_000                # ≈ 7 200 tokens
+PASS1_WINDOW_TOKENS  = int(os.getenv("PASS1_WINDOW_TOKENS", "6000"))   # PDF text per Pass-1 call
+PASS1_OVERLAP_TOKENS = int(os.getenv("PASS1_OVERLAP_TOKENS", "300"))   # repeated at each window start
+PASS1_UNIT_TOKENS    = 300                # window boundaries fall between blocks of ≤ this
+MAX_CHARS            = 24_000             # _pdf_to_text() default cap (KB upload) ≈ 7 200 tokens
+PASS1_DEDUPE_RATIO   = 0.9                # questions this similar in adjacent windows' overlap are merged
 OCR_LANGUAGES  = ["eng"]            # use only English for maximum compatibility
-TEXT_THRESHOLD = 1_000                # chars – if fewer → trigger OCR
+PASS_CONCURRENCY = int(os.getenv("EXTRACTOR_CONCURRENCY", "4"))   # parallel Pass-1/2/3 workers
+PASS_RETRIES     = int(os.getenv("EXTRACTOR_RETRIES", "2"))       # extra attempts per question
 
-# ── Prompts (unchanged) ─────────────────────────────────────────────────
+# ── Prompts ─────────────────────────────────────────────────────────────
 EXTRACT_PROMPT = """\
 You are an expert teaching assistant.
 
@@ -56,47 +72,18 @@ Context: <minimal context>
 Return only the blocks, with no extra commentary.
 """
 
-# ENRICH_PROMPT = textwrap.dedent("""\
-#     ROLE
-#       • Subject-matter teaching assistant
-#       • Excellent at building marking rubrics
-
-#     TASK
-#       1. *Verify & enrich* the context so the learner sees
-#          **all variables / code / tables essential** to answer the question.
-#       2. *Create an answer rubric* – JSON **array** of
-#          {{"criterion": str, "marks": int}} items (total ≈ 10 marks).
-
-#     RETURN STRICT JSON (no markdown):
-
-#       {{
-#         "context": "<<clean enriched context>>",
-#         "answer":  [ {{ "criterion": "...", "marks": 2 }}, … ]
-#       }}
-
-#     ------------------------------------------------------------------
-#     FULL PDF TEXT (truncated) ↓
-#     {pdf_text}
-#     ------------------------------------------------------------------
-
-#     QUESTION
-#     «{question}»
-
-#     CURRENT CONTEXT
-#     «{context}»
-# """)
-
+# Pass-2: {pdf_text} is the question's PDF excerpts (pdf_excerpts), not the whole PDF.
 ENRICH_PROMPT = textwrap.dedent("""
     ROLE
       • Experienced university tutor & assessment designer
 
     TASK:
-      Review the CURRENT CONTEXT and the FULL PDF TEXT below in relation to the QUESTION.
+      Review the CURRENT CONTEXT and the PDF EXCERPTS below in relation to the QUESTION.
       • Only include code snippets that are necessary for understanding the question, such as function signatures, input/output format, or code templates that help the student get started.
       • Do NOT include full example solutions, worked code, or step-by-step answers unless the question explicitly asks for it.
       • If the PDF or context contains any sample output, expected output, or example results, ALWAYS extract and include them in the context, clearly labeled as "Sample Output:" or "Expected Output:" (use section headings).
       • Do NOT just summarize or restate the question—always include all code, variables, and all sample/expected output needed to answer, but avoid giving away the solution.
-      • If details are missing but can be found in the FULL PDF TEXT, append those details.
+      • If details are missing but can be found in the PDF EXCERPTS, append those details.
       • Otherwise, return the CURRENT CONTEXT verbatim.
       • Format the output for a student: use clear section headings (e.g., "Instructions:", "Useful Functions:", "Sample Output:", "Expected Output:"), bullet points for steps, and triple backticks for code or output blocks.
       • Do NOT output or restate the answer itself, only the information needed to answer.
@@ -105,7 +92,7 @@ ENRICH_PROMPT = textwrap.dedent("""
     CURRENT CONTEXT:
     «{context}»
 
-    FULL PDF TEXT (truncated):
+    PDF EXCERPTS (most relevant parts of the PDF):
     {pdf_text}
 
     QUESTION:
@@ -171,35 +158,82 @@ RUBRIC_PROMPT = textwrap.dedent("""\
 
 
 
+ENRICH_SYSTEM = "Return ONLY the enriched context as plain text. Do not add any preamble, conclusion, or any answer. Do NOT include any answer, solution, or worked example—just the context needed to answer the question. If the PDF contains an answer or solution, OMIT it from the context."
+RUBRIC_SYSTEM = "Return the marking rubric as plain text."
+ENRICH_KWARGS = {"temperature": 0.2}   # slightly higher temperature for more helpful completions
+
+
 # ── Helpers ────────────────────────────────────────────────────────────
 _MD_FENCE = re.compile(r"```.*?```", re.S)
 _JSON_RE  = re.compile(r"(\[.*?\]|\{.*?\})", re.S)
 
 
-def _pdf_to_text(path: str) -> str:
-    """Return ASCII-safe text, auto-switching to OCR if needed."""
-    # Pass-1: use embedded text if present
-    pages = partition_pdf(filename=path,
-                          strategy="fast",
-                          infer_table_structure=False)
-
-    embedded_txt = "\n".join(p.text for p in pages if p.text)
-
-    # If text layer is tiny → re-run with OCR
-    if len(embedded_txt) < TEXT_THRESHOLD:
-        _warn_once(
-            "No/low text layer – switching to OCR (Tesseract required).")
-        pages = partition_pdf(
-            filename=path,
-            strategy="ocr_only",
-            languages=OCR_LANGUAGES,  # updated from ocr_languages to languages, now always a list
-            infer_table_structure=True,
-        )
-        embedded_txt = "\n".join(p.text for p in pages if p.text)
+# Everything that changes partition_pdf's output – part of the cache key
+_EXTRACT_SETTINGS = {
+    "strategy": "fast",
+    "ocr_strategy": "ocr_only",
+    "ocr_languages": OCR_LANGUAGES,
+    "ocr_tables": True,
+    "page_text_threshold": OCR_PAGE_TEXT_THRESHOLD,
+}
 
-    # ASCII-clean + truncate
-    embedded_txt = re.sub(r"[^\x00-\x7F]+", " ", embedded_txt)
-    return embedded_txt[:MAX_CHARS]
+
+def _ascii(text: str) -> str:
+    return re.sub(r"[^\x00-\x7F]+", " ", text)
+
+
+def _extract_pdf(path: str) -> dict:
+    """Text layer where a page has one, OCR (page-parallel) where not (uncached)."""
+    elements, pages = [], []
+    for res in iter_pages(path, OCR_LANGUAGES):
+        page_elements = [dict(e, text=_ascii(e["text"])) for e in res.elements]
+        elements.extend(page_elements)
+        pages.append({"page": res.page, "ocr": res.ocr, "seconds": round(res.seconds, 3),
+                      "chars": sum(len(e["text"]) for e in page_elements)})
+        logging.info("PDF page %d: %s, %d chars, %.2fs", res.page,
+                     "OCR" if res.ocr else "text layer", pages[-1]["chars"], res.seconds)
+    ocr = any(p["ocr"] for p in pages)
+    if ocr:
+        _warn_once("No/low text layer on some pages – OCR used (Tesseract required).")
+    return {"text": "\n".join(e["text"] for e in elements), "ocr": ocr,
+            "elements": elements, "pages": pages}
+
+
+def _pdf_record(path: str) -> dict:
+    """Cached extraction record (text, elements, per-page timings) for *path*."""
+    return pdf_text_cache.get_or_extract(path, _EXTRACT_SETTINGS, _extract_pdf)
+
+
+def _pdf_to_text(path: str, max_chars: Optional[int] = MAX_CHARS) -> str:
+    """Return the ASCII-safe text (first *max_chars*; None → all of it),
+    OCR'ing pages that have no text layer.  Results are cached by PDF
+    content hash, so re-runs skip partition_pdf/OCR.  Pass-1 windows the
+    full record text itself."""
+    text = _pdf_record(path)["text"]
+    return text if max_chars is None else text[:max_chars]
+
+
+def _page_texts(record: dict) -> list[str]:
+    pages: Dict[int, list] = {}
+    for e in record.get("elements") or []:
+        pages.setdefault(e.get("page") or 1, []).append(e["text"])
+    if not pages:
+        return [record.get("text", "")]
+    return ["\n".join(pages[p]) for p in sorted(pages)]
+
+
+def _page_timing_summary(record: dict) -> str:
+    pages = record.get("pages") or []
+    ocr_pages = [p for p in pages if p["ocr"]]
+    if not ocr_pages:
+        return ""
+    if record.get("cached"):
+        return f"🗂️ Cached PDF text reused – OCR of {len(ocr_pages)}/{len(pages)} pages skipped"
+    slowest = max(ocr_pages, key=lambda p: p["seconds"])
+    return (f"🖨️ OCR on {len(ocr_pages)}/{len(pages)} pages: "
+            f"{sum(p['seconds'] for p in ocr_pages):.1f}s of page time "
+            f"(slowest p.{slowest['page']} {slowest['seconds']:.1f}s), "
+            f"{record.get('seconds', 0):.1f}s wall")
 
 
 def _clean_json(raw: str) -> str:
@@ -223,7 +257,7 @@ def _repair_json(raw: str) -> str:
         json.loads(raw)
         return raw  # If valid, return as is
     except json.JSONDecodeError as e:
-        st.warning(f"⚠️ Attempting to repair JSON: {e}")
+        _emit("warning", f"⚠️ Attempting to repair JSON: {e}")
         # Try basic fixes (e.g., adding missing commas)
         repaired = raw.replace("}{", "},{")  # Fix missing commas between objects
         repaired = re.sub(r",\s*}", "}", repaired)  # Remove trailing commas
@@ -239,16 +273,231 @@ def _loads(raw: str, fallback):
     try:
         return json.loads(raw)
     except Exception as e:
-        st.error(f"❌ JSON parsing error: {e}")
+        _emit("error", f"❌ JSON parsing error: {e}")
         return fallback
 
 
-_warned = False
+# Status sink of the extraction running on this thread (set by
+# iter_extracted_questions, so helpers reach an ExtractionJob's messages
+# instead of calling st.* off the script thread).
+_sink = threading.local()
+
+
+def _st_notify(level: str, msg: str) -> None:
+    getattr(st, level)(msg)
+
+
+def _emit(level: str, msg: str) -> None:
+    (getattr(_sink, "notify", None) or _st_notify)(level, msg)
+
+
 def _warn_once(msg: str) -> None:
-    global _warned
-    if not _warned:
-        warnings.warn(msg)
-        _warned = True
+    """Warn once per extraction run (once per process outside one)."""
+    warned = getattr(_sink, "warned", None)
+    if warned is None:
+        warned = _sink.warned = set()
+    if msg not in warned:
+        warned.add(msg)
+        _emit("warning", msg)
+
+
+# ── Concurrent LLM passes ──────────────────────────────────────────────
+# Pass-2 / Pass-3 make one independent LLM call per question.  run_llm_pass()
+# runs them on a thread pool; every call goes through llm_gateway at BATCH
+# priority (shared Groq RPM/TPM buckets, jittered retries on 429/5xx, and
+# student evaluations are admitted first), results come back in input
+# order, and on_progress(done, total) is called from the caller's
+# (Streamlit) thread.  run_pipeline() instead chains several passes per
+# question and yields each question as soon as its last pass is done.
+
+def _batch_call(llm, messages, invoke_kwargs: dict, retries: int) -> str:
+    """One pass call at BATCH priority; retries/back-off are the gateway's."""
+    return llm_call(llm, messages, priority=BATCH, retries=retries, **invoke_kwargs)
+
+
+def run_llm_pass(llm, jobs: Sequence[list], *, invoke_kwargs: Optional[dict] = None,
+                 max_workers: int = PASS_CONCURRENCY, retries: int = PASS_RETRIES,
+                 on_progress: Optional[Callable[[int, int], None]] = None) -> list:
+    """Invoke *llm* on every message list in *jobs* concurrently.
+
+    Returns a list aligned with *jobs*: the response text, or the exception
+    raised by the last attempt for that job.
+    """
+    results: list = [None] * len(jobs)
+    if not jobs:
+        return results
+    kwargs = invoke_kwargs or {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs))),
+                            thread_name_prefix="llm-pass") as pool:
+        futures = {pool.submit(_batch_call, llm, msgs, kwargs, retries): i
+                   for i, msgs in enumerate(jobs)}
+        for done, fut in enumerate(as_completed(futures), start=1):
+            i = futures[fut]
+            try:
+                results[i] = fut.result()
+            except Exception as e:
+                results[i] = e
+            if on_progress is not None:
+                on_progress(done, len(jobs))
+    return results
+
+
+def enrich_contexts(llm, items: Sequence[tuple], pdf_text: str, system: str = ENRICH_SYSTEM,
+                    on_progress: Optional[Callable[[int, int], None]] = None,
+                    selector: Optional[ExcerptSelector] = None) -> list:
+    """Pass-2 for (question, context) pairs → raw enriched context text (or exception).
+    Each prompt carries only the PDF excerpts relevant to its question."""
+    selector = selector or ExcerptSelector(pdf_text)
+    jobs = [_enrich_messages(q, c, selector.select(q, c), system) for q, c in items]
+    if jobs:
+        logging.info(selector.summary())
+    return run_llm_pass(llm, jobs, invoke_kwargs=ENRICH_KWARGS, on_progress=on_progress)
+
+
+def generate_rubrics(llm, items: Sequence[tuple],
+                     on_progress: Optional[Callable[[int, int], None]] = None) -> list:
+    """Pass-3 for (question, context) pairs → rubric text (or exception)."""
+    jobs = [_rubric_messages(q, c) for q, c in items]
+    return run_llm_pass(llm, jobs, on_progress=on_progress)
+
+
+def _enrich_messages(question: str, context: str, excerpts: str, system: str = ENRICH_SYSTEM) -> list:
+    return [{"role": "system", "content": system},
+            {"role": "user", "content": ENRICH_PROMPT.format(pdf_text=excerpts, question=question, context=context)}]
+
+
+def _rubric_messages(question: str, context: str) -> list:
+    return [{"role": "system", "content": RUBRIC_SYSTEM},
+            {"role": "user", "content": RUBRIC_PROMPT.format(question=question, context=context)}]
+
+
+def run_pipeline(items: Sequence, worker: Callable, max_workers: int = PASS_CONCURRENCY) -> Iterator:
+    """Run worker(item) for every item concurrently and yield the results
+    as they finish (completion order, not input order).
+
+    Each worker runs all of its item's stages back to back, so item 1 can
+    reach its last stage while item 12 is still in the first; LLM calls
+    inside workers are still rate-limited by llm_gateway.
+    """
+    if not items:
+        return
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items))),
+                            thread_name_prefix="llm-pipeline") as pool:
+        futures = [pool.submit(worker, item) for item in items]
+        for fut in as_completed(futures):
+            yield fut.result()
+
+
+# ── Windowed Pass-1 ────────────────────────────────────────────────────
+# Long PDFs are no longer cut at a fixed character count.  The text is
+# split into token-budgeted windows whose boundaries fall between pages or
+# kb_chunker blocks (headings, paragraphs, code fences); each window
+# repeats the tail of the previous one so a question straddling a
+# boundary is seen whole at least once.  Windows are extracted
+# concurrently and the questions merged in document order; only
+# questions inside the overlap of two adjacent windows are deduplicated.
+
+def split_windows(pages: Sequence[str], max_tokens: int = PASS1_WINDOW_TOKENS,
+                  overlap_tokens: int = PASS1_OVERLAP_TOKENS,
+                  count: Callable[[str], int] = count_tokens) -> list[str]:
+    units = []
+    for page in pages:
+        if page.strip():
+            units.extend((c.text, c.tokens) for c in
+                         iter_chunks(page, max_tokens=min(PASS1_UNIT_TOKENS, max_tokens), count_tokens=count))
+    windows: list[str] = []
+    cur: list = []
+    cur_tokens = 0
+    for text, tokens in units:
+        if cur and cur_tokens + tokens > max_tokens:
+            windows.append("\n\n".join(u for u, _ in cur))
+            carry, carry_tokens = [], 0
+            for u in reversed(cur):
+                if carry_tokens + u[1] > overlap_tokens:
+                    break
+                carry.insert(0, u)
+                carry_tokens += u[1]
+            if carry_tokens + tokens > max_tokens:
+                carry, carry_tokens = [], 0
+            cur, cur_tokens = carry, carry_tokens
+        cur.append((text, tokens))
+        cur_tokens += tokens
+    if cur:
+        windows.append("\n\n".join(u for u, _ in cur))
+    return windows
+
+
+def _question_key(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+
+def _window_overlap(prev: str, cur: str) -> str:
+    """Text at the start of *cur* repeated from the end of *prev* (the
+    carried units of split_windows), or "" when the windows share none."""
+    cuts = [m.start() for m in re.finditer(r"\n\n", cur)] + [len(cur)]
+    for cut in reversed(cuts):
+        if cut and prev.endswith(cur[:cut]):
+            return cur[:cut]
+    return ""
+
+
+def _similar(a: str, b: str) -> bool:
+    if a == b:
+        return True
+    m = difflib.SequenceMatcher(None, a, b)
+    return m.real_quick_ratio() >= PASS1_DEDUPE_RATIO and m.ratio() >= PASS1_DEDUPE_RATIO
+
+
+def _in_overlap(key: str, overlap_key: Optional[str]) -> bool:
+    if overlap_key is None:                     # overlap unknown – any question may repeat
+        return True
+    if not overlap_key:
+        return False
+    if key in overlap_key:
+        return True
+    m = difflib.SequenceMatcher(None, overlap_key, key, autojunk=False)
+    return m.find_longest_match(0, len(overlap_key), 0, len(key)).size >= PASS1_DEDUPE_RATIO * len(key)
+
+
+def merge_window_questions(per_window: Sequence[Optional[list]],
+                           windows: Optional[Sequence[str]] = None) -> list[dict]:
+    """Merge parsed questions from consecutive windows in document order.
+
+    Only window k's questions are matched against window k-1's (None marks
+    a failed window), and with *windows* given only those whose text lies
+    in the overlap the two windows share.  A near-identical pair is kept
+    once with the longer context; each earlier question absorbs at most
+    one later one, and questions of the same window are never merged.
+    Ids are renumbered 1..n."""
+    merged: list[dict] = []
+    prev: list[tuple] = []                      # (merged index, key) of window k-1
+    for k, questions in enumerate(per_window):
+        overlap_key = None
+        if windows is not None and k:
+            overlap_key = _question_key(_window_overlap(windows[k - 1], windows[k]))
+        candidates = [(i, key) for i, key in prev if _in_overlap(key, overlap_key)]
+        cur: list[tuple] = []
+        for q in questions or []:
+            key = _question_key(q["question"])
+            if not key:
+                continue
+            dup = None
+            if _in_overlap(key, overlap_key):
+                for n, (i, other) in enumerate(candidates):
+                    if _similar(other, key):
+                        dup = i
+                        del candidates[n]
+                        break
+            if dup is None:
+                merged.append(dict(q))
+                dup = len(merged) - 1
+            elif len(q.get("context", "")) > len(merged[dup].get("context", "")):
+                merged[dup]["context"] = q["context"]
+            cur.append((dup, key))
+        prev = cur
+    for idx, q in enumerate(merged, start=1):
+        q["id"] = idx
+    return merged
 
 
 # ── Public API ─────────────────────────────────────────────────────────
@@ -382,133 +631,206 @@ def _wrap_python_code_blocks(text: str) -> str:
     return "\n".join(result)
 
 
-def extract_questions_from_pdf(pdf_path: str) -> list[dict]:
+def _merge_enriched_context(q: dict, enriched_context: str, pdf_text: str) -> str:
+    """Clean Pass-2 output and merge it with the question's original context."""
+    cleaned_context = clean_enriched_context(enriched_context)
+    # Remove any lines that look like an answer (e.g., start with 'Answer:', 'Solution:', 'Worked Example:', or are long and not code)
+    # BUT: Never remove lines labeled as 'Sample Output', 'Expected Output', or similar (these must be shown to students)
+    # Improved: Avoid context repetition and always include the original context at the top if not present
+    cleaned_context_lines = []
+    seen_lines = set()
+    # Always start with the original context if not empty
+    orig_context = q.get("context", "").strip()
+    if orig_context:
+        for line in orig_context.splitlines():
+            l = line.strip()
+            if l and l not in seen_lines:
+                cleaned_context_lines.append(l)
+                seen_lines.add(l)
+    # Now add enriched lines, skipping duplicates and unwanted lines
+    for line in cleaned_context.splitlines():
+        lstr = line.strip().lower()
+        l = line.strip()
+        if not l or l in seen_lines:
+            continue
+        if lstr.startswith(("answer:", "solution:", "worked example:")):
+            continue  # skip these
+        if lstr.startswith(("the answer is", "in summary", "to solve this", "therefore", "thus", "correct answer", "final answer")):
+            continue  # skip these
+        if len(l.split()) > 8 and not any(x in l for x in ["=", ":", "print", "input", "for ", "while ", "if ", "def ", "class "]):
+            continue  # skip likely answer sentences
+        cleaned_context_lines.append(line)
+        seen_lines.add(l)
+    cleaned_context = "\n".join(cleaned_context_lines)
+    # If context is still too short, try to extract relevant lines from PDF
+    if len(cleaned_context) < 40:
+        q_text = q["question"][:40]
+        pdf_lines = pdf_text.splitlines()
+        relevant_lines = [line for line in pdf_lines if q_text.split()[0] in line or any(x in line for x in ["=", "print", ":", "+", "input", "output", "Sample Output", "Expected Output"])]
+        for line in relevant_lines[:6]:
+            l = line.strip()
+            if l and l not in seen_lines:
+                cleaned_context += "\n" + line
+                seen_lines.add(l)
+    return cleaned_context.strip()
+
+
+def iter_extracted_questions(pdf_path: str,
+                             notify: Callable[[str, str], None] = _st_notify,
+                             on_total: Optional[Callable[[int], None]] = None) -> Iterator[dict]:
     """
-    Extract questions, enrich context, and generate rubrics from a PDF using the LLM.
+    Extract questions from a PDF, then stream them through Pass-2 (enrich
+    context) → Pass-3 (rubric) independently; each finished question is
+    yielded as soon as its rubric is ready, in completion order.
+
+    notify(level, msg) receives the status messages ("write", "info",
+    "success", "warning", "error"); the default shows them with st.*, pass
+    another sink when iterating off the Streamlit script thread.  Helper
+    messages (OCR fallback, JSON repair) go to the same sink.
+    on_total(n) is called once Pass-1 knows the number of questions.
     """
-    llm = get_llm()
-
-    # Use partition_pdf to extract text from the PDF
+    prev = getattr(_sink, "notify", None), getattr(_sink, "warned", None)
+    _sink.notify, _sink.warned = notify, set()
     try:
-        pdf_text = _pdf_to_text(pdf_path)  # Use the helper function to extract text
-    except Exception as e:
-        st.error(f"Error extracting text from PDF: {e}")
-        return []
+        yield from _iter_extracted_questions(pdf_path, notify, on_total)
+    finally:
+        _sink.notify, _sink.warned = prev
+
 
-    st.write(f"✂️ Characters sent to LLM (per call): {len(pdf_text):,}")
+def _iter_extracted_questions(pdf_path: str, notify: Callable[[str, str], None],
+                              on_total: Optional[Callable[[int], None]]) -> Iterator[dict]:
+    llm = get_llm()
 
-    # Pass-1: Extract questions
+    # Use partition_pdf to extract text from the PDF
     try:
-        response = llm.invoke(
-            [
-                {"role": "system", "content": EXTRACT_PROMPT},
-                {"role": "user", "content": pdf_text},
-            ]
-        ).content
+        record = _pdf_record(pdf_path)
+        pdf_text = record["text"]
     except Exception as e:
-        st.error(f"Error invoking LLM for question extraction: {e}")
-        return []
-
-    questions = parse_extracted_questions(response)
+        notify("error", f"Error extracting text from PDF: {e}")
+        return
+    ocr_report = _page_timing_summary(record)
+    if ocr_report:
+        notify("write", ocr_report)
+
+    windows = split_windows(_page_texts(record))
+    if not windows:
+        notify("warning", "No text could be extracted from the PDF.")
+        return
+    notify("write", f"✂️ Pass-1: {len(pdf_text):,} characters in {len(windows)} window(s) "
+                    f"of ≤ {PASS1_WINDOW_TOKENS:,} tokens")
+
+    # Pass-1: Extract questions (one call per window, concurrent)
+    responses = run_llm_pass(llm, [[{"role": "system", "content": EXTRACT_PROMPT},
+                                    {"role": "user", "content": w}] for w in windows])
+    failed = [r for r in responses if isinstance(r, Exception)]
+    if len(failed) == len(windows):
+        notify("error", f"Error invoking LLM for question extraction: {failed[0]}")
+        return
+    for i, r in enumerate(responses, start=1):
+        if isinstance(r, Exception):
+            notify("warning", f"⚠️ Pass-1 failed for window {i}/{len(windows)}: {r}")
+    questions = merge_window_questions([None if isinstance(r, Exception) else parse_extracted_questions(r)
+                                        for r in responses], windows)
     if not questions:
-        # Fallback: synthesize questions from instruction-only PDFs
-        st.info("No explicit questions detected. Attempting to synthesize quiz questions from instructions…")
-        try:
-            fallback_resp = llm.invoke(
-                [
-                    {"role": "system", "content": FALLBACK_SYNTH_PROMPT},
-                    {"role": "user", "content": pdf_text},
-                ]
-            ).content
-            questions = parse_extracted_questions(fallback_resp)
-        except Exception as e:
-            st.error(f"Fallback synthesis failed: {e}")
-            return []
+        # Fallback: synthesize questions from instruction-only PDFs, window by window
+        notify("info", "No explicit questions detected. Attempting to synthesize quiz questions from instructions…")
+        responses = run_llm_pass(llm, [[{"role": "system", "content": FALLBACK_SYNTH_PROMPT},
+                                        {"role": "user", "content": w}] for w in windows])
+        failed = [r for r in responses if isinstance(r, Exception)]
+        if len(failed) == len(windows):
+            notify("error", f"Fallback synthesis failed: {failed[0]}")
+            return
+        questions = merge_window_questions([None if isinstance(r, Exception) else parse_extracted_questions(r)
+                                            for r in responses], windows)
         if not questions:
-            st.warning("No questions could be synthesized from the PDF. Please verify the document contains assessable material.")
-            return []
-
-    st.success(f"✅ Pass-1: extracted {len(questions)} questions")
+            notify("warning", "No questions could be synthesized from the PDF. Please verify the document contains assessable material.")
+            return
 
-    # Pass-2: Enrich context
-    enriched_questions = []
     for idx, q in enumerate(questions, start=1):
         q.setdefault("id", idx)  # Ensure every question has an ID
+    notify("success", f"✅ Pass-1: extracted {len(questions)} questions")
+    if on_total is not None:
+        on_total(len(questions))
+    selector = ExcerptSelector(pdf_text)       # Pass-2 sends per-question excerpts, not the whole PDF
+
+    def process(q: dict):
+        # Runs on a pool thread: no st.* here, problems are returned with the question
+        problems = []
         try:
-            enrich_prompt = ENRICH_PROMPT.format(
-                pdf_text=pdf_text,
-                question=q["question"],
-                context=q["context"],
-            )
-            enriched_context = llm.invoke(
-                [
-                    {"role": "system", "content": "Return ONLY the enriched context as plain text. Do not add any preamble, conclusion, or any answer. Do NOT include any answer, solution, or worked example—just the context needed to answer the question. If the PDF contains an answer or solution, OMIT it from the context."},
-                    {"role": "user", "content": enrich_prompt},
-                ],
-                temperature=0.2  # Slightly higher for more helpful completions
-            ).content
-            cleaned_context = clean_enriched_context(enriched_context)
-            # Remove any lines that look like an answer (e.g., start with 'Answer:', 'Solution:', 'Worked Example:', or are long and not code)
-            # BUT: Never remove lines labeled as 'Sample Output', 'Expected Output', or similar (these must be shown to students)
-            # Improved: Avoid context repetition and always include the original context at the top if not present
-            cleaned_context_lines = []
-            seen_lines = set()
-            # Always start with the original context if not empty
-            orig_context = q.get("context", "").strip()
-            if orig_context:
-                for line in orig_context.splitlines():
-                    l = line.strip()
-                    if l and l not in seen_lines:
-                        cleaned_context_lines.append(l)
-                        seen_lines.add(l)
-            # Now add enriched lines, skipping duplicates and unwanted lines
-            for line in cleaned_context.splitlines():
-                lstr = line.strip().lower()
-                l = line.strip()
-                if not l or l in seen_lines:
-                    continue
-                if lstr.startswith(("answer:", "solution:", "worked example:")):
-                    continue  # skip these
-                if lstr.startswith(("the answer is", "in summary", "to solve this", "therefore", "thus", "correct answer", "final answer")):
-                    continue  # skip these
-                if len(l.split()) > 8 and not any(x in l for x in ["=", ":", "print", "input", "for ", "while ", "if ", "def ", "class "]):
-                    continue  # skip likely answer sentences
-                cleaned_context_lines.append(line)
-                seen_lines.add(l)
-            cleaned_context = "\n".join(cleaned_context_lines)
-            # If context is still too short, try to extract relevant lines from PDF
-            if len(cleaned_context) < 40:
-                q_text = q["question"][:40]
-                pdf_lines = pdf_text.splitlines()
-                relevant_lines = [line for line in pdf_lines if q_text.split()[0] in line or any(x in line for x in ["=", "print", ":", "+", "input", "output", "Sample Output", "Expected Output"])]
-                for line in relevant_lines[:6]:
-                    l = line.strip()
-                    if l and l not in seen_lines:
-                        cleaned_context += "\n" + line
-                        seen_lines.add(l)
-            q["context"] = cleaned_context.strip()
-            enriched_questions.append(q)
+            excerpts = selector.select(q["question"], q["context"])
+            enriched = _batch_call(llm, _enrich_messages(q["question"], q["context"], excerpts),
+                                   ENRICH_KWARGS, PASS_RETRIES)
+            q["context"] = _merge_enriched_context(q, enriched, pdf_text)
         except Exception as e:
-            st.warning(f"⚠️ Error enriching context for Q{idx}: {e}")
-            enriched_questions.append(q)  # Add the question without enrichment
-    st.success("✅ Pass-2: context enriched")
-
-    # Pass-3: Generate rubrics
-    for q in enriched_questions:
+            problems.append(f"⚠️ Error enriching context for Q{q['id']}: {e}")  # rubric from Pass-1 context
         try:
-            rubric_prompt = RUBRIC_PROMPT.format(
-                question=q["question"],
-                context=q["context"],
-            )
-            rubric_response = llm.invoke(
-                [
-                    {"role": "system", "content": "Return the marking rubric as plain text."},
-                    {"role": "user", "content": rubric_prompt},
-                ]
-            ).content
-            q["answer"] = rubric_response.strip()
+            q["answer"] = _batch_call(llm, _rubric_messages(q["question"], q["context"]),
+                                      {}, PASS_RETRIES).strip()
         except Exception as e:
-            st.warning(f"⚠️ Error generating rubric for Q{q['id']}: {e}")
+            problems.append(f"⚠️ Error generating rubric for Q{q['id']}: {e}")
             q["answer"] = "Rubric generation failed."
-    st.success("✅ Pass-3: rubrics generated")
-    return enriched_questions
+        return q, problems
+
+    for q, problems in run_pipeline(questions, process):
+        for msg in problems:
+            notify("warning", msg)
+        yield q
+    notify("info", selector.summary())
+
+
+def extract_questions_from_pdf(pdf_path: str) -> list[dict]:
+    """
+    Extract questions, enrich context, and generate rubrics from a PDF using the LLM.
+    Blocking wrapper around iter_extracted_questions(); returns questions in id order.
+    """
+    total = [0]
+    progress = st.progress(0.0, text="Pass-2/3: enriching contexts and generating rubrics…")
+    questions = []
+    for q in iter_extracted_questions(pdf_path, on_total=lambda n: total.__setitem__(0, n)):
+        questions.append(q)
+        progress.progress(len(questions) / total[0])
+    progress.empty()
+    if questions:
+        st.success("✅ Pass-2/3: contexts enriched and rubrics generated")
+    return sorted(questions, key=lambda q: q["id"])
+
+
+class ExtractionJob:
+    """
+    iter_extracted_questions() on a background thread, so the teacher page
+    can show (and edit) finished questions while the rest are processed.
+    The page polls snapshot() on each rerun.
+    """
+
+    def __init__(self, pdf_path: str):
+        self.pdf_path = pdf_path
+        self.total: Optional[int] = None
+        self.done = False
+        self.error: Optional[Exception] = None
+        self._questions: Dict[int, dict] = {}
+        self._messages: List[tuple] = []
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="quiz-extract", daemon=True)
+        self._thread.start()
+
+    def _notify(self, level: str, msg: str) -> None:
+        with self._lock:
+            self._messages.append((level, msg))
+
+    def _set_total(self, n: int) -> None:
+        self.total = n
+
+    def _run(self) -> None:
+        try:
+            for q in iter_extracted_questions(self.pdf_path, notify=self._notify, on_total=self._set_total):
+                with self._lock:
+                    self._questions[q["id"]] = q
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+
+    def snapshot(self) -> tuple:
+        """(finished questions in id order, status messages so far)."""
+        with self._lock:
+            return [self._questions[k] for k in sorted(self._questions)], list(self._messages)
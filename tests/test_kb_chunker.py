@@ -0,0 +1,45 @@
+"""iter_chunks(): heading-only and all-caps content is never dropped."""
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "1.4_agent2_quiz"))
+
+from kb_chunker import iter_chunks  # noqa: E402
+
+
+def words(text):
+    return len(text.split())
+
+
+def chunks(text, max_tokens=50):
+    return [c.text for c in iter_chunks(text, max_tokens=max_tokens, count_tokens=words)]
+
+
+def test_heading_only_document_is_kept():
+    assert chunks("LAB 3 NETWORK SCANNING") == ["LAB 3 NETWORK SCANNING"]
+
+
+def test_all_caps_command_listing_is_a_paragraph():
+    text = "SELECT * FROM USERS;\nDROP TABLE X;\nNMAP -SS -P 22"
+    assert chunks(text) == [text]
+
+
+def test_trailing_heading_is_kept():
+    out = chunks("INTRODUCTION\n\nSome body text here.\n\nFINAL NOTES")
+    assert out == ["INTRODUCTION\n\nSome body text here.", "FINAL NOTES"]
+
+
+def test_headings_over_budget_are_emitted():
+    text = "\n\n".join(f"PART {n} OVERVIEW" for n in "ABCDEF")
+    out = chunks(text, max_tokens=7)
+    assert "\n\n".join(out) == text
+    assert all(words(c) <= 7 for c in out)
+
+
+def test_heading_leads_oversized_block():
+    body = " ".join(f"w{i}." for i in range(30))
+    out = chunks(f"## Next\n\n{body}", max_tokens=12)
+    assert out[0].startswith("## Next\n\nw0.")
+    assert all(words(c) <= 12 for c in out)
@@ -0,0 +1,62 @@
+"""merge_window_questions(): dedupe only across adjacent windows' overlap."""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+for folder in ("1.3_models", "1.2_back_end", "1.4_agent2_quiz"):
+    sys.path.insert(0, str(ROOT / folder))
+
+pytest.importorskip("streamlit")
+pytest.importorskip("unstructured")
+pytest.importorskip("langchain_groq")
+qe = pytest.importorskip("quiz_extractor")
+
+SAME = "What is the output of the following code?"
+
+
+def q(question, context):
+    return {"id": 0, "question": question, "context": context}
+
+
+def test_same_window_repeats_are_kept():
+    window = [q(SAME, "print(1 + 1)"), q(SAME, "print('a' * 3)")]
+    merged = qe.merge_window_questions([window])
+    assert [m["context"] for m in merged] == ["print(1 + 1)", "print('a' * 3)"]
+    assert [m["id"] for m in merged] == [1, 2]
+
+
+def test_overlap_duplicate_is_merged_with_longer_context():
+    w1 = "Intro\n\nQ1. Define a list.\n\nQ2. What is the output of the following code?"
+    w2 = "Q2. What is the output of the following code?\n\nprint(len('abc'))\n\nQ3. Explain tuples."
+    per_window = [[q("Define a list.", "lists"), q(SAME, "")],
+                  [q(SAME, "print(len('abc'))"), q("Explain tuples.", "tuples")]]
+    merged = qe.merge_window_questions(per_window, [w1, w2])
+    assert [m["question"] for m in merged] == ["Define a list.", SAME, "Explain tuples."]
+    assert merged[1]["context"] == "print(len('abc'))"
+
+
+def test_repeated_wording_outside_overlap_is_kept():
+    w1 = "Q1. What is the output of the following code?\n\nprint(1)\n\nShared tail."
+    w2 = "Shared tail.\n\nQ9. What is the output of the following code?\n\nprint(2)"
+    per_window = [[q(SAME, "print(1)")], [q(SAME, "print(2)")]]
+    merged = qe.merge_window_questions(per_window, [w1, w2])
+    assert [m["context"] for m in merged] == ["print(1)", "print(2)"]
+
+
+def test_only_adjacent_windows_are_compared():
+    per_window = [[q(SAME, "print(1)")], [q("Explain tuples.", "")], [q(SAME, "print(2)")]]
+    assert len(qe.merge_window_questions(per_window)) == 3
+
+
+def test_failed_window_breaks_adjacency():
+    per_window = [[q(SAME, "print(1)")], None, [q(SAME, "print(1)")]]
+    assert len(qe.merge_window_questions(per_window)) == 2
+
+
+def test_one_later_question_per_earlier_one():
+    per_window = [[q(SAME, "print(1)")], [q(SAME, "print(1)"), q(SAME, "print(2)")]]
+    merged = qe.merge_window_questions(per_window)
+    assert [m["context"] for m in merged] == ["print(1)", "print(2)"]